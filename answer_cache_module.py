@@ -0,0 +1,166 @@
+"""
+NearPulse — кэш ответов AI-аналитика на общие вопросы.
+
+"Что думаешь о рынке NEAR?", "как работает стейкинг HOT?" не зависят от
+кошелька, и одинаковый ответ можно отдать всем за миллисекунды вместо
+повторного вызова модели. Вопрос кэшируется, только если:
+
+  • это первый ход разговора: в истории из запроса (до trim_history) нет
+    ни одной реплики — продолжение зависит от истории;
+  • в нём нет ссылок на собственный кошелёк (мой, портфель, баланс, адрес
+    *.near, ...) — см. PERSONAL_MARKERS.
+
+Такие вопросы модель получает без данных кошелька (api.parse_chat_request),
+поэтому ответ можно отдать другому пользователю.
+
+Поиск: вопрос нормализуется (регистр, ё→е, пунктуация и эмодзи — прочь) и
+раскладывается в множество символьных триграмм; ответ берётся у самого
+похожего сохранённого вопроса, если сходство Жаккара ≥ AI_ANSWER_SIMILARITY.
+Точное совпадение нормализованного текста ищется и в Redis (общий кэш
+воркеров), похожие — в памяти процесса (до AI_ANSWER_CACHE_SIZE вопросов).
+
+Свежесть: ответ живёт AI_ANSWER_TTL секунд и устаревает раньше, если цена
+NEAR ушла больше чем на AI_ANSWER_PRICE_DRIFT от цены на момент ответа —
+рыночные ответы не переживают заметного движения рынка.
+
+Env:
+  AI_ANSWER_TTL          — секунд (по умолчанию 900; 0 — кэш выключен)
+  AI_ANSWER_SIMILARITY   — порог сходства 0..1 (0.8)
+  AI_ANSWER_PRICE_DRIFT  — доля изменения цены NEAR, сбрасывающая ответ (0.03)
+  AI_ANSWER_CACHE_SIZE   — вопросов в памяти процесса (500)
+"""
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from cache_module import cached, set_cache
+import metrics_module
+
+AI_ANSWER_TTL = int(os.environ.get("AI_ANSWER_TTL", 900))
+AI_ANSWER_SIMILARITY = float(os.environ.get("AI_ANSWER_SIMILARITY", 0.8))
+AI_ANSWER_PRICE_DRIFT = float(os.environ.get("AI_ANSWER_PRICE_DRIFT", 0.03))
+AI_ANSWER_CACHE_SIZE = int(os.environ.get("AI_ANSWER_CACHE_SIZE", 500))
+MAX_QUESTION_CHARS = 300  # длинные сообщения почти всегда уникальны
+
+# Слова и шаблоны, которые делают вопрос личным
+PERSONAL_MARKERS = re.compile(
+    r"\b(мо[йяеи]\w*|мне|меня|мной|у\s+меня|я|наш\w*|портфел\w*|кошел\w*|баланс\w*|"
+    r"my|mine|me|i|wallet|portfolio|balance)\b"
+    r"|[a-z0-9_\-]+\.(near|tg)\b|\b[0-9a-f]{64}\b",
+    re.IGNORECASE,
+)
+_PUNCT = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES = re.compile(r"\s+")
+
+_entries = OrderedDict()  # нормализованный вопрос → (триграммы, ответ, ts, цена NEAR)
+_lock = threading.Lock()
+
+
+def normalize(text):
+    text = text.lower().replace("ё", "е")
+    return _SPACES.sub(" ", _PUNCT.sub(" ", text)).strip()
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _has_turns(history):
+    if not isinstance(history, list):
+        return bool(history)
+    return any(isinstance(m, dict) and m.get("role") in ("user", "assistant") for m in history)
+
+
+def question_key(message, history):
+    """
+    Нормализованный вопрос, если ответ на него можно делить между
+    пользователями, иначе None. history — история из запроса как пришла,
+    до trim_history: обрезанная по бюджету (или из одних ответов ассистента)
+    история пуста, но продолжение разговора от этого общим не становится.
+    """
+    if AI_ANSWER_TTL <= 0 or _has_turns(history) or len(message) > MAX_QUESTION_CHARS:
+        return None
+    if PERSONAL_MARKERS.search(message):
+        metrics_module.ai_answer_cache("personal")
+        return None
+    question = normalize(message)
+    return question or None
+
+
+def _redis_key(question):
+    return "ai_answer:" + hashlib.blake2b(question.encode(), digest_size=12).hexdigest()
+
+
+def _current_price():
+    price = cached("near_price")
+    return price if isinstance(price, (int, float)) else 0
+
+
+def _fresh(ts, price, now_price):
+    if time.time() - ts >= AI_ANSWER_TTL:
+        return False
+    if price and now_price:
+        return abs(now_price - price) / price <= AI_ANSWER_PRICE_DRIFT
+    return True
+
+
+def _best_match(question, grams):
+    with _lock:
+        entry = _entries.get(question)
+        if entry is not None:
+            return question, entry
+        candidates = list(_entries.items())
+    best, best_score = None, AI_ANSWER_SIMILARITY
+    n = len(grams)
+    for other, entry in candidates:
+        m = len(entry[0])
+        # Жаккар не больше min/max размеров — такие пары не пересекаем
+        if min(n, m) < best_score * max(n, m):
+            continue
+        common = len(grams & entry[0])
+        score = common / (n + m - common)
+        if score >= best_score:
+            best, best_score = (other, entry), score
+    return best
+
+
+def lookup(question):
+    """Ответ из кэша или None. Пишет hit / miss / stale в метрики."""
+    now_price = _current_price()
+    grams = trigrams(question)
+    match = _best_match(question, grams)
+    if match is None:
+        shared = cached(_redis_key(question))  # ответ другого воркера на тот же вопрос
+        if shared:
+            match = (question, (grams, shared["answer"], shared["ts"], shared["price"]))
+    if match is None:
+        metrics_module.ai_answer_cache("miss")
+        return None
+    other, (_, answer, ts, price) = match
+    if not _fresh(ts, price, now_price):
+        with _lock:
+            _entries.pop(other, None)
+        metrics_module.ai_answer_cache("stale")
+        return None
+    with _lock:
+        if other in _entries:
+            _entries.move_to_end(other)
+        else:
+            _entries[other] = match[1]
+    metrics_module.ai_answer_cache("hit")
+    return answer
+
+
+def store(question, answer):
+    if not answer:
+        return
+    price, ts = _current_price(), time.time()
+    with _lock:
+        _entries[question] = (trigrams(question), answer, ts, price)
+        _entries.move_to_end(question)
+        while len(_entries) > AI_ANSWER_CACHE_SIZE:
+            _entries.popitem(last=False)
+    set_cache(_redis_key(question), {"answer": answer, "ts": ts, "price": price}, AI_ANSWER_TTL)
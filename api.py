@@ -2,21 +2,41 @@
 NearPulse Flask API — REST endpoints for Telegram Mini App.
 v2.1.0 — Fixed bugs + AI Chat Agent endpoint.
 """
+import time
+_IMPORT_T0 = time.perf_counter()  # от начала импорта api — для STARTUP
+
 import os
 import json
-import time
 import base64
+import threading
 import math
 import requests as http_requests
 from datetime import datetime, timezone
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
-from flask import Flask, jsonify, request
+from bisect import bisect_left
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 from dotenv import load_dotenv
 from datetime import datetime, timezone, timedelta
 
 load_dotenv()
 
+# ─── Startup timing ────────────────────────────────────────────────────────
+# Фазы импорта и прогрева в мс; отдаются в /api/health → "startup".
+STARTUP = {}
+_startup_mark = _IMPORT_T0
+
+
+def _startup_phase(name):
+    global _startup_mark
+    now = time.perf_counter()
+    STARTUP[f"{name}Ms"] = round((now - _startup_mark) * 1000, 1)
+    _startup_mark = now
+
+
+_startup_phase("deps")
 
 def safe_get(obj, key, default=0):
     """Return obj[key] only when obj is a dict; avoids AttributeError on null/string agg fields."""
@@ -29,7 +49,7 @@ app = Flask(__name__)
 
 # ─── CORS ─────────────────────────────────────────────────────────────────
 # BUGFIX: добавлены все возможные Netlify-домены + wildcard для локалки
-CORS(app, origins=[
+CORS_ORIGINS = [
     "https://nearpulseapp.netlify.app",
     "https://near-pulse.vercel.app",
     "https://nearpulse.netlify.app",
@@ -37,95 +57,61 @@ CORS(app, origins=[
     "http://localhost:5173",
     "http://localhost:3000",
     "http://127.0.0.1:5173",
-], supports_credentials=False)
+]
+CORS_EXPOSE_HEADERS = ["ETag", "Server-Timing", "X-Trace-Id"]
+CORS(app, origins=CORS_ORIGINS, supports_credentials=False, expose_headers=CORS_EXPOSE_HEADERS)
 
 # ─── Constants ─────────────────────────────────────────────────────────────
-NEAR_RPC_URL      = "https://rpc.mainnet.near.org"
-NEARBLOCKS_API    = "https://api.nearblocks.io/v1"
+# Базовые URL переопределяются через env — так bench/mock_upstream.py подменяет upstream
+NEAR_RPC_URL      = os.environ.get("NEAR_RPC_URL", "https://rpc.mainnet.near.org")
+NEARBLOCKS_API    = os.environ.get("NEARBLOCKS_API", "https://api.nearblocks.io/v1")
 NEARBLOCKS_API_KEY = os.environ.get("NEARBLOCKS_API_KEY", "")
-FASTNEAR_API      = "https://api.fastnear.com/v1"
-INTEAR_API        = "https://prices.intear.tech"
-COINGECKO_API     = "https://api.coingecko.com/api/v3"
-REF_FINANCE_API   = "https://indexer.ref.finance"
+FASTNEAR_API      = os.environ.get("FASTNEAR_API", "https://api.fastnear.com/v1")
+INTEAR_API        = os.environ.get("INTEAR_API", "https://prices.intear.tech")
+COINGECKO_API     = os.environ.get("COINGECKO_API", "https://api.coingecko.com/api/v3")
+REF_FINANCE_API   = os.environ.get("REF_FINANCE_API", "https://indexer.ref.finance")
 HOT_CONTRACT      = "game.hot.tg"
 YOCTO_NEAR        = 1e24
 API_TIMEOUT       = 10
 FIRESPACE_HOURS   = {0: 2, 1: 3, 2: 4, 3: 6, 4: 12, 5: 12, 6: 24}
 
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
-
-TOKEN_DECIMALS_MAP = {
-    "dac17f958d2ee523a2206206994597c13d831ec7.factory.bridge.near": 6,
-    "usdt.tether-token.near": 6,
-    "a0b86991c6218b36c1d19d4a2e9eb0ce3606eb48.factory.bridge.near": 6,
-    "17208628f84f5d6ad33f0da3bbbeb27ffcb398eac501a31bd6ad2011e36133a1": 18,
-    "wrap.near": 24,
-    "token.v2.ref-finance.near": 18,
-    "token.burrow.near": 9,
-    "meta-pool.near": 24,
-    "token.skyward.near": 18,
-    "token.pembrock.near": 18,
-    "2260fac5e5542a773aa44fbcfedf7c193bc2c599.factory.bridge.near": 8,
-    "c02aaa39b223fe8d0a0e5c4f27ead9083c756cc2.factory.bridge.near": 18,
-    "eth.bridge.near": 18,
-    "aurora": 18,
-    "token.paras.near": 18,
-    "game.hot.tg": 6,
-    "harvest-moon.near": 6,
-    "aa-harvest-moon.near": 9,
-    "token.0xshitzu.near": 18,
-    "pre.meteor-token.near": 9,
-    "meteor-points.near": 9,
-    "token.rhealab.near": 9,
-    "lst.rhealab.near": 24,
-    "token.lonkingnearbackto2024.near": 18,
-    "dd.tg": 18,
-    "benthedog.near": 18,
-    "meme-cooking.near": 18,
-}
-
-TOKEN_COINGECKO_MAP = {
-    "dac17f958d2ee523a2206206994597c13d831ec7.factory.bridge.near": "tether",
-    "usdt.tether-token.near": "tether",
-    "a0b86991c6218b36c1d19d4a2e9eb0ce3606eb48.factory.bridge.near": "usd-coin",
-    "17208628f84f5d6ad33f0da3bbbeb27ffcb398eac501a31bd6ad2011e36133a1": "dai",
-    "wrap.near": "near",
-    "token.v2.ref-finance.near": "ref-finance",
-    "token.burrow.near": "burrow",
-    "2260fac5e5542a773aa44fbcfedf7c193bc2c599.factory.bridge.near": "wrapped-bitcoin",
-    "c02aaa39b223fe8d0a0e5c4f27ead9083c756cc2.factory.bridge.near": "ethereum",
-    "eth.bridge.near": "ethereum",
-    "aurora": "aurora-near",
-    "token.paras.near": "paras",
-}
-
-MAJOR_TOKENS = [
-    "dac17f958d2ee523a2206206994597c13d831ec7.factory.bridge.near",
-    "usdt.tether-token.near",
-    "a0b86991c6218b36c1d19d4a2e9eb0ce3606eb48.factory.bridge.near",
-    "17208628f84f5d6ad33f0da3bbbeb27ffcb398eac501a31bd6ad2011e36133a1",
-    "wrap.near",
-    "2260fac5e5542a773aa44fbcfedf7c193bc2c599.factory.bridge.near",
-    "c02aaa39b223fe8d0a0e5c4f27ead9083c756cc2.factory.bridge.near",
-]
+ANTHROPIC_API_URL = os.environ.get("ANTHROPIC_API_URL", "https://api.anthropic.com")
+AI_MODEL          = "claude-sonnet-4-20250514"
+AI_MAX_SESSIONS   = int(os.environ.get("AI_MAX_SESSIONS", 8))
 
 # ─── Cache ─────────────────────────────────────────────────────────────────
-UPSTASH_REDIS_URL = os.environ.get("UPSTASH_REDIS_URL", "")
-CACHE_TTL = 300  # 5 minutes
-_redis_client = None
-_mem_cache = {}
-
-try:
-    if UPSTASH_REDIS_URL:
-        import redis as redis_lib
-        _redis_client = redis_lib.from_url(UPSTASH_REDIS_URL, decode_responses=True, socket_timeout=3)
-        _redis_client.ping()
-        print("[Cache] Upstash Redis connected")
-    else:
-        print("[Cache] No UPSTASH_REDIS_URL, using in-memory cache")
-except Exception as e:
-    print(f"[Cache] Redis connection failed ({e}), using in-memory fallback")
-    _redis_client = None
+from cache_module import (
+    CACHE_TTL, cached, cached_entries, entry_data, get_many, set_cache, set_many, cached_response, cache_response, conditional_json, register_compression, connect_redis,
+)
+from metrics_module import register_metrics
+import metrics_module
+import answer_cache_module as answer_cache
+from tracing_module import register_tracing, traced
+from profiler_module import register_profiler, profiled, profile_requested
+import upstream_module as upstream
+import token_registry_module as token_registry
+import market_module as market
+import price_history_module as price_history
+import live_module as live
+import follower_module as follower
+
+# metrics и tracing раньше compression: after_request идут в обратном
+# порядке, так что время ответа включает сжатие
+register_metrics(app)
+register_tracing(app)
+register_profiler(app)
+register_compression(app)
+upstream.register_governor(app)
+
+
+@app.before_request
+def _note_first_request():
+    if "firstRequestMs" not in STARTUP:
+        STARTUP["firstRequestMs"] = round((time.perf_counter() - _IMPORT_T0) * 1000, 1)
+
+
+_startup_phase("modules")
 
 
 def nearblocks_headers():
@@ -135,315 +121,376 @@ def nearblocks_headers():
     return headers
 
 
-def cached(key):
-    if _redis_client:
-        try:
-            raw = _redis_client.get(f"np:{key}")
-            if raw:
-                return json.loads(raw)
-        except Exception:
-            pass
-    entry = _mem_cache.get(key)
-    if entry and time.time() - entry["ts"] < CACHE_TTL:
-        return entry["data"]
-    return None
+# ─── NEAR Data Functions ───────────────────────────────────────────────────
+# Каждый источник разбит на запрос и разбор ответа (parse_*), чтобы
+# api_async.py переиспользовал тот же разбор поверх асинхронного клиента.
+def view_account_payload(address):
+    return {
+        "jsonrpc": "2.0",
+        "id": "dontcare",
+        "method": "query",
+        "params": {
+            "request_type": "view_account",
+            "finality": "final",
+            "account_id": address,
+        },
+    }
 
 
-def set_cache(key, data, ttl=CACHE_TTL):
-    _mem_cache[key] = {"data": data, "ts": time.time()}
-    if _redis_client:
-        try:
-            _redis_client.setex(f"np:{key}", ttl, json.dumps(data, default=str))
-        except Exception:
-            pass
+def parse_view_account(address, data):
+    if "error" in data:
+        return {"address": address, "near": 0}
+    amount = data["result"]["amount"]
+    near = int(amount) / YOCTO_NEAR
+    return {"address": address, "near": near}
 
 
-# ─── NEAR Data Functions ───────────────────────────────────────────────────
 def get_balance(address):
     try:
-        r = http_requests.post(
-            NEAR_RPC_URL,
-            json={
-                "jsonrpc": "2.0",
-                "id": "dontcare",
-                "method": "query",
-                "params": {
-                    "request_type": "view_account",
-                    "finality": "final",
-                    "account_id": address,
-                },
-            },
-            timeout=API_TIMEOUT,
-        )
-        data = r.json()
-        if "error" in data:
-            return {"address": address, "near": 0}
-        amount = data["result"]["amount"]
-        near = int(amount) / YOCTO_NEAR
-        return {"address": address, "near": near}
+        r = upstream.post("rpc", NEAR_RPC_URL, endpoint="view_account",
+                          json=view_account_payload(address), timeout=API_TIMEOUT)
+        return parse_view_account(address, r.json())
     except Exception as e:
         print(f"[get_balance] Error: {e}")
         return {"address": address, "near": 0}
 
 
+def parse_intear_price(data):
+    p = data.get("price") if isinstance(data, dict) else data
+    return float(p) if p is not None else 0
+
+
+def parse_coingecko_near_price(data):
+    return data.get("near", {}).get("usd", 0)
+
+
+def intear_near_price():
+    r = upstream.get(
+        "intear", f"{INTEAR_API}/get-token-price",
+        endpoint="near_price", degrade=False,
+        params={"token_id": "wrap.near"},
+        timeout=API_TIMEOUT,
+    )
+    price = parse_intear_price(r.json()) if r.status_code == 200 else 0
+    if not price:
+        raise ValueError("Intear returned no price")
+    return price
+
+
+def coingecko_near_price():
+    r = upstream.get(
+        "coingecko", f"{COINGECKO_API}/simple/price",
+        endpoint="near_price", degrade=False,
+        params={"ids": "near", "vs_currencies": "usd"},
+        timeout=API_TIMEOUT,
+    )
+    price = parse_coingecko_near_price(r.json())
+    if not price:
+        raise ValueError("CoinGecko returned no price")
+    return price
+
+
 def get_near_price():
     c = cached("near_price")
     if c is not None:
         return c
-    price = 0
-    try:
-        r = http_requests.get(
-            f"{INTEAR_API}/get-token-price",
-            params={"token_id": "wrap.near"},
-            timeout=API_TIMEOUT,
-        )
-        if r.status_code == 200:
-            data = r.json()
-            p = data.get("price") if isinstance(data, dict) else data
-            price = float(p) if p is not None else 0
-        if not price:
-            raise ValueError("Intear returned no price")
-        set_cache("near_price", price)
-        return price
-    except Exception as e:
-        print(f"[get_near_price] Intear: {e}")
     try:
-        r = http_requests.get(
-            f"{COINGECKO_API}/simple/price",
-            params={"ids": "near", "vs_currencies": "usd"},
-            timeout=API_TIMEOUT,
-        )
-        price = r.json().get("near", {}).get("usd", 0)
-        if price:
-            set_cache("near_price", price)
-        return price
+        # CoinGecko стартует, если Intear не ответил за свой p95 или упал
+        price = upstream.hedged(("intear", intear_near_price), ("coingecko", coingecko_near_price))
     except Exception as e:
-        print(f"[get_near_price] CoinGecko fallback: {e}")
-    return 0
+        print(f"[get_near_price] {e}")
+        return 0
+    set_cache("near_price", price)
+    price_history.observe("near", price)
+    return price
+
+
+def staking_deposits_url(address):
+    return f"{NEARBLOCKS_API}/kitwallet/staking-deposits/{http_requests.utils.quote(address)}"
+
+
+def parse_staking_deposits(data):
+    deposits = data if isinstance(data, list) else data.get("data", data.get("deposits", []))
+    if not isinstance(deposits, list):
+        deposits = []
+    total = 0
+    for item in deposits:
+        deposit = item.get("deposit", item.get("amount", "0"))
+        amount = int(str(deposit))
+        if amount > 0:
+            total += amount / YOCTO_NEAR
+    return total
 
 
 def get_staking_balance(address):
     try:
-        url = f"{NEARBLOCKS_API}/kitwallet/staking-deposits/{http_requests.utils.quote(address)}"
-        r = http_requests.get(url, headers=nearblocks_headers(), timeout=API_TIMEOUT)
-        data = r.json()
-        deposits = data if isinstance(data, list) else data.get("data", data.get("deposits", []))
-        if not isinstance(deposits, list):
-            deposits = []
-        total = 0
-        for item in deposits:
-            deposit = item.get("deposit", item.get("amount", "0"))
-            amount = int(str(deposit))
-            if amount > 0:
-                total += amount / YOCTO_NEAR
-        return total
+        r = upstream.get("nearblocks", staking_deposits_url(address), endpoint="staking_deposits",
+                         headers=nearblocks_headers(), timeout=API_TIMEOUT)
+        return parse_staking_deposits(r.json())
     except Exception as e:
         print(f"[get_staking_balance] Error: {e}")
         return 0
 
 
-def get_hot_claim_status(address):
-    try:
-        args_b64 = base64.b64encode(json.dumps({"account_id": address}).encode()).decode()
-        r = http_requests.post(
-            NEAR_RPC_URL,
-            json={
-                "jsonrpc": "2.0",
-                "id": "dontcare",
-                "method": "query",
-                "params": {
-                    "request_type": "call_function",
-                    "finality": "final",
-                    "account_id": HOT_CONTRACT,
-                    "method_name": "get_user",
-                    "args_base64": args_b64,
-                },
-            },
-            timeout=API_TIMEOUT,
-        )
-        data = r.json()
-        if "error" in data:
-            return None
-        result = data.get("result", {}).get("result")
-        if not result or not isinstance(result, list):
-            return None
-        json_str = bytes(result).decode("utf-8")
-        user_data = json.loads(json_str)
-        firespace = user_data.get("firespace")
-        if firespace is not None:
-            level = int(firespace)
-            storage_hours = FIRESPACE_HOURS.get(level, 24)
-        else:
-            raw = (
-                user_data.get("storage_hours")
-                or user_data.get("storage_duration")
-                or user_data.get("storage_fill_hours")
-                or user_data.get("claim_interval")
-                or user_data.get("storage")
-                or 24
-            )
-            storage_hours = int(raw) if raw else 24
-
-        max_storage_ms = storage_hours * 3600 * 1000
-        last_claim_raw = (
-            user_data.get("last_claimed_at")
-            or user_data.get("last_claim")
-            or user_data.get("claimed_at")
-            or user_data.get("updated_at")
-            or 0
+def hot_claim_payload(address):
+    args_b64 = base64.b64encode(json.dumps({"account_id": address}).encode()).decode()
+    return {
+        "jsonrpc": "2.0",
+        "id": "dontcare",
+        "method": "query",
+        "params": {
+            "request_type": "call_function",
+            "finality": "final",
+            "account_id": HOT_CONTRACT,
+            "method_name": "get_user",
+            "args_base64": args_b64,
+        },
+    }
+
+
+def parse_hot_claim(data):
+    if "error" in data:
+        return None
+    result = data.get("result", {}).get("result")
+    if not result or not isinstance(result, list):
+        return None
+    json_str = bytes(result).decode("utf-8")
+    user_data = json.loads(json_str)
+    firespace = user_data.get("firespace")
+    if firespace is not None:
+        level = int(firespace)
+        storage_hours = FIRESPACE_HOURS.get(level, 24)
+    else:
+        raw = (
+            user_data.get("storage_hours")
+            or user_data.get("storage_duration")
+            or user_data.get("storage_fill_hours")
+            or user_data.get("claim_interval")
+            or user_data.get("storage")
+            or 24
         )
-        last_claim_ms = last_claim_raw / 1e6 if last_claim_raw > 1e15 else last_claim_raw
-        next_claim_at = last_claim_ms + max_storage_ms
-        now = time.time() * 1000
+        storage_hours = int(raw) if raw else 24
+
+    max_storage_ms = storage_hours * 3600 * 1000
+    last_claim_raw = (
+        user_data.get("last_claimed_at")
+        or user_data.get("last_claim")
+        or user_data.get("claimed_at")
+        or user_data.get("updated_at")
+        or 0
+    )
+    last_claim_ms = last_claim_raw / 1e6 if last_claim_raw > 1e15 else last_claim_raw
+    next_claim_at = last_claim_ms + max_storage_ms
+    now = time.time() * 1000
 
-        if now >= next_claim_at:
-            return {"readyToClaim": True, "hoursUntilClaim": 0, "minutesUntilClaim": 0}
+    if now >= next_claim_at:
+        return {"readyToClaim": True, "hoursUntilClaim": 0, "minutesUntilClaim": 0}
 
-        diff_ms = next_claim_at - now
-        hours = int(diff_ms // 3600000)
-        minutes = int((diff_ms % 3600000) // 60000)
-        return {"readyToClaim": False, "hoursUntilClaim": hours, "minutesUntilClaim": minutes}
+    diff_ms = next_claim_at - now
+    hours = int(diff_ms // 3600000)
+    minutes = int((diff_ms % 3600000) // 60000)
+    return {"readyToClaim": False, "hoursUntilClaim": hours, "minutesUntilClaim": minutes}
+
+
+def get_hot_claim_status(address):
+    try:
+        r = upstream.post("rpc", NEAR_RPC_URL, endpoint="hot_claim",
+                          json=hot_claim_payload(address), timeout=API_TIMEOUT)
+        return parse_hot_claim(r.json())
     except Exception as e:
         print(f"[get_hot_claim_status] Error: {e}")
         return None
 
 
+def inventory_url(address):
+    return f"{NEARBLOCKS_API}/account/{address}/inventory"
+
+
+def inventory_rows(data):
+    return data.get("inventory", {}).get("fts", [])
+
+
+def parse_inventory_tokens(data, known=None):
+    """
+    Токены inventory с точными суммами: rawAmount — строка в минимальных
+    единицах, amount — float из Decimal. Метаданные — из реестра токенов
+    (known — уже разрешённые token_registry.resolve_rows()).
+    """
+    rows = inventory_rows(data)
+    if known is None:
+        known = token_registry.resolve_rows(rows)
+    result = []
+    for t in rows:
+        contract = t.get("contract", "")
+        raw = token_registry.raw_amount(t.get("amount", t.get("balance", "0")))
+        if raw <= 0:
+            continue
+        decimals, guessed = token_registry.decimals_of(known, contract, raw)
+        meta = known.get(contract.lower()) or {}
+        symbol = t.get("symbol") or meta.get("symbol")
+        if not symbol:
+            if "meme-cooking.near" in contract:
+                # e.g. "jambo-1679.meme-cooking.near" → "JAMBO"
+                symbol = contract.split("-")[0].upper()
+            else:
+                parts = contract.split(".")
+                symbol = parts[0][:10].upper() if len(parts[0]) > 15 else parts[0].upper()
+        nb_price = t.get("price") or (t.get("ft_meta") or {}).get("price") or 0
+        result.append({
+            "name": t.get("name") or meta.get("name") or symbol,
+            "symbol": symbol,
+            "contract": contract,
+            "amount": float(token_registry.to_units(raw, decimals)),
+            "rawAmount": str(raw),
+            "decimals": decimals,
+            "decimalsGuessed": guessed,
+            "icon": t.get("icon") or (t.get("ft_meta") or {}).get("icon"),
+            "nearblocks_price": float(nb_price) if nb_price else 0,
+        })
+    return result
+
+
+def get_ft_metadata(contract):
+    try:
+        r = upstream.post("rpc", NEAR_RPC_URL, endpoint="ft_metadata",
+                          json=token_registry.ft_metadata_payload(contract), timeout=API_TIMEOUT)
+        return token_registry.parse_ft_metadata(contract, r.json())
+    except Exception as e:
+        print(f"[ft_metadata] {contract}: {e}")
+        return None
+
+
+def resolve_token_metadata(rows):
+    """Реестр для строк inventory; decimals, которых нет нигде, — из ft_metadata контрактов."""
+    known = token_registry.resolve_rows(rows)
+    missing = token_registry.missing_decimals(known)
+    if missing:
+        with ThreadPoolExecutor(max_workers=len(missing), thread_name_prefix="ft-meta") as pool:
+            token_registry.apply_ft_metadata(known, missing, list(pool.map(get_ft_metadata, missing)))
+    return known
+
+
 def get_all_tokens(address):
     try:
-        url = f"{NEARBLOCKS_API}/account/{address}/inventory"
-        r = http_requests.get(url, headers=nearblocks_headers(), timeout=API_TIMEOUT)
-        tokens = r.json().get("inventory", {}).get("fts", [])
-        result = []
-        for t in tokens:
-            contract = t.get("contract", "")
-            raw_amount = float(t.get("amount", t.get("balance", "0")))
-            decimals = (
-                TOKEN_DECIMALS_MAP.get(contract)
-                or TOKEN_DECIMALS_MAP.get(contract.lower())
-                or (t.get("ft_meta") or {}).get("decimals")
-                or t.get("decimals")
-            )
-            if not decimals:
-                decimals = 18 if raw_amount > 1e15 else 0
-            decimals = int(decimals)
-            normalized = raw_amount / (10 ** decimals) if decimals > 0 else raw_amount
-            symbol = t.get("symbol") or (t.get("ft_meta") or {}).get("symbol")
-            if not symbol:
-                if "meme-cooking.near" in contract:
-                    # e.g. "jambo-1679.meme-cooking.near" → "JAMBO"
-                    symbol = contract.split("-")[0].upper()
-                else:
-                    parts = contract.split(".")
-                    symbol = parts[0][:10].upper() if len(parts[0]) > 15 else parts[0].upper()
-            nb_price = t.get("price") or (t.get("ft_meta") or {}).get("price") or 0
-            result.append({
-                "name": t.get("name") or (t.get("ft_meta") or {}).get("name") or symbol,
-                "symbol": symbol,
-                "contract": contract,
-                "amount": normalized,
-                "decimals": decimals,
-                "icon": t.get("icon") or (t.get("ft_meta") or {}).get("icon"),
-                "nearblocks_price": float(nb_price) if nb_price else 0,
-            })
-        return [t for t in result if t["amount"] > 0]
+        r = upstream.get("nearblocks", inventory_url(address), endpoint="inventory",
+                         headers=nearblocks_headers(), timeout=API_TIMEOUT)
+        data = r.json()
+        return parse_inventory_tokens(data, resolve_token_metadata(inventory_rows(data)))
     except Exception as e:
         print(f"[get_all_tokens] Error: {e}")
         return []
 
 
+def coingecko_ids(contracts):
+    contract_to_id = {}
+    for c in contracts:
+        gid = token_registry.coingecko_id(c)
+        if gid:
+            contract_to_id[c] = gid
+    return contract_to_id
+
+
+def parse_coingecko_prices(data, contract_to_id):
+    prices = {}
+    for c, gid in contract_to_id.items():
+        p = (data.get(gid) or {}).get("usd")
+        if p and isinstance(p, (int, float)):
+            prices[c] = p
+            prices[c.lower()] = p
+    return prices
+
+
 def get_coingecko_prices(contracts):
     try:
-        contract_to_id = {}
-        ids = set()
-        for c in contracts:
-            gid = TOKEN_COINGECKO_MAP.get(c.lower())
-            if gid:
-                contract_to_id[c] = gid
-                ids.add(gid)
-        if not ids:
+        contract_to_id = coingecko_ids(contracts)
+        if not contract_to_id:
             return {}
-        r = http_requests.get(
-            f"{COINGECKO_API}/simple/price",
-            params={"ids": ",".join(ids), "vs_currencies": "usd"},
+        r = upstream.get(
+            "coingecko", f"{COINGECKO_API}/simple/price",
+            endpoint="token_prices",
+            params={"ids": ",".join(set(contract_to_id.values())), "vs_currencies": "usd"},
             timeout=API_TIMEOUT,
         )
-        data = r.json()
-        prices = {}
-        for c, gid in contract_to_id.items():
-            p = (data.get(gid) or {}).get("usd")
-            if p and isinstance(p, (int, float)):
-                prices[c] = p
-                prices[c.lower()] = p
-        return prices
+        return parse_coingecko_prices(r.json(), contract_to_id)
     except Exception as e:
         print(f"[coingecko] Error: {e}")
         return {}
 
 
+def parse_ref_finance_prices(ref_prices, contracts):
+    ref_prices = ref_prices or {}
+    prices = {}
+    for c in contracts:
+        for variant in [c, c.lower()]:
+            p = ref_prices.get(variant)
+            if p:
+                pnum = float(p) if isinstance(p, (str, int, float)) else float(p.get("price", 0))
+                if pnum > 0:
+                    prices[c] = pnum
+                    prices[c.lower()] = pnum
+                    break
+    return prices
+
+
 def get_ref_finance_prices(contracts):
     try:
-        r = http_requests.get(f"{REF_FINANCE_API}/list-token-price", timeout=API_TIMEOUT)
-        ref_prices = r.json() or {}
-        prices = {}
-        for c in contracts:
-            for variant in [c, c.lower()]:
-                p = ref_prices.get(variant)
-                if p:
-                    pnum = float(p) if isinstance(p, (str, int, float)) else float(p.get("price", 0))
-                    if pnum > 0:
-                        prices[c] = pnum
-                        prices[c.lower()] = pnum
-                        break
-        return prices
+        r = upstream.get("ref", f"{REF_FINANCE_API}/list-token-price", endpoint="token_prices", timeout=API_TIMEOUT)
+        return parse_ref_finance_prices(r.json(), contracts)
     except Exception as e:
         print(f"[ref_finance] Error: {e}")
         return {}
 
 
+def parse_intear_prices(intear_data, contracts):
+    intear_data = intear_data or {}
+    prices = {}
+    for c in contracts:
+        for variant in [c, c.lower()]:
+            p = intear_data.get(variant)
+            if p is None:
+                continue
+            pnum = float(p.get("price", 0)) if isinstance(p, dict) else float(p)
+            if pnum > 0:
+                prices[c] = pnum
+                prices[c.lower()] = pnum
+                break
+    return prices
+
+
 def get_intear_prices(contracts):
     try:
-        r = http_requests.get(f"{INTEAR_API}/list-token-price", timeout=API_TIMEOUT)
-        intear_data = r.json() or {}
-        prices = {}
-        for c in contracts:
-            for variant in [c, c.lower()]:
-                p = intear_data.get(variant)
-                if p is None:
-                    continue
-                pnum = float(p.get("price", 0)) if isinstance(p, dict) else float(p)
-                if pnum > 0:
-                    prices[c] = pnum
-                    prices[c.lower()] = pnum
-                    break
-        return prices
+        r = upstream.get("intear", f"{INTEAR_API}/list-token-price", endpoint="token_prices", timeout=API_TIMEOUT)
+        return parse_intear_prices(r.json(), contracts)
     except Exception as e:
         print(f"[intear] Error: {e}")
         return {}
 
 
+def priced_tokens(tokens):
+    """Токены, для которых нужны цены (HOT считается отдельно)."""
+    return [t for t in tokens if t["contract"].lower() != "game.hot.tg"]
+
+
+@traced()
 def get_tokens_with_prices(address, min_usd=0.01):
-    tokens = get_all_tokens(address)
-    tokens = [t for t in tokens if t["contract"].lower() != "game.hot.tg"]
+    tokens = priced_tokens(get_all_tokens(address))
     if not tokens:
         return {"major": [], "filtered": [], "hidden": []}
     contracts = [t["contract"] for t in tokens]
     intear_prices = get_intear_prices(contracts)
     ref_prices = get_ref_finance_prices(contracts)
     cg_prices = get_coingecko_prices(contracts)
-    SPAM_SYMBOL_KEYWORDS   = {"http", "www", ".com", ".org", ".io", "lottery", "reward"}
-    SPAM_NAME_KEYWORDS     = {"http", "www", "to claim", "lottery", "you won"}
-    SPAM_CONTRACT_PATTERNS = {"laboratory.jumpfinance.near"}
-
-    def _is_spam(token):
-        sym  = (token.get("symbol") or "").lower()
-        name = (token.get("name")   or "").lower()
-        c    = (token.get("contract") or "").lower()
-        if any(k in sym  for k in SPAM_SYMBOL_KEYWORDS):   return True
-        if any(k in name for k in SPAM_NAME_KEYWORDS):     return True
-        if any(p in c    for p in SPAM_CONTRACT_PATTERNS): return True
-        return False
+    return classify_tokens(tokens, intear_prices, ref_prices, cg_prices, min_usd)
+
 
-    results = []
+@traced()
+def classify_tokens(tokens, intear_prices, ref_prices, cg_prices, min_usd=0.01):
+    """
+    Один линейный проход: цена, USD-стоимость и (major, spam) из индекса
+    token_registry.classify() → major / filtered / hidden. Major, не
+    прошедшие фильтр, не попадают никуда (как и раньше).
+    """
+    major, filtered, hidden = [], [], []
     for t in tokens:
         c = t["contract"]
         price = (
@@ -456,33 +503,39 @@ def get_tokens_with_prices(address, min_usd=0.01):
             or t["nearblocks_price"]
             or 0
         )
-        usd_value = t["amount"] * price
-        is_major  = c.lower() in [m.lower() for m in MAJOR_TOKENS]
-        is_spam   = _is_spam(t)
-        results.append({**t, "price": price, "usdValue": usd_value, "isMajor": is_major, "isSpam": is_spam})
-
-    major = sorted(
-        [t for t in results if t["isMajor"] and not t["isSpam"] and t["price"] > 0 and t["usdValue"] >= min_usd],
-        key=lambda x: -x["usdValue"],
-    )
-    others = [t for t in results if not t["isMajor"]]
-    filtered = sorted(
-        [t for t in others if not t["isSpam"] and t["price"] > 0 and t["usdValue"] >= min_usd],
-        key=lambda x: -x["usdValue"],
-    )
-    hidden = [t for t in others if t not in filtered]
+        usd_value = 0.0
+        if price:
+            units = token_registry.to_units(int(t["rawAmount"]), t["decimals"]) if "rawAmount" in t else Decimal(str(t["amount"]))
+            usd_value = float(units * Decimal(str(price)))
+        is_major, is_spam = token_registry.classify(c, t.get("symbol"), t.get("name"))
+        row = {**t, "price": price, "usdValue": usd_value, "isMajor": is_major, "isSpam": is_spam}
+        visible = not is_spam and price > 0 and usd_value >= min_usd
+        if is_major:
+            if visible:
+                major.append(row)
+        elif visible:
+            filtered.append(row)
+        else:
+            hidden.append(row)
+    major.sort(key=lambda x: -x["usdValue"])
+    filtered.sort(key=lambda x: -x["usdValue"])
     return {"major": major, "filtered": filtered, "hidden": hidden}
 
 
+def parse_token_balance(data, token_id="game.hot.tg"):
+    token = next((t for t in inventory_rows(data) if t.get("contract") == token_id), None)
+    if token:
+        raw = token_registry.raw_amount(token.get("amount", 0))
+        decimals, _ = token_registry.decimals_of({}, token_id, raw)
+        return float(token_registry.to_units(raw, decimals))
+    return 0
+
+
 def get_token_balance(address, token_id="game.hot.tg"):
     try:
-        url = f"{NEARBLOCKS_API}/account/{address}/inventory"
-        r = http_requests.get(url, headers=nearblocks_headers(), timeout=API_TIMEOUT)
-        fts = r.json().get("inventory", {}).get("fts", [])
-        token = next((t for t in fts if t.get("contract") == token_id), None)
-        if token:
-            return float(token.get("amount", 0)) / 1e6
-        return 0
+        r = upstream.get("nearblocks", inventory_url(address), endpoint="inventory",
+                         headers=nearblocks_headers(), timeout=API_TIMEOUT)
+        return parse_token_balance(r.json(), token_id)
     except Exception as e:
         print(f"[get_token_balance] Error: {e}")
         return 0
@@ -492,7 +545,7 @@ def get_token_balance(address, token_id="game.hot.tg"):
 def get_user_nfts(account_id):
     try:
         url = f"{FASTNEAR_API}/account/{account_id}/nft"
-        r = http_requests.get(url, timeout=API_TIMEOUT)
+        r = upstream.get("fastnear", url, endpoint="nft", timeout=API_TIMEOUT)
         if r.status_code != 200:
             print(f"[FastNEAR NFT] status {r.status_code}")
             return []
@@ -524,14 +577,25 @@ def get_user_nfts(account_id):
 
 
 # ─── Transaction Analysis ──────────────────────────────────────────────────
+TXNS_PARAMS = {"per_page": 50, "order": "desc"}
+
+
+def txns_url(address):
+    return f"{NEARBLOCKS_API}/account/{address}/txns"
+
+
+def parse_transaction_history(data):
+    txns = data.get("txns", [])
+    if isinstance(txns, dict):
+        txns = list(txns.values())
+    return txns if isinstance(txns, list) else []
+
+
 def get_transaction_history(address):
     try:
-        url = f"{NEARBLOCKS_API}/account/{address}/txns"
-        r = http_requests.get(url, params={"per_page": 50, "order": "desc"}, headers=nearblocks_headers(), timeout=API_TIMEOUT)
-        txns = r.json().get("txns", [])
-        if isinstance(txns, dict):
-            txns = list(txns.values())
-        return txns if isinstance(txns, list) else []
+        r = upstream.get("nearblocks", txns_url(address), endpoint="txns",
+                         params=TXNS_PARAMS, headers=nearblocks_headers(), timeout=API_TIMEOUT)
+        return parse_transaction_history(r.json())
     except Exception as e:
         print(f"[get_transaction_history] Error: {e}")
         return []
@@ -721,6 +785,27 @@ def analyze_transaction_group(tx_group, user_address):
     }
 
 
+@traced()
+def analyze_transactions(txns, account_id):
+    """Группирует сырые txns по хэшу и прогоняет analyze_transaction_group."""
+    grouped = defaultdict(list)
+    for tx in txns:
+        h = tx.get("transaction_hash", "")
+        if h:
+            grouped[h].append(tx)
+    analyzed = []
+    for tx_hash, tx_group in grouped.items():
+        try:
+            result = analyze_transaction_group(tx_group, account_id)
+            if result:
+                analyzed.append(result)
+        except Exception as e:
+            print(f"[skip tx] {tx_hash}: {e}")
+            continue
+    return analyzed
+
+
+@traced()
 def compute_analytics(grouped_txs, near_price):
     total_txs = len(grouped_txs)
     total_gas = sum(tx.get("gas", 0) for tx in grouped_txs)
@@ -838,8 +923,7 @@ def compute_analytics(grouped_txs, near_price):
 
 
 # ─── AI Chat ───────────────────────────────────────────────────────────────
-def build_ai_system_prompt(wallet_context=None):
-    base = """Ты — NearPulse AI, персональный аналитик NEAR Protocol и криптовалютного рынка.
+AI_SYSTEM_PROMPT = """Ты — NearPulse AI, персональный аналитик NEAR Protocol и криптовалютного рынка.
 
 Твои возможности:
 • Анализ рынка NEAR, криптовалют и DeFi экосистемы
@@ -857,38 +941,143 @@ def build_ai_system_prompt(wallet_context=None):
 
 Контекст платформы: NearPulse — аналитический инструмент для NEAR Protocol кошельков."""
 
-    if wallet_context:
-        near = wallet_context.get("near", 0)
-        staking = wallet_context.get("staking", 0)
-        hot = wallet_context.get("hot", 0)
-        near_price = wallet_context.get("nearPrice", 0)
-        total_usd = wallet_context.get("totalUSD", 0)
-        address = wallet_context.get("address", "")
-
-        tokens_info = ""
-        tokens = wallet_context.get("tokens", {})
-        all_tokens = tokens.get("major", []) + tokens.get("filtered", [])
-        if all_tokens:
-            top_tokens = all_tokens[:5]
-            tokens_info = "\nОсновные токены: " + ", ".join(
-                f"{t['symbol']} ({t['amount']:.2f}, ${t.get('usdValue', 0):.2f})" 
-                for t in top_tokens
-            )
+AI_HISTORY_TOKENS = int(os.environ.get("AI_HISTORY_TOKENS", 2000))
+AI_CONTEXT_TOKENS = 5   # токенов портфеля в контексте
+AI_CONTEXT_TXNS   = 8   # последних операций в контексте
+
 
-        base += f"""
+def wallet_context_from_cache(account_id):
+    """
+    Контекст кошелька из кэша ответов balance / stats / txns — того, что
+    webapp уже загрузил для этого аккаунта; один MGET. None — в кэше пусто.
+    """
+    data = get_many((f"balance:{account_id}", f"stats:{account_id}", f"txns:{account_id}"))
+    balance, stats, txns = data[f"balance:{account_id}"], data[f"stats:{account_id}"], data[f"txns:{account_id}"]
+    if not (balance or stats or txns):
+        return None
+    context = dict(balance or {"address": account_id})
+    if stats:
+        context["stats"] = stats
+    if txns:
+        context["transactions"] = txns.get("transactions", [])
+    return context
 
-━━━ ДАННЫЕ КОШЕЛЬКА ПОЛЬЗОВАТЕЛЯ ━━━
+
+def _tx_date(tx):
+    try:
+        return datetime.fromtimestamp(int(tx.get("timestamp", 0)) / 1e9, tz=timezone.utc).strftime("%Y-%m-%d")
+    except (TypeError, ValueError, OverflowError):
+        return "?"
+
+
+def format_wallet_context(wallet_context):
+    """
+    Блок данных кошелька. Без относительного времени ("2ч назад") и в
+    постоянном порядке — между ходами разговора текст не меняется, и
+    префикс system остаётся в кэше промпта у провайдера.
+    """
+    near = wallet_context.get("near", 0)
+    staking = wallet_context.get("staking", 0)
+    hot = wallet_context.get("hot", 0)
+    near_price = wallet_context.get("nearPrice", 0)
+    total_usd = wallet_context.get("totalUSD", 0)
+    address = wallet_context.get("address", "")
+
+    tokens_info = ""
+    tokens = wallet_context.get("tokens") or {}
+    all_tokens = tokens.get("major", []) + tokens.get("filtered", [])
+    if all_tokens:
+        top_tokens = all_tokens[:AI_CONTEXT_TOKENS]
+        tokens_info = "\nОсновные токены: " + ", ".join(
+            f"{t['symbol']} ({t['amount']:.2f}, ${t.get('usdValue', 0):.2f})" 
+            for t in top_tokens
+        )
+
+    activity_info = ""
+    stats = wallet_context.get("stats")
+    if stats:
+        breakdown = ", ".join(f"{k} {v.get('count', 0)}" for k, v in sorted((stats.get("breakdown") or {}).items()))
+        activity_info = (
+            f"\nАктивность: {stats.get('totalTxs', 0)} транзакций, газ {stats.get('gasSpent', 0)} NEAR "
+            f"(${stats.get('gasUSD', 0)}), чаще всего — {stats.get('mostActive') or '—'}"
+            + (f"\nПо категориям: {breakdown}" if breakdown else "")
+        )
+    recent = wallet_context.get("transactions")
+    if recent:
+        activity_info += "\nПоследние операции:\n" + "\n".join(
+            f"• {_tx_date(tx)} {tx.get('action') or tx.get('type')} — {tx.get('protocol', '')}"
+            for tx in recent[:AI_CONTEXT_TXNS]
+        )
+
+    return f"""━━━ ДАННЫЕ КОШЕЛЬКА ПОЛЬЗОВАТЕЛЯ ━━━
 Адрес: {address}
 NEAR баланс: {near:.4f} NEAR (${near * near_price:.2f})
 В стейкинге: {staking:.4f} NEAR
 HOT токены: {hot:.2f}
 Цена NEAR: ${near_price:.4f}
-Общая стоимость портфеля: ${total_usd:.2f}{tokens_info}
+Общая стоимость портфеля: ${total_usd:.2f}{tokens_info}{activity_info}
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 Используй эти данные для персонализированных ответов."""
 
-    return base
+
+def build_ai_system_prompt(wallet_context=None):
+    """
+    System-блоки для Messages API. Статичный промпт идёт первым и одинаков
+    для всех запросов; cache_control на каждом блоке — точки кэширования
+    префикса: статичная часть общая для всех, с данными кошелька — для
+    разговора одного пользователя.
+    """
+    blocks = [{"type": "text", "text": AI_SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+    if wallet_context:
+        blocks.append({"type": "text", "text": format_wallet_context(wallet_context),
+                       "cache_control": {"type": "ephemeral"}})
+    return blocks
+
+
+def estimate_tokens(text):
+    """Грубая оценка токенов: ~3 символа на токен (кириллица дороже латиницы)."""
+    return len(text) // 3 + 1
+
+
+def trim_history(history, budget=AI_HISTORY_TOKENS):
+    """
+    Самые свежие сообщения истории, укладывающиеся в budget токенов.
+    Первым должен идти user — ведущие ответы ассистента отбрасываются.
+    """
+    kept, used = [], 0
+    for message in reversed(history):
+        if not isinstance(message, dict) or message.get("role") not in ("user", "assistant"):
+            continue
+        content = message.get("content")
+        if not isinstance(content, str) or not content:
+            continue
+        used += estimate_tokens(content)
+        if used > budget:
+            break
+        kept.append({"role": message["role"], "content": content})
+    kept.reverse()
+    while kept and kept[0]["role"] != "user":
+        kept.pop(0)
+    return kept
+
+
+def anthropic_request(messages, system_prompt, max_tokens=800, stream=False):
+    """(headers, payload) для POST {ANTHROPIC_API_URL}/v1/messages."""
+    headers = {
+        "x-api-key": ANTHROPIC_API_KEY,
+        "anthropic-version": "2023-06-01",
+        "content-type": "application/json",
+    }
+    payload = {
+        "model": AI_MODEL,
+        "max_tokens": max_tokens,
+        "system": system_prompt,
+        "messages": messages,
+    }
+    if stream:
+        payload["stream"] = True
+    return headers, payload
 
 
 def call_anthropic_api(messages, system_prompt, max_tokens=800):
@@ -897,19 +1086,10 @@ def call_anthropic_api(messages, system_prompt, max_tokens=800):
         return None, "ANTHROPIC_API_KEY не настроен на сервере"
     
     try:
-        headers = {
-            "x-api-key": ANTHROPIC_API_KEY,
-            "anthropic-version": "2023-06-01",
-            "content-type": "application/json",
-        }
-        payload = {
-            "model": "claude-sonnet-4-20250514",
-            "max_tokens": max_tokens,
-            "system": system_prompt,
-            "messages": messages,
-        }
-        r = http_requests.post(
-            "https://api.anthropic.com/v1/messages",
+        headers, payload = anthropic_request(messages, system_prompt, max_tokens)
+        r = upstream.post(
+            "anthropic", f"{ANTHROPIC_API_URL}/v1/messages",
+            endpoint="messages",
             headers=headers,
             json=payload,
             timeout=30,
@@ -928,43 +1108,265 @@ def call_anthropic_api(messages, system_prompt, max_tokens=800):
         return None, str(e)
 
 
+# ─── AI streaming ──────────────────────────────────────────────────────────
+# Одновременных разговоров с моделью (обычных и потоковых) не больше
+# AI_MAX_SESSIONS на процесс: каждый держит поток gunicorn (или соединение
+# event loop) до 30 с, и без лимита несколько чатов выедают весь пул.
+# Сверх лимита — сразу 503 с Retry-After, без очереди.
+_ai_sessions = threading.BoundedSemaphore(AI_MAX_SESSIONS)
+
+
+def acquire_ai_session(mode):
+    if not _ai_sessions.acquire(blocking=False):
+        metrics_module.ai_rejected(mode)
+        return False
+    metrics_module.ai_session(mode, 1)
+    return True
+
+
+def release_ai_session(mode):
+    metrics_module.ai_session(mode, -1)
+    _ai_sessions.release()
+
+
+def ai_busy_response():
+    resp = jsonify({"error": "AI analyst is busy, try again in a few seconds"})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "5"
+    return resp
+
+
+def parse_chat_request(body):
+    """
+    Тело /api/ai/chat → (messages, system-блоки, question). question —
+    ключ answer_cache для общего вопроса (тогда модель не получает данных
+    кошелька, и ответ можно отдать другим), иначе None. ValueError — пустой запрос.
+    """
+    if not body:
+        raise ValueError("Empty request body")
+    user_message = body.get("message", "").strip()
+    if not user_message:
+        raise ValueError("Message is required")
+    raw_history = body.get("history") or []
+    # общий ли вопрос — по истории до обрезки: продолжение не становится первым ходом
+    question = answer_cache.question_key(user_message, raw_history)
+    # История — по бюджету токенов, а не фиксированные 10 сообщений
+    history = trim_history(raw_history)
+    messages = history + [{"role": "user", "content": user_message}]
+    if question:
+        return messages, build_ai_system_prompt(None), question
+    # accountId — контекст собирается из кэша на сервере; walletContext от клиента — запасной
+    account_id = body.get("accountId")
+    wallet_context = wallet_context_from_cache(account_id) if isinstance(account_id, str) and account_id else None
+    return messages, build_ai_system_prompt(wallet_context or body.get("walletContext")), None
+
+
+def sse_event(data, event=None):
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def parse_anthropic_line(line):
+    """
+    Строка SSE-потока Anthropic → ("text", str) | ("stop", reason) |
+    ("done", None) | ("error", message) | None (ping, служебные события).
+    """
+    if not line.startswith("data:"):
+        return None
+    try:
+        event = json.loads(line[5:])
+    except ValueError:
+        return None
+    kind = event.get("type")
+    if kind == "content_block_delta":
+        delta = event.get("delta") or {}
+        if delta.get("type") == "text_delta":
+            return "text", delta.get("text", "")
+    elif kind == "message_delta":
+        return "stop", (event.get("delta") or {}).get("stop_reason")
+    elif kind == "message_stop":
+        return "done", None
+    elif kind == "error":
+        return "error", (event.get("error") or {}).get("message", "model error")
+    return None
+
+
+class ChatRelay:
+    """События parse_anthropic_line → наши SSE-строки; done — ответ закончен."""
+
+    def __init__(self):
+        self.stop_reason = None
+        self.done = False
+        self.complete = False  # дошли до message_stop — ответ целиком в text()
+        self.parts = []
+
+    def feed(self, kind, value):
+        if kind == "text":
+            if not value:
+                return None
+            self.parts.append(value)
+            return sse_event({"text": value})
+        if kind == "stop":
+            self.stop_reason = value
+            return None
+        self.done = True
+        if kind == "done":
+            self.complete = True
+            return sse_event({"model": "claude-sonnet-4", "stopReason": self.stop_reason}, "done")
+        return sse_event({"error": value}, "error")
+
+    def text(self):
+        return "".join(self.parts).strip()
+
+    def end(self):
+        """Поток модели кончился без message_stop."""
+        return None if self.done else sse_event({"error": "stream ended early"}, "error")
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def cached_answer_events(answer):
+    """Ответ из answer_cache в формате потока: один фрагмент и done."""
+    return [sse_event({"text": answer}),
+            sse_event({"model": "claude-sonnet-4", "stopReason": "end_turn", "cached": True}, "done")]
+
+
 # ─── API Endpoints ─────────────────────────────────────────────────────────
+def build_balance_result(account_id, balance, staking, hot, hot_claim, near_price, tokens):
+    for category in ["major", "filtered", "hidden"]:
+        for t in tokens.get(category, []):
+            if t.get("icon") and len(str(t["icon"])) > 200:
+                t["icon"] = None
+    return {
+        "address": account_id,
+        "near": round(balance["near"], 4),
+        "staking": round(staking, 4),
+        "hot": round(hot, 2),
+        "hotClaim": hot_claim,
+        "nearPrice": near_price,
+        "totalUSD": round(
+            (balance["near"] + staking) * near_price
+            + sum(t.get("usdValue", 0) for t in tokens.get("major", []) + tokens.get("filtered", [])),
+            2,
+        ) if near_price else round(
+            sum(t.get("usdValue", 0) for t in tokens.get("major", []) + tokens.get("filtered", [])),
+            2,
+        ),
+        "tokens": tokens,
+    }
+
+
+def tx_sort_key(tx):
+    """[-timestamp, id]: по возрастанию — от новых к старым. block_timestamp бывает строкой."""
+    try:
+        ts = int(tx.get("timestamp") or 0)
+    except (TypeError, ValueError):
+        ts = 0
+    return [-ts, tx.get("id") or ""]
+
+
+def encode_tx_cursor(sort_key):
+    """Непрозрачный курсор: самая новая транзакция, которая уже есть у клиента."""
+    return base64.urlsafe_b64encode(json.dumps(list(sort_key)).encode()).decode().rstrip("=")
+
+
+def decode_tx_cursor(cursor):
+    """Курсор → ключ сортировки; ValueError — битый курсор."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        neg_ts, tx_id = json.loads(raw)
+        return [int(neg_ts), str(tx_id)]
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def build_transactions_index(analyzed, near_price):
+    """
+    Весь разобранный список (от новых к старым) + ключи сортировки — то, что
+    лежит в txns_all:<account>. Ключи — списки, а не кортежи: после JSON из
+    Redis они сравниваются так же, как до записи.
+    """
+    keyed = sorted(((tx_sort_key(tx), tx) for tx in analyzed), key=lambda p: p[0])
+    return {
+        "transactions": [tx for _, tx in keyed],
+        "sortKeys": [key for key, _ in keyed],
+        "nearPrice": near_price,
+    }
+
+
+def build_transactions_result(index, limit):
+    keys = index["sortKeys"]
+    return {
+        "transactions": index["transactions"][:limit],
+        "nearPrice": index["nearPrice"],
+        "total": len(keys),
+        "cursor": encode_tx_cursor(keys[0]) if keys else None,
+    }
+
+
+def build_transactions_delta(index, cursor, limit):
+    """
+    ?since=<cursor>: только транзакции новее курсора (бинпоиск по ключам
+    индекса) и новый курсор. reset: true — у клиента дыра: курсор старше
+    всего закэшированного списка или новых больше limit; тогда в ответе
+    обычный top-limit, и клиент заменяет им свой список.
+    """
+    since = decode_tx_cursor(cursor)
+    keys = index["sortKeys"]
+    start = bisect_left(keys, since)
+    if start > limit or (keys and since > keys[-1]):
+        return {**build_transactions_result(index, limit), "reset": True}
+    return {
+        "transactions": index["transactions"][:start],
+        "nearPrice": index["nearPrice"],
+        "cursor": encode_tx_cursor(keys[0]) if start else cursor,
+        "reset": False,
+    }
+
+
+def build_stats_result(analyzed, near_price):
+    stats = compute_analytics(analyzed, near_price)
+    stats["nearPrice"] = near_price
+    return stats
+
+
+def fetch_balance_result(account_id):
+    balance = get_balance(account_id)
+    staking = get_staking_balance(account_id)
+    hot = get_token_balance(account_id)
+    hot_claim = get_hot_claim_status(account_id)
+    near_price = get_near_price()
+    tokens = get_tokens_with_prices(account_id)
+    return build_balance_result(account_id, balance, staking, hot, hot_claim, near_price, tokens)
+
+
+def fetch_transaction_index(account_id):
+    """Разобранная история → индекс в txns_all: (для ?since=) и его копия в ответ."""
+    txns = get_transaction_history(account_id)
+    near_price = get_near_price()
+    index = build_transactions_index(analyze_transactions(txns, account_id), near_price)
+    set_cache(f"txns_all:{account_id}", index, follower.ttl(CACHE_TTL))
+    return index
+
+
+def transaction_index(account_id):
+    return cached(f"txns_all:{account_id}") or fetch_transaction_index(account_id)
+
+
+def fetch_transactions_result(account_id, limit=20):
+    return build_transactions_result(fetch_transaction_index(account_id), limit)
+
+
 @app.route("/api/balance/<account_id>")
+@profiled
 def api_balance(account_id):
     cache_key = f"balance:{account_id}"
-    c = cached(cache_key)
-    if c:
-        return jsonify(c)
+    resp = None if profile_requested() else cached_response(cache_key, prefetch=("near_price",))
+    if resp:
+        return resp
     try:
-        balance = get_balance(account_id)
-        staking = get_staking_balance(account_id)
-        hot = get_token_balance(account_id)
-        hot_claim = get_hot_claim_status(account_id)
-        near_price = get_near_price()
-        tokens = get_tokens_with_prices(account_id)
-        for category in ["major", "filtered", "hidden"]:
-            for t in tokens.get(category, []):
-                if t.get("icon") and len(str(t["icon"])) > 200:
-                    t["icon"] = None
-        result = {
-            "address": account_id,
-            "near": round(balance["near"], 4),
-            "staking": round(staking, 4),
-            "hot": round(hot, 2),
-            "hotClaim": hot_claim,
-            "nearPrice": near_price,
-            "totalUSD": round(
-                (balance["near"] + staking) * near_price
-                + sum(t.get("usdValue", 0) for t in tokens.get("major", []) + tokens.get("filtered", [])),
-                2,
-            ) if near_price else round(
-                sum(t.get("usdValue", 0) for t in tokens.get("major", []) + tokens.get("filtered", [])),
-                2,
-            ),
-            "tokens": tokens,
-        }
-        set_cache(cache_key, result)
-        return jsonify(result)
+        return cache_response(cache_key, fetch_balance_result(account_id))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -972,69 +1374,38 @@ def api_balance(account_id):
 @app.route("/api/transactions/<account_id>")
 def api_transactions(account_id):
     cache_key = f"txns:{account_id}"
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 50)
+    since = request.args.get("since")
+    if since:
+        # дельта из txns_all: — ответ зависит от курсора, общий кэш ответов не нужен
+        try:
+            return conditional_json(build_transactions_delta(transaction_index(account_id), since, limit), 0)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
     if not request.args.get("_") and not request.args.get("nocache"):
-        c = cached(cache_key)
-        if c:
-            return jsonify(c)
+        resp = cached_response(cache_key, prefetch=("near_price",))
+        if resp:
+            return resp
     try:
-        limit = request.args.get("limit", 20, type=int)
-        limit = min(max(limit, 1), 50)
-        txns = get_transaction_history(account_id)
-        near_price = get_near_price()
-        grouped = defaultdict(list)
-        for tx in txns:
-            h = tx.get("transaction_hash", "")
-            if h:
-                grouped[h].append(tx)
-        analyzed = []
-        for tx_hash, tx_group in grouped.items():
-            try:
-                result = analyze_transaction_group(tx_group, account_id)
-                if result:
-                    analyzed.append(result)
-            except Exception as e:
-                print(f"[skip tx] {tx_hash}: {e}")
-                continue
-        analyzed.sort(key=lambda x: x.get("timestamp", 0), reverse=True)
-        transactions = analyzed[:limit]
-        result = {
-            "transactions": transactions,
-            "nearPrice": near_price,
-            "total": len(analyzed),
-        }
-        set_cache(cache_key, result)
-        return jsonify(result)
+        return cache_response(cache_key, fetch_transactions_result(account_id, limit), follower.ttl(CACHE_TTL))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/stats/<account_id>")
+@profiled
 def api_stats(account_id):
     cache_key = f"stats:{account_id}"
-    c = cached(cache_key)
-    if c:
-        return jsonify(c)
+    resp = None if profile_requested() else cached_response(cache_key, prefetch=("near_price",))
+    if resp:
+        return resp
     try:
         txns = get_transaction_history(account_id)
         near_price = get_near_price()
-        grouped = defaultdict(list)
-        for tx in txns:
-            h = tx.get("transaction_hash", "")
-            if h:
-                grouped[h].append(tx)
-        analyzed = []
-        for tx_hash, tx_group in grouped.items():
-            try:
-                result = analyze_transaction_group(tx_group, account_id)
-                if result:
-                    analyzed.append(result)
-            except Exception as e:
-                print(f"[skip tx] {tx_hash}: {e}")
-                continue
-        stats = compute_analytics(analyzed, near_price)
-        stats["nearPrice"] = near_price
-        set_cache(cache_key, stats)
-        return jsonify(stats)
+        analyzed = analyze_transactions(txns, account_id)
+        return cache_response(cache_key, build_stats_result(analyzed, near_price))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1046,6 +1417,75 @@ def get_analytics(account_id):
     return api_stats(account_id)
 
 
+# ─── Live updates ──────────────────────────────────────────────────────────
+def live_refresh(account_id, since):
+    """
+    Обновление аккаунта для live_module → (balance, txns). Записи кэша,
+    сделанные после since (прошлого обновления хаба) — запросом клиента или
+    хабом другого воркера, — берутся как есть; остальное — из upstream и
+    сразу в кэш, так что REST-запрос подписчика после события отвечается из кэша.
+    TTL — как у REST-маршрутов: txns: (и txns_all: внутри fetch) — follower.ttl().
+    """
+    keys = {"balance": f"balance:{account_id}", "txns": f"txns:{account_id}"}
+    fetch = {"balance": fetch_balance_result, "txns": fetch_transactions_result}
+    ttls = {"balance": CACHE_TTL, "txns": follower.ttl(CACHE_TTL)}
+    entries = cached_entries(keys.values())
+    out, fresh = {}, {}
+    for name, key in keys.items():
+        entry = entries[key]
+        if entry and entry["ts"] > since:
+            out[name] = entry_data(entry)
+        else:
+            out[name] = fetch[name](account_id)
+            fresh.setdefault(ttls[name], {})[key] = out[name]
+    for ttl, items in fresh.items():
+        set_many(items, ttl)
+    return out["balance"], out["txns"]
+
+
+live.configure(live_refresh)
+# активность в сети (follower_module) — внеочередное обновление подписчикам
+follower.on_touch(lambda accounts, keys: live.touch(accounts))
+
+
+def live_busy_response():
+    resp = jsonify({"error": "Too many live streams, try again later"})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "30"
+    return resp
+
+
+@app.route("/api/live")
+def api_live():
+    """
+    Подписка на изменения аккаунтов: /api/live?accounts=a.near,b.near →
+    text/event-stream (события — см. live_module). Во Flask поток держит
+    поток gunicorn, поэтому их не больше LIVE_SYNC_STREAMS; под uvicorn
+    маршрут обслуживает api_async без этого ограничения.
+    """
+    try:
+        accounts = live.parse_accounts(request.args.get("accounts"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    sub = live.subscribe(accounts, limit=live.LIVE_SYNC_STREAMS)
+    if sub is None:
+        return live_busy_response()
+
+    def generate():
+        yield sse_event({"accounts": accounts}, "subscribed")
+        while not sub.closed:
+            events = sub.take(live.LIVE_HEARTBEAT_SECONDS)
+            if not events:
+                yield ": ping\n\n"
+            for event, data in events:
+                yield sse_event(data, event)
+
+    # close() приходит и после обрыва клиента (ошибка записи heartbeat)
+    resp = Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
+    resp.call_on_close(lambda: live.unsubscribe(sub))
+    return resp
+
+
 @app.route("/api/ai/chat", methods=["POST"])
 def ai_chat():
     """
@@ -1054,44 +1494,37 @@ def ai_chat():
     Request body:
     {
         "message": "Что думаешь о рынке NEAR?",
-        "history": [{"role": "user", "content": "..."}, ...],  // optional
-        "walletContext": {...}  // optional — данные кошелька для персонализации
+        "history": [{"role": "user", "content": "..."}, ...],  // optional, режется по AI_HISTORY_TOKENS
+        "accountId": "alice.near",  // optional — контекст кошелька собирается из кэша на сервере
+        "walletContext": {...}  // optional — данные кошелька от клиента, если accountId нет в кэше
     }
     """
     try:
-        body = request.get_json(force=True)
-        if not body:
-            return jsonify({"error": "Empty request body"}), 400
-        
-        user_message = body.get("message", "").strip()
-        if not user_message:
-            return jsonify({"error": "Message is required"}), 400
-        
-        # История диалога (последние 10 сообщений для экономии токенов)
-        history = body.get("history", [])
-        if len(history) > 10:
-            history = history[-10:]
-        
-        # Данные кошелька для персонализации
-        wallet_context = body.get("walletContext")
-        
-        # Строим сообщения
-        messages = history + [{"role": "user", "content": user_message}]
-        
-        # Системный промпт
-        system_prompt = build_ai_system_prompt(wallet_context)
-        
-        # Вызываем Claude
-        response_text, error = call_anthropic_api(messages, system_prompt)
+        try:
+            messages, system_prompt, question = parse_chat_request(request.get_json(force=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not ANTHROPIC_API_KEY:
+            # Fallback если нет API ключа
+            return jsonify({
+                "reply": "🤖 AI-аналитик временно недоступен. Добавьте ANTHROPIC_API_KEY в переменные окружения Render.",
+                "error": "ANTHROPIC_API_KEY не настроен на сервере",
+            })
+        answer = answer_cache.lookup(question) if question else None
+        if answer:
+            return jsonify({"reply": answer, "model": "claude-sonnet-4", "cached": True})
+        if not acquire_ai_session("sync"):
+            return ai_busy_response()
+        try:
+            # Вызываем Claude
+            response_text, error = call_anthropic_api(messages, system_prompt)
+        finally:
+            release_ai_session("sync")
         
         if error:
-            # Fallback если нет API ключа
-            if "не настроен" in error:
-                return jsonify({
-                    "reply": "🤖 AI-аналитик временно недоступен. Добавьте ANTHROPIC_API_KEY в переменные окружения Render.",
-                    "error": error
-                })
             return jsonify({"error": error}), 500
+        if question:
+            answer_cache.store(question, response_text)
         
         return jsonify({
             "reply": response_text,
@@ -1102,6 +1535,82 @@ def ai_chat():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/ai/chat/stream", methods=["POST"])
+def ai_chat_stream():
+    """
+    Тот же запрос, что /api/ai/chat; ответ — text/event-stream:
+      data: {"text": "..."}                                   — фрагменты по мере генерации
+      event: done   data: {"model": ..., "stopReason": ...}   — конец ответа
+      event: error  data: {"error": "..."}                    — сбой посреди потока
+    Ошибки до начала ответа — обычный JSON с кодом 4xx/5xx. Разрыв
+    соединения клиентом закрывает поток к Anthropic (call_on_close).
+    """
+    try:
+        messages, system_prompt, question = parse_chat_request(request.get_json(force=True, silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not ANTHROPIC_API_KEY:
+        return jsonify({"error": "ANTHROPIC_API_KEY не настроен на сервере"}), 503
+    answer = answer_cache.lookup(question) if question else None
+    if answer:
+        return Response(cached_answer_events(answer), mimetype="text/event-stream", headers=SSE_HEADERS)
+    if not acquire_ai_session("stream"):
+        return ai_busy_response()
+    try:
+        headers, payload = anthropic_request(messages, system_prompt, stream=True)
+        r = upstream.post(
+            "anthropic", f"{ANTHROPIC_API_URL}/v1/messages",
+            endpoint="messages_stream",
+            headers=headers,
+            json=payload,
+            stream=True,
+            timeout=(10, 30),  # 30 с — между фрагментами, а не на весь ответ
+        )
+    except Exception as e:
+        release_ai_session("stream")
+        print(f"[ai_chat_stream] Error: {e}")
+        return jsonify({"error": str(e)}), 502
+    if r.status_code != 200:
+        r.close()
+        release_ai_session("stream")
+        return jsonify({"error": f"Anthropic API error: {r.status_code}"}), 502
+
+    t0 = time.perf_counter()
+
+    def generate():
+        relay, first = ChatRelay(), True
+        try:
+            for line in r.iter_lines(decode_unicode=True):
+                event = parse_anthropic_line(line) if line else None
+                chunk = relay.feed(*event) if event else None
+                if chunk:
+                    if first:
+                        metrics_module.ai_first_token("stream", time.perf_counter() - t0)
+                        first = False
+                    yield chunk
+                if relay.done:
+                    break
+        except Exception as e:
+            print(f"[ai_chat_stream] Stream error: {e}")
+            relay.done = True
+            yield sse_event({"error": str(e)}, "error")
+        tail = relay.end()
+        if tail:
+            yield tail
+        if relay.complete and question:
+            answer_cache.store(question, relay.text())
+
+    def close():
+        # gunicorn зовёт close() и после обрыва клиента — upstream-ответ закрывается
+        # вместе с сокетом, генерация на стороне Anthropic прекращается
+        r.close()
+        release_ai_session("stream")
+
+    resp = Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
+    resp.call_on_close(close)
+    return resp
+
+
 @app.route("/", methods=["GET"])
 def index():
     return jsonify({
@@ -1116,7 +1625,10 @@ def index():
             "/api/nft/<account_id>",
             "/api/nfts/<account_id>",
             "/api/ai/chat  [POST]",
+            "/api/ai/chat/stream  [POST, text/event-stream]",
+            "/api/live?accounts=<a,b>  [text/event-stream]",
             "/api/health",
+            "/metrics",
         ]
     })
 
@@ -1127,6 +1639,8 @@ def health():
         "status": "ok",
         "timestamp": int(time.time()),
         "ai": "enabled" if ANTHROPIC_API_KEY else "disabled (no ANTHROPIC_API_KEY)",
+        "circuits": upstream.breaker_states(),
+        "startup": STARTUP,
     })
 
 
@@ -1137,6 +1651,7 @@ try:
     print("[NFT] Paginated NFT routes registered")
 except ImportError:
     print("[NFT] nft_module.py not found, using built-in /api/nft/ endpoint")
+_startup_phase("nft")
 
 # ─── Добавить в api.py (вставить перед строкой "if __name__") ────────────
 #
@@ -1144,21 +1659,88 @@ except ImportError:
 # для отображения графика в webapp.
 # Сохрани этот код в api.py, найдя блок # === Main === или конец файла.
 
+def get_price_history(gecko_id):
+    try:
+        r = upstream.get(
+            "coingecko", f"{COINGECKO_API}/coins/{gecko_id}/market_chart",
+            endpoint="market_chart", params=price_history.market_chart_params(), timeout=API_TIMEOUT,
+        )
+        return r.json() if r.status_code == 200 else None
+    except Exception as e:
+        print(f"[price_history] {gecko_id}: {e}")
+        return None
+
+
+def backfill_price_history(gecko_ids):
+    """Дозагрузка истории цен для id без полного дневного ряда (параллельно, до BACKFILLS_PER_REQUEST)."""
+    missing = price_history.needs_backfill(gecko_ids)
+    if not missing:
+        return
+    with ThreadPoolExecutor(max_workers=len(missing), thread_name_prefix="price-hist") as pool:
+        for gecko_id, data in zip(missing, pool.map(get_price_history, missing)):
+            price_history.apply_backfill(gecko_id, data)
+
+
+def portfolio_holdings(account_id):
+    """
+    (NEAR в стейкинге, {id CoinGecko: количество}) из кэшированного ответа
+    /api/balance. Истории количеств токенов нет — берутся текущие.
+    """
+    balance = cached(f"balance:{account_id}") or {}
+    tokens = balance.get("tokens") or {}
+    holdings = defaultdict(float)
+    for t in tokens.get("major", []) + tokens.get("filtered", []):
+        gecko_id = token_registry.coingecko_id(t.get("contract", ""))
+        if gecko_id:
+            holdings[gecko_id] += t.get("amount", 0)
+    return balance.get("staking", 0) or 0, dict(holdings)
+
+
+def value_history_usd(account_id, history, stamps):
+    """
+    Дописывает в точки history (по одной на ts из stamps) nearPrice и usd:
+    (NEAR + стейкинг) × цена NEAR дня + текущие токены × их цены дня. Все
+    цены — одним пакетом price_history.prices_at(). usd — None, если цены
+    NEAR на этот день нет. → список учтённых id CoinGecko.
+    """
+    staking, holdings = portfolio_holdings(account_id)
+    ids = ["near"] + [g for g in holdings if g != "near"]
+    backfill_price_history(ids)
+    prices = price_history.prices_at([(g, ts) for g in ids for ts in stamps])
+    n = len(stamps)
+    by_id = {g: prices[k * n:(k + 1) * n] for k, g in enumerate(ids)}
+    for i, point in enumerate(history):
+        near_price = by_id["near"][i]
+        point["ts"] = int(stamps[i])
+        point["nearPrice"] = near_price
+        if near_price is None:
+            point["usd"] = None
+            continue
+        usd = (point["near"] + staking) * near_price
+        for gecko_id, amount in holdings.items():
+            price = by_id[gecko_id][i]
+            if price:
+                usd += amount * price
+        point["usd"] = round(usd, 2)
+    return ids
+
+
 @app.route("/api/portfolio-history/<account_id>")
 def api_portfolio_history(account_id):
     """
     История баланса NEAR для графика в webapp.
-    Берём транзакции за период и считаем приблизительный баланс.
-    period: 7d | 14d | 30d
+    Берём транзакции за период и считаем приблизительный баланс; каждая
+    точка оценивается в USD по истории цен (value_history_usd).
+    period: 7d | 14d | 30d | 90d
     """
     period = request.args.get("period", "7d")
-    days_map = {"7d": 7, "14d": 14, "30d": 30}
+    days_map = {"7d": 7, "14d": 14, "30d": 30, "90d": 90}
     days = days_map.get(period, 7)
 
     cache_key = f"portfolio_history:{account_id}:{period}"
-    cached_data = cached(cache_key)
-    if cached_data:
-        return jsonify(cached_data)
+    resp = cached_response(cache_key)
+    if resp:
+        return resp
 
     try:
         # Получаем текущий баланс
@@ -1170,7 +1752,7 @@ def api_portfolio_history(account_id):
                 "account_id": account_id
             }
         }
-        r = http_requests.post(NEAR_RPC_URL, json=rpc_body, timeout=8)
+        r = upstream.post("rpc", NEAR_RPC_URL, endpoint="view_account", json=rpc_body, timeout=8)
         current_near = 0
         if r.status_code == 200:
             result = r.json().get("result", {})
@@ -1183,16 +1765,22 @@ def api_portfolio_history(account_id):
         # Получаем транзакции за период для восстановления истории
         nb_key = os.environ.get("NEARBLOCKS_API_KEY", "")
         headers = {"Authorization": f"Bearer {nb_key}"} if nb_key else {}
-        r2 = http_requests.get(
-            f"{NEARBLOCKS_API}/account/{account_id}/txns",
-            params={"limit": 100, "order": "desc"},
-            headers=headers,
-            timeout=8
-        )
+        try:
+            r2 = upstream.get(
+                "nearblocks", f"{NEARBLOCKS_API}/account/{account_id}/txns",
+                endpoint="txns",
+                params={"limit": 100, "order": "desc"},
+                headers=headers,
+                timeout=8
+            )
+        except upstream.UpstreamError as e:
+            # Ответ без истории отдаём, но не кэшируем (запрос помечен degraded)
+            print(f"[portfolio_history] NearBlocks: {e}")
+            r2 = None
 
         history = []
 
-        if r2.status_code == 200:
+        if r2 is not None and r2.status_code == 200:
             txns = r2.json().get("txns", [])
             # Фильтруем по периоду
             cutoff_ms = (datetime.now(timezone.utc).timestamp() - days * 86400) * 1000
@@ -1248,65 +1836,114 @@ def api_portfolio_history(account_id):
                     "near": round(current_near, 4),
                 })
 
+        # ts точек — как в циклах выше: сейчас минус i дней
+        now = datetime.now(timezone.utc)
+        stamps = [(now - timedelta(days=i)).timestamp() for i in range(days - 1, -1, -1)]
+        priced = value_history_usd(account_id, history, stamps)
+
         result = {
             "account":    account_id,
             "period":     period,
             "currentNear": round(current_near, 4),
+            "currentUsd": history[-1]["usd"] if history else None,
+            "pricedTokens": priced,
             "history":    history,
         }
-        set_cache(cache_key, result, 300)  # 5 минут
-        return jsonify(result)
+        return cache_response(cache_key, result, 300)  # 5 минут
 
     except Exception as e:
         print(f"[portfolio_history] Error: {e}")
         return jsonify({"account": account_id, "period": period, "history": [], "error": str(e)}), 500
-# ─── Market endpoints (DexScreener proxy) ─────────────────────────────────
+# ─── Market endpoints (снимки market_module; DexScreener — только без поллера) ─
+MARKET_TTL = max(int(market.MARKET_POLL_SECONDS), 10)
+
+
+def market_unavailable(payload):
+    resp = jsonify({**payload, "error": "market data is not loaded yet"})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "5"
+    return resp
+
+
 @app.route("/api/market/near")
 def api_market_near():
-    cache_key = "market_near"
-    c = cached(cache_key)
-    if c:
-        return jsonify(c)
-    try:
-        r = http_requests.get(
-            "https://api.dexscreener.com/latest/dex/search",
-            params={"q": "near"},
-            timeout=10
-        )
-        data = r.json()
-        pairs = [p for p in (data.get("pairs") or []) if p.get("chainId") == "near"]
-        result = {"pairs": pairs}
-        set_cache(cache_key, result, 120)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({"error": str(e), "pairs": []}), 500
+    pairs, ts = market.read("pairs")
+    if ts is None:
+        return market_unavailable({"pairs": []})
+    return conditional_json({"pairs": pairs, "updatedAt": ts}, MARKET_TTL)
 
 
 @app.route("/api/market/new-tokens")
 def api_market_new_tokens():
-    cache_key = "market_new_tokens"
-    c = cached(cache_key)
-    if c:
-        return jsonify(c)
-    try:
-        r = http_requests.get(
-            "https://api.dexscreener.com/token-profiles/latest/v1",
-            timeout=10
-        )
-        data = r.json()
-        if isinstance(data, list):
-            near_tokens = [t for t in data if t.get("chainId") == "near"][:10]
-        else:
-            near_tokens = []
-        result = {"tokens": near_tokens}
-        set_cache(cache_key, result, 300)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({"error": str(e), "tokens": []}), 500
+    tokens, ts = market.read("newTokens")
+    if ts is None:
+        return market_unavailable({"tokens": []})
+    return conditional_json({"tokens": tokens, "updatedAt": ts}, MARKET_TTL)
+
+
+@app.route("/api/market/tokens")
+def api_market_tokens():
+    """Последние пары отслеживаемых токенов (MARKET_TOKENS): первая — NEAR."""
+    tokens, ts = market.read("tokens")
+    if ts is None:
+        return market_unavailable({"tokens": []})
+    return conditional_json({"tokens": tokens, "updatedAt": ts}, MARKET_TTL)
+
+
+@app.route("/api/market/chart/<token>")
+def api_market_chart(token):
+    """OHLC-ряд: ?range=24h|7d|30d|90d; token — контракт или "near"."""
+    period = request.args.get("range", "24h")
+    if period not in market.TIERS:
+        return jsonify({"error": f"range must be one of {', '.join(market.TIERS)}"}), 400
+    market.read("tokens")  # без поллера ряды наполняет разовый опрос
+    data = market.chart(token, period)
+    if data is None:
+        return jsonify({"error": "token is not tracked", "tracked": market.MARKET_TOKENS}), 404
+    return conditional_json(data, MARKET_TTL)
+
+
+# ─── Production entry point ────────────────────────────────────────────────
+_startup_phase("routes")
+STARTUP["importMs"] = round((time.perf_counter() - _IMPORT_T0) * 1000, 1)
+print(f"[startup] api imported in {STARTUP['importMs']:.0f} ms "
+      f"(deps {STARTUP['depsMs']:.0f}, modules {STARTUP['modulesMs']:.0f}, routes {STARTUP['routesMs']:.0f})")
+
+WARM_UP_TIMEOUT = float(os.environ.get("WARM_UP_TIMEOUT", 3))
+
+
+def _warm_price():
+    t0 = time.perf_counter()
+    with upstream.scope(upstream.BACKGROUND):
+        price = get_near_price()
+    STARTUP["nearPriceMs"] = round((time.perf_counter() - t0) * 1000, 1)
+    print(f"[warm_up] NEAR price {price} in {STARTUP['nearPriceMs']:.0f} ms")
+
+
+def warm_up():
+    """Прогрев: фоновое подключение к Redis и цена NEAR. Цену ждём не дольше
+    WARM_UP_TIMEOUT — медленный upstream не должен задерживать старт; если
+    не успела, она догрузится в фоне (или первым запросом в воркере)."""
+    t0 = time.perf_counter()
+    connect_redis()
+    worker = threading.Thread(target=_warm_price, name="warm-up", daemon=True)
+    worker.start()
+    worker.join(WARM_UP_TIMEOUT)
+    STARTUP["warmUpMs"] = round((time.perf_counter() - t0) * 1000, 1)
+    if worker.is_alive():
+        print(f"[warm_up] NEAR price not ready after {WARM_UP_TIMEOUT:.0f}s, continuing")
+
+
+def create_app():
+    """Фабрика для gunicorn: gunicorn -c gunicorn.conf.py "api:create_app()"."""
+    warm_up()
+    return app
 
 
 # ─── Main ──────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8080))
     print(f"NearPulse API v2.1.0 starting on port {port}")
+    market.start_poller()
+    follower.start()
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,716 @@
+"""
+NearPulse async API — ASGI-приложение для горячих endpoints.
+
+/api/balance, /api/transactions, /api/stats, NFT-маршруты, потоковый
+AI-чат (/api/ai/chat/stream) и live-подписки (/api/live — соединение не
+занимает поток) обслуживаются здесь: запросы к upstream идут через общую aiohttp-сессию, так что один
+воркер держит сотни запросов в полёте, а независимые источники (RPC,
+NearBlocks, прайс-каталоги) запрашиваются параллельно. Разбор ответов и
+классификация — те же parse_* / analyze_* из api.py и nft_module.py.
+Все остальные маршруты отдаёт Flask-приложение, смонтированное через a2wsgi.
+
+    uvicorn api_async:app --host 0.0.0.0 --port 8080 --workers 2
+
+Env:
+  ASYNC_MAX_CONNECTIONS — лимит соединений к upstream на воркер (по умолчанию 500)
+  ASYNC_WSGI_THREADS    — потоки для смонтированного Flask (по умолчанию 32)
+"""
+import os
+import time
+import asyncio
+import contextlib
+
+import aiohttp
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Match, Mount, Route
+
+import api
+import nft_module
+import upstream_module as upstream
+import metrics_module
+import tracing_module
+import answer_cache_module as answer_cache
+import token_registry_module as token_registry
+from cache_module import (
+    CACHE_TTL, cached_entries, entry_data, has_redis, is_empty, local_entry, render_entry, render_json, set_cache,
+)
+
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("ASYNC_MAX_CONNECTIONS", 500))
+ASYNC_WSGI_THREADS = int(os.environ.get("ASYNC_WSGI_THREADS", 32))
+
+_http = None
+
+
+# ─── Cache / response helpers ──────────────────────────────────────────────
+async def _cache_get(key, prefetch=()):
+    """
+    Копия процесса — сразу; Redis (блокирующий клиент) — в пуле потоков,
+    один MGET на key и prefetch.
+    """
+    keys = (key, *prefetch)
+    if has_redis() and any(local_entry(k) is None for k in keys):
+        return (await asyncio.to_thread(cached_entries, keys))[key]
+    return cached_entries(keys, use_redis=False)[key]
+
+
+def _conditions(request):
+    return {
+        "if_none_match": request.headers.get("if-none-match"),
+        "accept_encoding": request.headers.get("accept-encoding"),
+        "fields": request.query_params.get("fields"),
+    }
+
+
+def _respond(rendered):
+    status, body, headers = rendered
+    return Response(body, status_code=status, headers=headers,
+                    media_type="application/json" if status == 200 else None)
+
+
+async def _cached_response(request, key, prefetch=()):
+    entry = await _cache_get(key, prefetch)
+    if is_empty(entry):
+        return None
+    return _respond(render_entry(entry, **_conditions(request)))
+
+
+def _cache_response(request, key, data, ttl=CACHE_TTL):
+    return _respond(render_entry(set_cache(key, data, ttl), **_conditions(request)))
+
+
+def _query_int(request, name, default):
+    try:
+        return int(request.query_params.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# ─── Upstream (async twins of the api.py fetchers) ─────────────────────────
+async def _get(provider, url, endpoint=None, **kwargs):
+    """GET через governor → (status, json); тело разбирается и для 4xx, как в sync-версиях."""
+    return await upstream.request_async(_http, provider, "GET", url, endpoint=endpoint, **kwargs)
+
+
+async def _post(provider, url, payload, endpoint=None):
+    return await upstream.request_async(_http, provider, "POST", url, endpoint=endpoint, json=payload)
+
+
+async def get_balance(address):
+    try:
+        _, data = await _post("rpc", api.NEAR_RPC_URL, api.view_account_payload(address), "view_account")
+        return api.parse_view_account(address, data)
+    except Exception as e:
+        print(f"[async get_balance] Error: {e}")
+        return {"address": address, "near": 0}
+
+
+async def intear_near_price():
+    status, data = await _get("intear", f"{api.INTEAR_API}/get-token-price", "near_price",
+                              degrade=False, params={"token_id": "wrap.near"})
+    price = api.parse_intear_price(data) if status == 200 else 0
+    if not price:
+        raise ValueError("Intear returned no price")
+    return price
+
+
+async def coingecko_near_price():
+    _, data = await _get("coingecko", f"{api.COINGECKO_API}/simple/price", "near_price",
+                         degrade=False, params={"ids": "near", "vs_currencies": "usd"})
+    price = api.parse_coingecko_near_price(data)
+    if not price:
+        raise ValueError("CoinGecko returned no price")
+    return price
+
+
+async def get_near_price():
+    entry = await _cache_get("near_price")
+    if entry is not None:
+        return entry_data(entry)
+    try:
+        price = await upstream.hedged_async(("intear", intear_near_price), ("coingecko", coingecko_near_price))
+    except Exception as e:
+        print(f"[async get_near_price] {e}")
+        return 0
+    set_cache("near_price", price)
+    api.price_history.observe("near", price)
+    return price
+
+
+async def get_staking_balance(address):
+    try:
+        _, data = await _get("nearblocks", api.staking_deposits_url(address), "staking_deposits",
+                             headers=api.nearblocks_headers())
+        return api.parse_staking_deposits(data)
+    except Exception as e:
+        print(f"[async get_staking_balance] Error: {e}")
+        return 0
+
+
+async def get_hot_claim_status(address):
+    try:
+        _, data = await _post("rpc", api.NEAR_RPC_URL, api.hot_claim_payload(address), "hot_claim")
+        return api.parse_hot_claim(data)
+    except Exception as e:
+        print(f"[async get_hot_claim_status] Error: {e}")
+        return None
+
+
+async def get_inventory(address):
+    """Один запрос inventory на FT-токены и HOT (sync-версия делает два)."""
+    try:
+        _, data = await _get("nearblocks", api.inventory_url(address), "inventory", headers=api.nearblocks_headers())
+        return data
+    except Exception as e:
+        print(f"[async get_inventory] Error: {e}")
+        return None
+
+
+async def _price_catalog(provider, url, label):
+    try:
+        _, data = await _get(provider, url, "token_prices")
+        return data
+    except Exception as e:
+        print(f"[async {label}] Error: {e}")
+        return None
+
+
+async def get_coingecko_prices(contracts):
+    contract_to_id = api.coingecko_ids(contracts)
+    if not contract_to_id:
+        return {}
+    try:
+        _, data = await _get(
+            "coingecko", f"{api.COINGECKO_API}/simple/price", "token_prices",
+            params={"ids": ",".join(set(contract_to_id.values())), "vs_currencies": "usd"},
+        )
+        return api.parse_coingecko_prices(data, contract_to_id)
+    except Exception as e:
+        print(f"[async coingecko] Error: {e}")
+        return {}
+
+
+async def get_ft_metadata(contract):
+    try:
+        _, data = await _post("rpc", api.NEAR_RPC_URL, token_registry.ft_metadata_payload(contract), "ft_metadata")
+        return token_registry.parse_ft_metadata(contract, data)
+    except Exception as e:
+        print(f"[async ft_metadata] {contract}: {e}")
+        return None
+
+
+async def resolve_token_metadata(rows):
+    known = await _maybe_thread(token_registry.resolve_rows, rows)
+    missing = token_registry.missing_decimals(known)
+    if missing:
+        metas = await asyncio.gather(*(get_ft_metadata(c) for c in missing))
+        await _maybe_thread(token_registry.apply_ft_metadata, known, missing, metas)
+    return known
+
+
+@tracing_module.traced()
+async def get_tokens_with_prices(inventory, min_usd=0.01):
+    tokens = []
+    if inventory is not None:
+        try:
+            known = await resolve_token_metadata(api.inventory_rows(inventory))
+            tokens = api.priced_tokens(api.parse_inventory_tokens(inventory, known))
+        except Exception as e:
+            print(f"[async get_all_tokens] Error: {e}")
+    if not tokens:
+        return {"major": [], "filtered": [], "hidden": []}
+    contracts = [t["contract"] for t in tokens]
+    intear_raw, ref_raw, cg_prices = await asyncio.gather(
+        _price_catalog("intear", f"{api.INTEAR_API}/list-token-price", "intear"),
+        _price_catalog("ref", f"{api.REF_FINANCE_API}/list-token-price", "ref_finance"),
+        get_coingecko_prices(contracts),
+    )
+    intear_prices, ref_prices = {}, {}
+    try:
+        intear_prices = api.parse_intear_prices(intear_raw, contracts)
+    except Exception as e:
+        print(f"[async intear] Error: {e}")
+    try:
+        ref_prices = api.parse_ref_finance_prices(ref_raw, contracts)
+    except Exception as e:
+        print(f"[async ref_finance] Error: {e}")
+    return api.classify_tokens(tokens, intear_prices, ref_prices, cg_prices, min_usd)
+
+
+async def get_transaction_history(address):
+    try:
+        _, data = await _get("nearblocks", api.txns_url(address), "txns",
+                             params=api.TXNS_PARAMS, headers=api.nearblocks_headers())
+        return api.parse_transaction_history(data)
+    except Exception as e:
+        print(f"[async get_transaction_history] Error: {e}")
+        return []
+
+
+# ─── Endpoints ─────────────────────────────────────────────────────────────
+async def api_balance(request):
+    account_id = request.path_params["account_id"]
+    cache_key = f"balance:{account_id}"
+    resp = await _cached_response(request, cache_key, prefetch=("near_price",))
+    if resp:
+        return resp
+    try:
+        balance, staking, inventory, hot_claim, near_price = await asyncio.gather(
+            get_balance(account_id),
+            get_staking_balance(account_id),
+            get_inventory(account_id),
+            get_hot_claim_status(account_id),
+            get_near_price(),
+        )
+        hot = 0
+        if inventory is not None:
+            try:
+                hot = api.parse_token_balance(inventory)
+            except Exception as e:
+                print(f"[async get_token_balance] Error: {e}")
+        tokens = await get_tokens_with_prices(inventory)
+        result = api.build_balance_result(account_id, balance, staking, hot, hot_claim, near_price, tokens)
+        return _cache_response(request, cache_key, result)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def _transaction_index(account_id):
+    """Индекс txns_all: из upstream (см. api.fetch_transaction_index) и в кэш."""
+    txns, near_price = await asyncio.gather(get_transaction_history(account_id), get_near_price())
+    index = api.build_transactions_index(api.analyze_transactions(txns, account_id), near_price)
+    set_cache(f"txns_all:{account_id}", index, api.follower.ttl(CACHE_TTL))
+    return index
+
+
+async def api_transactions(request):
+    account_id = request.path_params["account_id"]
+    cache_key = f"txns:{account_id}"
+    limit = min(max(_query_int(request, "limit", 20), 1), 50)
+    since = request.query_params.get("since")
+    if since:
+        try:
+            entry = await _cache_get(f"txns_all:{account_id}")
+            index = await _transaction_index(account_id) if is_empty(entry) else entry_data(entry)
+            result = api.build_transactions_delta(index, since, limit)
+        except ValueError:
+            return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+        except Exception as e:
+            return JSONResponse({"error": str(e)}, status_code=500)
+        return _respond(render_json(result, 0, **_conditions(request)))
+    if not request.query_params.get("_") and not request.query_params.get("nocache"):
+        resp = await _cached_response(request, cache_key, prefetch=("near_price",))
+        if resp:
+            return resp
+    try:
+        result = api.build_transactions_result(await _transaction_index(account_id), limit)
+        return _cache_response(request, cache_key, result, api.follower.ttl(CACHE_TTL))
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def api_stats(request):
+    account_id = request.path_params["account_id"]
+    cache_key = f"stats:{account_id}"
+    resp = await _cached_response(request, cache_key, prefetch=("near_price",))
+    if resp:
+        return resp
+    try:
+        txns, near_price = await asyncio.gather(get_transaction_history(account_id), get_near_price())
+        analyzed = api.analyze_transactions(txns, account_id)
+        return _cache_response(request, cache_key, api.build_stats_result(analyzed, near_price))
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+# ─── NFT ───────────────────────────────────────────────────────────────────
+async def fetch_nft_listing(account_id):
+    key = f"nft_contracts:{account_id}"
+    listing = nft_module._cached(key, nft_module.NFT_CACHE_TTL)
+    if listing is not None:
+        return listing
+
+    async def fastnear():
+        status, data = await _get("fastnear", f"{nft_module.FASTNEAR_API}/account/{account_id}/nft", "nft",
+                                  degrade=False)
+        if status != 200:
+            raise upstream.UpstreamError(f"FastNEAR HTTP {status}")
+        return nft_module.parse_fastnear_nfts(data)
+
+    async def inventory():
+        status, data = await _get("nearblocks", f"{nft_module.NEARBLOCKS_API}/account/{account_id}/inventory",
+                                  "inventory", degrade=False, headers=nft_module._nb_headers())
+        if status != 200:
+            raise upstream.UpstreamError(f"NearBlocks HTTP {status}")
+        return nft_module.parse_inventory_nfts(data)
+
+    try:
+        entries = await upstream.hedged_async(("fastnear", fastnear), ("nearblocks", inventory))
+    except Exception as e:
+        print(f"[async NFT contracts] error: {e}")
+        entries = []
+    listing = nft_module._build_listing(entries)
+    nft_module._set_cache(key, listing, api.follower.ttl(nft_module.NFT_CACHE_TTL))
+    return listing
+
+
+async def api_nft_contracts(request):
+    account_id = request.path_params["account_id"]
+    page = _query_int(request, "page", 1)
+    per_page = min(_query_int(request, "limit", _query_int(request, "per_page", 20)), 50)
+    try:
+        nft_module.check_page(page, per_page)
+        payload, etag = nft_module.contracts_page(
+            await fetch_nft_listing(account_id), account_id, page, per_page, request.query_params.get("cursor"))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return _respond(render_json(payload, nft_module.NFT_CACHE_TTL, etag, **_conditions(request)))
+
+
+async def api_nft_tokens_all(request):
+    account_id = request.path_params["account_id"]
+    page = _query_int(request, "page", 1)
+    per_page = min(_query_int(request, "per_page", 24), 48)
+    key = f"nft_all:{account_id}:p{page}:pp{per_page}"
+    result = nft_module._cached(key, nft_module.NFT_CACHE_TTL)
+    if result is None:
+        try:
+            status, data = await _get(
+                "nearblocks", f"{nft_module.NEARBLOCKS_API}/account/{account_id}/inventory/nfts",
+                "inventory_nfts",
+                params={"page": page, "per_page": per_page},
+                headers=nft_module._nb_headers(),
+                timeout=aiohttp.ClientTimeout(total=15),
+            )
+            if status != 200:
+                return JSONResponse({"tokens": [], "hasMore": False, "total": 0, "error": f"HTTP {status}"})
+            result = nft_module.build_nft_page(data, page, per_page)
+            nft_module._set_cache(key, result, api.follower.ttl(nft_module.NFT_CACHE_TTL))
+        except asyncio.TimeoutError:
+            print(f"[async fetch_all_nfts_paged] Timeout for {account_id} p{page}")
+            return JSONResponse({"tokens": [], "hasMore": False, "total": 0, "error": "timeout"})
+        except Exception as e:
+            print(f"[async fetch_all_nfts_paged] Error: {e}")
+            return JSONResponse({"tokens": [], "hasMore": False, "total": 0, "error": str(e)})
+    return _respond(render_json(result, nft_module.NFT_CACHE_TTL, **_conditions(request)))
+
+
+async def api_nft_meta(request):
+    contract_id = request.path_params["contract_id"]
+    key = f"nft_meta:{contract_id}"
+    meta = nft_module._cached(key, nft_module.META_CACHE_TTL)
+    if meta is None:
+        meta = nft_module.default_contract_meta(contract_id)
+        try:
+            status, data = await _get("nearblocks", f"{nft_module.NEARBLOCKS_API}/nfts/{contract_id}", "nft_meta",
+                                      headers=nft_module._nb_headers())
+            if status == 200:
+                meta = nft_module.parse_contract_meta(contract_id, data)
+            else:
+                print(f"[async contract_meta] NearBlocks {status} for {contract_id}")
+        except Exception as e:
+            print(f"[async contract_meta] {contract_id}: {e}")
+        nft_module._set_cache(key, meta, nft_module.META_CACHE_TTL)
+    return _respond(render_json({"contract": contract_id, **meta}, nft_module.META_CACHE_TTL, **_conditions(request)))
+
+
+async def api_nft_ids(request):
+    account_id = request.path_params["account_id"]
+    contract_id = request.path_params["contract_id"]
+    ids = (await fetch_nft_listing(account_id))["tokenIds"].get(contract_id)
+    if ids is None:
+        return JSONResponse({"error": "Collection not found"}, status_code=404)
+    offset = max(_query_int(request, "offset", 0), 0)
+    limit = min(max(_query_int(request, "limit", 100), 1), 500)
+    return _respond(render_json({
+        "account": account_id,
+        "contract": contract_id,
+        "tokenIds": ids[offset : offset + limit],
+        "total": len(ids),
+        "hasMore": offset + limit < len(ids),
+    }, nft_module.NFT_CACHE_TTL, **_conditions(request)))
+
+
+# ─── AI chat stream ────────────────────────────────────────────────────────
+# Потоковый чат здесь, а не в смонтированном Flask: ответ модели идёт
+# чанками прямо из event loop, без потока из пула a2wsgi на 30 с.
+AI_STREAM_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+
+
+async def _maybe_thread(fn, *args):
+    """fn, которой может понадобиться Redis, — в пуле потоков; без Redis — сразу."""
+    if has_redis():
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+class ClosingStream(StreamingResponse):
+    """text/event-stream, который при любом исходе — конец ответа, ошибка,
+    разрыв клиента — зовёт cleanup (закрыть поток к модели и освободить
+    AI-сессию, отписаться от live-хаба)."""
+
+    def __init__(self, content, cleanup):
+        super().__init__(content, media_type="text/event-stream", headers=api.SSE_HEADERS)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.cleanup()
+
+
+async def ai_chat_stream(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    try:
+        # wallet context и answer_cache могут читать Redis — не в event loop
+        messages, system_prompt, question = await _maybe_thread(api.parse_chat_request, body)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if not api.ANTHROPIC_API_KEY:
+        return JSONResponse({"error": "ANTHROPIC_API_KEY не настроен на сервере"}, status_code=503)
+    answer = await _maybe_thread(answer_cache.lookup, question) if question else None
+    if answer:
+        return StreamingResponse(iter(api.cached_answer_events(answer)), media_type="text/event-stream",
+                                 headers=api.SSE_HEADERS)
+    if not api.acquire_ai_session("stream"):
+        return JSONResponse({"error": "AI analyst is busy, try again in a few seconds"},
+                            status_code=503, headers={"Retry-After": "5"})
+    stack = contextlib.AsyncExitStack()
+
+    async def cleanup():
+        await stack.aclose()
+        api.release_ai_session("stream")
+
+    headers, payload = api.anthropic_request(messages, system_prompt, stream=True)
+    t0 = time.perf_counter()
+    try:
+        r = await stack.enter_async_context(upstream.stream_async(
+            _http, "anthropic", "POST", f"{api.ANTHROPIC_API_URL}/v1/messages", endpoint="messages_stream",
+            headers=headers, json=payload, timeout=AI_STREAM_TIMEOUT,
+        ))
+        if r.status != 200:
+            raise upstream.UpstreamError(f"Anthropic API error: {r.status}")
+    except Exception as e:
+        await cleanup()
+        print(f"[async ai_chat_stream] Error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=502)
+
+    async def events():
+        relay, first = api.ChatRelay(), True
+        try:
+            async for raw in r.content:
+                event = api.parse_anthropic_line(raw.decode("utf-8", "replace").strip())
+                chunk = relay.feed(*event) if event else None
+                if chunk:
+                    if first:
+                        metrics_module.ai_first_token("stream", time.perf_counter() - t0)
+                        first = False
+                    yield chunk
+                if relay.done:
+                    break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"[async ai_chat_stream] Stream error: {e}")
+            relay.done = True
+            yield api.sse_event({"error": str(e) or "model stream timed out"}, "error")
+        tail = relay.end()
+        if tail:
+            yield tail
+        if relay.complete and question:
+            answer_cache.store(question, relay.text())  # запись в Redis — write-behind, не блокирует
+
+    return ClosingStream(events(), cleanup)
+
+
+async def api_live(request):
+    try:
+        accounts = api.live.parse_accounts(request.query_params.get("accounts"))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    # push() идёт из потока хаба — будим event loop потокобезопасно
+    sub = api.live.subscribe(accounts, wake=lambda: loop.call_soon_threadsafe(ready.set))
+    if sub is None:
+        return JSONResponse({"error": "Too many live streams, try again later"},
+                            status_code=503, headers={"Retry-After": "30"})
+
+    async def cleanup():
+        api.live.unsubscribe(sub)
+
+    async def events():
+        yield api.sse_event({"accounts": accounts}, "subscribed")
+        while True:
+            try:
+                await asyncio.wait_for(ready.wait(), api.live.LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            ready.clear()
+            for event, data in sub.take(0):
+                yield api.sse_event(data, event)
+
+    return ClosingStream(events(), cleanup)
+
+
+# ─── App ───────────────────────────────────────────────────────────────────
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    global _http
+    _http = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=api.API_TIMEOUT),
+        connector=aiohttp.TCPConnector(limit=ASYNC_MAX_CONNECTIONS, ttl_dns_cache=300),
+    )
+    api.warm_up()
+    api.market.start_poller()
+    api.follower.start()
+    try:
+        yield
+    finally:
+        await _http.close()
+
+
+class GovernorScope:
+    """Свой scope upstream_module на каждый HTTP-запрос (аналог before_request во Flask)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with upstream.scope(upstream.INTERACTIVE):
+            await self.app(scope, receive, send)
+
+
+class ProfilePassthrough:
+    """?profile=1 на balance/stats отдаёт Flask-версия маршрута: cProfile
+    (profiler_module.profiled) снимается в её потоке, а не в event loop.
+    Токен проверяет Flask; без него ответ обычный."""
+
+    PATHS = ("/api/balance/", "/api/stats/", "/api/analytics/")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] == "http" and scope["path"].startswith(self.PATHS)
+                and b"profile=1" in scope.get("query_string", b"")):
+            return await _flask(scope, receive, send)
+        await self.app(scope, receive, send)
+
+
+def _asgi_route(scope):
+    """Шаблон ASGI-маршрута или None — запрос уйдёт в смонтированный Flask,
+    который сам пишет метрики и trace (register_metrics / register_tracing)."""
+    if scope["type"] != "http":
+        return None
+    for route in routes:
+        if isinstance(route, Route) and route.matches(scope)[0] == Match.FULL:
+            return route.path
+    return None
+
+
+class MetricsMiddleware:
+    """Латентность и in-flight для ASGI-маршрутов."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route = _asgi_route(scope)
+        if route is None:
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics_module.HTTP_IN_FLIGHT.inc(route)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics_module.HTTP_IN_FLIGHT.dec(route)
+            metrics_module.observe_request(route, scope["method"], status, time.perf_counter() - t0)
+
+
+class TracingMiddleware:
+    """Trace на запрос к ASGI-маршруту; Server-Timing / X-Trace-Id в ответ."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route = _asgi_route(scope)
+        if route is None:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        force = tracing_module.force_requested(
+            headers.get(tracing_module.SAMPLE_HEADER.lower().encode(), b"").decode("latin-1"),
+            headers.get(b"authorization", b"").decode("latin-1"))
+        trace = tracing_module.start_trace(f"{scope['method']} {route}", force=force)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                extra = [(k.lower().encode(), v.encode()) for k, v in tracing_module.timing_headers(trace).items()]
+                message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            tracing_module.finish(trace, status)
+            tracing_module.end_trace()
+
+
+_cors = [Middleware(CORSMiddleware, allow_origins=api.CORS_ORIGINS, allow_methods=["GET"],
+                   expose_headers=api.CORS_EXPOSE_HEADERS)]
+
+
+_cors_post = [Middleware(CORSMiddleware, allow_origins=api.CORS_ORIGINS, allow_methods=["POST"],
+                        allow_headers=["Content-Type"], expose_headers=api.CORS_EXPOSE_HEADERS)]
+
+
+def _route(path, endpoint):
+    # OPTIONS — чтобы preflight дошёл до CORSMiddleware маршрута
+    return Route(path, endpoint, methods=["GET", "HEAD", "OPTIONS"], middleware=_cors)
+
+
+_flask = WSGIMiddleware(api.app, workers=ASYNC_WSGI_THREADS)
+
+routes = [
+    _route("/api/balance/{account_id}", api_balance),
+    _route("/api/transactions/{account_id}", api_transactions),
+    _route("/api/stats/{account_id}", api_stats),
+    _route("/api/analytics/{account_id}", api_stats),
+    _route("/api/nfts/{account_id}", api_nft_contracts),
+    _route("/api/nft/{account_id}", api_nft_contracts),
+    _route("/api/nft-tokens/{account_id}", api_nft_tokens_all),
+    _route("/api/nft-meta/{account_id}/{contract_id:path}", api_nft_meta),
+    _route("/api/nft-ids/{account_id}/{contract_id:path}", api_nft_ids),
+    _route("/api/live", api_live),
+    Route("/api/ai/chat/stream", ai_chat_stream, methods=["POST", "OPTIONS"], middleware=_cors_post),
+    Mount("/", app=_flask),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(ProfilePassthrough), Middleware(MetricsMiddleware),
+        Middleware(TracingMiddleware), Middleware(GovernorScope),
+    ],
+    lifespan=lifespan,
+)
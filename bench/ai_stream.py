@@ -0,0 +1,132 @@
+"""
+AI chat against the mock model (bench/mock_upstream.py): time to first
+text and to the full reply for /api/ai/chat vs /api/ai/chat/stream, with
+N concurrent chats, plus a disconnect check — a client that drops the
+stream after the first chunk must cancel the model request — and the
+answer cache: a generic question asked twice, then reworded.
+
+    python bench/ai_stream.py
+    python bench/ai_stream.py --server async --clients 4,16 --model-token-ms 50
+
+Chats over AI_MAX_SESSIONS are answered 503 and counted as "busy".
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+import harness  # noqa: E402
+from mock_upstream import mock_env  # noqa: E402
+
+MOCK_PORT, SERVER_PORT = 9920, 9921
+CHAT = {"message": "Что с моим портфелем?", "walletContext": {"address": "alice.near", "near": 12.5, "nearPrice": 3.2}}
+GENERIC = ["Что думаешь о рынке NEAR?", "что думаешь о рынке NEAR", "Что ты думаешь о рынке NEAR??"]
+
+
+async def _chat(client, path):
+    """→ (секунд до первого текста, секунд до конца, статус)."""
+    t0 = time.perf_counter()
+    first = None
+    async with client.post(path, json=CHAT) as r:
+        if path.endswith("/stream") and r.status == 200:
+            async for line in r.content:
+                if first is None and line.startswith(b"data:"):
+                    first = time.perf_counter() - t0
+        else:
+            await r.read()
+    total = time.perf_counter() - t0
+    return first if first is not None else total, total, r.status
+
+
+async def _run(base, path, clients):
+    async with aiohttp.ClientSession(base, timeout=aiohttp.ClientTimeout(total=120)) as client:
+        results = await asyncio.gather(*(_chat(client, path) for _ in range(clients)))
+    ok = [r for r in results if r[2] == 200]
+    busy = sum(1 for r in results if r[2] == 503)
+    first = sorted(r[0] for r in ok)
+    total = sorted(r[1] for r in ok)
+    return first, total, busy
+
+
+async def _drop_after_first_chunk(base):
+    async with aiohttp.ClientSession(base) as client:
+        async with client.post("/api/ai/chat/stream", json=CHAT) as r:
+            await r.content.readline()
+    # даём серверу заметить разрыв и закрыть поток к модели
+    await asyncio.sleep(1)
+
+
+async def _generic_questions(base):
+    """→ [(вопрос, мс, cached)] для /api/ai/chat."""
+    out = []
+    async with aiohttp.ClientSession(base) as client:
+        for message in GENERIC:
+            t0 = time.perf_counter()
+            async with client.post("/api/ai/chat", json={"message": message}) as r:
+                data = await r.json()
+            out.append((message, (time.perf_counter() - t0) * 1000, bool(data.get("cached"))))
+    return out
+
+
+def _mock_stats():
+    with urllib.request.urlopen(f"http://127.0.0.1:{MOCK_PORT}/_stats") as r:
+        return json.load(r)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=("sync", "async"), default="sync")
+    parser.add_argument("--clients", default="1,8")
+    parser.add_argument("--latency-ms", type=float, default=300, help="model time to first token")
+    parser.add_argument("--model-tokens", type=int, default=60)
+    parser.add_argument("--model-token-ms", type=float, default=30)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--max-sessions", type=int, default=8)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.pop("UPSTASH_REDIS_URL", None)
+    env.update(mock_env(MOCK_PORT))
+    env.update({"PORT": str(SERVER_PORT), "WEB_CONCURRENCY": "1", "GUNICORN_THREADS": str(args.threads),
+                "ANTHROPIC_API_KEY": "mock", "AI_MAX_SESSIONS": str(args.max_sessions)})
+    mock = [sys.executable, "bench/mock_upstream.py", "--port", str(MOCK_PORT), "--latency-ms", str(args.latency_ms),
+            "--model-tokens", str(args.model_tokens), "--model-token-ms", str(args.model_token_ms)]
+    if args.server == "async":
+        server = [sys.executable, "-m", "uvicorn", "api_async:app", "--port", str(SERVER_PORT), "--log-level", "warning"]
+    else:
+        server = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "api:create_app()"]
+    procs = [harness.spawn(mock, env)]
+    try:
+        harness.wait_ready(f"http://127.0.0.1:{MOCK_PORT}/_stats")
+        procs.append(harness.spawn(server, env))
+        base = f"http://127.0.0.1:{SERVER_PORT}"
+        harness.wait_ready(f"{base}/api/health", timeout=60)
+        print(f"server={args.server} threads={args.threads} AI_MAX_SESSIONS={args.max_sessions} "
+              f"model: {args.latency_ms:.0f} ms to first token, {args.model_tokens}×{args.model_token_ms:.0f} ms")
+        print(f"{'route':22s} {'clients':>7s} {'ok':>4s} {'busy':>4s} {'first p50':>10s} {'first max':>10s} "
+              f"{'total p50':>10s} {'total max':>10s}")
+        for clients in [int(c) for c in args.clients.split(",")]:
+            for path in ("/api/ai/chat", "/api/ai/chat/stream"):
+                first, total, busy = asyncio.run(_run(base, path, clients))
+                print(f"{path:22s} {clients:7d} {len(first):4d} {busy:4d} "
+                      f"{harness.percentile(first, 0.5) * 1000:8.0f}ms {(first[-1] if first else 0) * 1000:8.0f}ms "
+                      f"{harness.percentile(total, 0.5) * 1000:8.0f}ms {(total[-1] if total else 0) * 1000:8.0f}ms")
+        before = _mock_stats().get("anthropic_cancelled", 0)
+        asyncio.run(_drop_after_first_chunk(base))
+        cancelled = _mock_stats().get("anthropic_cancelled", 0) - before
+        print(f"client dropped stream after first chunk → model stream cancelled: {'yes' if cancelled else 'NO'}")
+        for message, ms, hit in asyncio.run(_generic_questions(base)):
+            print(f"answer cache: {message!r:34s} {ms:7.1f} ms {'cached' if hit else 'model'}")
+    finally:
+        harness.stop(procs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Chain follower against the mock chain (bench/mock_upstream.py): N accounts
+are warmed, then clients keep reading their /api/transactions and
+/api/balance for --duration seconds while the chain produces blocks with
+unrelated traffic. Reports upstream calls during the idle phase (the
+follower must not refetch untouched accounts), then triggers activity on
+one account and measures how long /api/transactions keeps serving the old
+list. --no-follow runs the same scenario on plain TTL caching.
+
+With --workers N every request opens a new connection, so reads spread
+over the workers, and the new transaction counts as served only once
+--confirm responses in a row carry it: one worker still holding the old
+list is a failure, not noise. --redis keeps UPSTASH_REDIS_URL from the
+environment (the shared cache and touched feed the workers need).
+
+    python bench/chain_follower.py
+    python bench/chain_follower.py --no-follow
+    python bench/chain_follower.py --server sync --chain-txs 500
+    UPSTASH_REDIS_URL=redis://localhost:6379 python bench/chain_follower.py --workers 2 --redis
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+import harness  # noqa: E402
+from mock_upstream import mock_env  # noqa: E402
+
+MOCK_PORT, SERVER_PORT = 9950, 9951
+ACCOUNT_PROVIDERS = ("rpc", "nearblocks", "fastnear", "intear", "ref", "coingecko")
+
+
+def _mock(path, method="GET"):
+    req = urllib.request.Request(f"http://127.0.0.1:{MOCK_PORT}{path}", method=method)
+    with urllib.request.urlopen(req) as r:
+        return json.load(r)
+
+
+def _calls():
+    stats = _mock("/_stats")
+    return sum(stats.get(p, 0) for p in ACCOUNT_PROVIDERS), stats.get("chain", 0)
+
+
+async def _read_all(client, accounts, duration):
+    deadline = time.perf_counter() + duration
+    requests = 0
+    while time.perf_counter() < deadline:
+        for account in accounts:
+            for path in (f"/api/transactions/{account}", f"/api/balance/{account}"):
+                async with client.get(path) as r:
+                    await r.read()
+                requests += 1
+        await asyncio.sleep(0.2)
+    return requests
+
+
+async def _staleness(client, account, timeout, confirm):
+    """
+    Секунд от активности до первого из confirm подряд ответов /api/transactions
+    с новой транзакцией (None — не дождались) и число старых ответов после первого нового.
+    """
+    await asyncio.to_thread(_mock, f"/_activity/{account}", "POST")
+    t0 = time.perf_counter()
+    first, streak, stale_after = None, 0, 0
+    while time.perf_counter() - t0 < timeout:
+        async with client.get(f"/api/transactions/{account}") as r:
+            data = await r.json()
+        if any(tx.get("id", "").startswith("live") for tx in data.get("transactions", [])):
+            if streak == 0:
+                first = time.perf_counter() - t0
+            streak += 1
+            if streak >= confirm:
+                return first, stale_after
+        else:
+            stale_after += first is not None
+            streak = 0
+        await asyncio.sleep(0.1)
+    return None, stale_after
+
+
+async def _scenario(base, accounts, duration, timeout, workers, confirm):
+    # с несколькими воркерами keep-alive прилип бы к одному из них
+    connector = aiohttp.TCPConnector(force_close=workers > 1)
+    async with aiohttp.ClientSession(base, connector=connector) as client:
+        await _read_all(client, accounts, 0.1)  # прогрев: по одному запросу на маршрут
+        await asyncio.sleep(2)                  # follower успевает увидеть записанные ключи
+        calls, chain = await asyncio.to_thread(_calls)
+        requests = await _read_all(client, accounts, duration)
+        idle_calls, idle_chain = await asyncio.to_thread(_calls)
+        lag, stale_after = await _staleness(client, accounts[0], timeout, confirm)
+        after, _ = await asyncio.to_thread(_calls)
+    return requests, idle_calls - calls, idle_chain - chain, lag, stale_after, after - idle_calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=("sync", "async"), default="async")
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=15, help="give up waiting for the new transaction")
+    parser.add_argument("--chain-txs", type=int, default=50)
+    parser.add_argument("--no-follow", action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--confirm", type=int, default=None, help="fresh responses in a row (default 1, 10 with --workers > 1)")
+    parser.add_argument("--redis", action="store_true", help="keep UPSTASH_REDIS_URL from the environment")
+    args = parser.parse_args()
+    confirm = args.confirm or (10 if args.workers > 1 else 1)
+
+    env = dict(os.environ)
+    if not args.redis:
+        env.pop("UPSTASH_REDIS_URL", None)
+    env.update(mock_env(MOCK_PORT))
+    env.update({"PORT": str(SERVER_PORT), "WEB_CONCURRENCY": str(args.workers), "MARKET_POLL_SECONDS": "0",
+                "CHAIN_FOLLOW_SECONDS": "0" if args.no_follow else "1", "FOLLOW_TTL": "3600"})
+    mock = [sys.executable, "bench/mock_upstream.py", "--port", str(MOCK_PORT), "--latency-ms", "50",
+            "--chain-txs", str(args.chain_txs)]
+    if args.server == "async":
+        server = [sys.executable, "-m", "uvicorn", "api_async:app", "--port", str(SERVER_PORT), "--log-level", "warning",
+                  "--workers", str(args.workers)]
+    else:
+        server = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "api:create_app()"]
+    procs = [harness.spawn(mock, {**env, "WEB_CONCURRENCY": "1"})]  # мок — uvicorn, WEB_CONCURRENCY и его касается
+    try:
+        harness.wait_ready(f"http://127.0.0.1:{MOCK_PORT}/_stats")
+        procs.append(harness.spawn(server, env))
+        base = f"http://127.0.0.1:{SERVER_PORT}"
+        harness.wait_ready(f"{base}/api/health", timeout=60)
+        accounts = [f"acct{i}.near" for i in range(args.accounts)]
+        requests, idle, chain, lag, stale_after, refetch = asyncio.run(
+            _scenario(base, accounts, args.duration, args.timeout, args.workers, confirm))
+        mode = "TTL only" if args.no_follow else "follower"
+        print(f"server={args.server} workers={args.workers} redis={'yes' if args.redis else 'no'} mode={mode} "
+              f"accounts={args.accounts} chain noise={args.chain_txs} tx/block")
+        print(f"idle {args.duration:.0f}s: {requests} requests, {idle} account upstream calls, {chain} chain RPC calls")
+        if lag is None:
+            print(f"new transaction not served after {args.timeout:.0f}s (cached list is stale until its TTL)")
+        else:
+            print(f"new transaction served {lag:.2f}s after activity ({confirm} in a row); "
+                  f"{refetch} account upstream calls to refresh it")
+        if stale_after:
+            print(f"old list served {stale_after} times after the new one had appeared")
+    finally:
+        harness.stop(procs)
+
+
+if __name__ == "__main__":
+    main()
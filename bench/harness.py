@@ -0,0 +1,171 @@
+"""
+Shared helpers for the bench scripts: starting servers, driving routes
+with N concurrent clients, server CPU / peak RSS from /proc, and
+comparison against a saved baseline.
+"""
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def spawn(cmd, env):
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop(procs):
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.wait()
+
+
+def wait_ready(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+# ─── Load ──────────────────────────────────────────────────────────────────
+async def drive(base, paths, clients, duration):
+    """
+    clients воркеров гоняют GET по путям из итератора paths, пока не
+    истечёт duration. → (req/s, отсортированные латентности в с, ошибок).
+    """
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    connector = aiohttp.TCPConnector(limit=clients)
+
+    async with aiohttp.ClientSession(base, connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as client:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                path = next(paths)
+                t0 = time.perf_counter()
+                try:
+                    async with client.get(path) as r:
+                        await r.read()
+                        if r.status >= 500:
+                            errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    return len(latencies) / elapsed, latencies, errors
+
+
+def fresh_accounts(template, account):
+    """Пути с новым под-аккаунтом на каждый запрос — каждый мимо кэша."""
+    for n in itertools.count():
+        yield template.format(acct=f"b{n}.{account}")
+
+
+# ─── Process stats (Linux /proc) ───────────────────────────────────────────
+def process_tree(pid):
+    """pid и все его потомки (gunicorn master + воркеры)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        p = stack.pop()
+        tree.append(p)
+        stack.extend(children.get(p, []))
+    return tree
+
+
+def cpu_seconds(pid):
+    """user+system CPU процесса и потомков, с."""
+    total = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])  # utime, stime
+        except (OSError, IndexError, ValueError):
+            continue
+    return total / CLK_TCK
+
+
+def peak_rss_mb(pid):
+    """Сумма VmHWM (пиковый RSS) по дереву процессов, МБ."""
+    total = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total / 1024
+
+
+def proc_stats_available():
+    return sys.platform.startswith("linux") and os.path.isdir("/proc/self")
+
+
+# ─── Baseline ──────────────────────────────────────────────────────────────
+def save_results(path, results):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"results saved to {path}")
+
+
+def compare(path, results, key_fields, checks, tolerance):
+    """
+    Сравнивает с сохранённым прогоном. checks: [(поле, "higher"|"lower")] —
+    в какую сторону лучше. → список регрессий больше tolerance (доля).
+    """
+    with open(path, encoding="utf-8") as f:
+        baseline = {tuple(r[k] for k in key_fields): r for r in json.load(f)}
+    regressions = []
+    for r in results:
+        base = baseline.get(tuple(r[k] for k in key_fields))
+        if not base:
+            continue
+        for field, better in checks:
+            old, new = base.get(field), r.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old if better == "lower" else (old - new) / old
+            if change > tolerance:
+                label = " ".join(str(r[k]) for k in key_fields)
+                regressions.append(f"{label}: {field} {old:.4g} → {new:.4g} ({change:+.0%})")
+    return regressions
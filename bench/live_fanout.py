@@ -0,0 +1,140 @@
+"""
+Live updates vs polling against the mock upstream (bench/mock_upstream.py):
+N clients watching one account either poll /api/balance and
+/api/transactions?_=<ts> every --refresh seconds (what the webapp did), or
+hold N /api/live streams. Reports upstream calls for each mode and, for
+the streams, the time from new on-chain activity (mock /_activity) to the
+"tx" and "balance" events on every subscriber.
+
+    python bench/live_fanout.py
+    python bench/live_fanout.py --server sync --subscribers 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+import harness  # noqa: E402
+from mock_upstream import mock_env  # noqa: E402
+
+MOCK_PORT, SERVER_PORT = 9930, 9931
+
+
+def _mock(path, method="GET"):
+    req = urllib.request.Request(f"http://127.0.0.1:{MOCK_PORT}{path}", method=method)
+    with urllib.request.urlopen(req) as r:
+        return json.load(r)
+
+
+def _upstream_calls():
+    return sum(v for k, v in _mock("/_stats").items() if k in ("rpc", "nearblocks", "fastnear", "intear", "ref", "coingecko"))
+
+
+async def _poll(base, account, clients, refresh, duration):
+    async with aiohttp.ClientSession(base) as client:
+        async def one():
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                for path in (f"/api/balance/{account}", f"/api/transactions/{account}?limit=10&_={time.time()}"):
+                    async with client.get(path) as r:
+                        await r.read()
+                await asyncio.sleep(refresh)
+        await asyncio.gather(*(one() for _ in range(clients)))
+
+
+async def _listen(client, account, deadline, seen, ready):
+    """События одного подписчика: имя события → момент первого получения."""
+    async with client.get(f"/api/live?accounts={account}") as r:
+        if r.status != 200:
+            seen["status"] = r.status
+            ready.set()
+            return
+        event = None
+        while time.perf_counter() < deadline:
+            try:
+                line = await asyncio.wait_for(r.content.readline(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                break
+            line = line.decode().strip()
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                seen.setdefault(event or "message", time.perf_counter())
+                if event == "snapshot":
+                    ready.set()
+                event = None
+
+
+async def _live(base, account, clients, duration, settle):
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=None)
+    async with aiohttp.ClientSession(base, timeout=timeout, connector=aiohttp.TCPConnector(limit=0)) as client:
+        deadline = time.perf_counter() + duration
+        seen = [{} for _ in range(clients)]
+        ready = [asyncio.Event() for _ in range(clients)]
+        tasks = [asyncio.create_task(_listen(client, account, deadline, s, e)) for s, e in zip(seen, ready)]
+        await asyncio.wait_for(asyncio.gather(*(e.wait() for e in ready)), settle + duration)
+        t0 = time.perf_counter()
+        await asyncio.to_thread(_mock, f"/_activity/{account}", "POST")
+        await asyncio.gather(*tasks)
+    return seen, t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=("sync", "async"), default="async")
+    parser.add_argument("--subscribers", type=int, default=50)
+    parser.add_argument("--refresh", type=float, default=2, help="LIVE_REFRESH_SECONDS and the polling period")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.pop("UPSTASH_REDIS_URL", None)
+    env.update(mock_env(MOCK_PORT))
+    env.update({"PORT": str(SERVER_PORT), "WEB_CONCURRENCY": "1", "GUNICORN_THREADS": str(args.subscribers + 8),
+                "LIVE_REFRESH_SECONDS": str(args.refresh), "LIVE_SYNC_STREAMS": str(args.subscribers),
+                "LIVE_MAX_STREAMS": str(max(args.subscribers, 100)), "MARKET_POLL_SECONDS": "0"})
+    mock = [sys.executable, "bench/mock_upstream.py", "--port", str(MOCK_PORT), "--latency-ms", str(args.latency_ms)]
+    if args.server == "async":
+        server = [sys.executable, "-m", "uvicorn", "api_async:app", "--port", str(SERVER_PORT), "--log-level", "warning"]
+    else:
+        server = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "api:create_app()"]
+    procs = [harness.spawn(mock, env)]
+    try:
+        harness.wait_ready(f"http://127.0.0.1:{MOCK_PORT}/_stats")
+        procs.append(harness.spawn(server, env))
+        base = f"http://127.0.0.1:{SERVER_PORT}"
+        harness.wait_ready(f"{base}/api/health", timeout=60)
+        print(f"server={args.server} clients={args.subscribers} refresh={args.refresh:.0f}s "
+              f"duration={args.duration:.0f}s upstream latency={args.latency_ms:.0f}ms")
+
+        before = _upstream_calls()
+        asyncio.run(_poll(base, "poller.near", args.subscribers, args.refresh, args.duration))
+        polled = _upstream_calls() - before
+        print(f"polling  upstream calls: {polled:6d}")
+
+        before = _upstream_calls()
+        seen, t0 = asyncio.run(_live(base, "watched.near", args.subscribers, args.duration, settle=args.refresh * 3))
+        pushed = _upstream_calls() - before
+        rejected = sum(1 for s in seen if "status" in s)
+        print(f"live     upstream calls: {pushed:6d}  ({polled / max(pushed, 1):.1f}× fewer), rejected streams: {rejected}")
+        for event in ("tx", "balance"):
+            lags = sorted(s[event] - t0 for s in seen if event in s)
+            if lags:
+                print(f"  {event:8s} delivered to {len(lags):3d}/{args.subscribers}  "
+                      f"p50 {harness.percentile(lags, 0.5):5.2f}s  max {lags[-1]:5.2f}s after activity")
+            else:
+                print(f"  {event:8s} delivered to   0/{args.subscribers}")
+    finally:
+        harness.stop(procs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Load test: sync Flask (gunicorn gthread) vs async app (uvicorn) against the
+local mock upstream.
+
+    python bench/loadtest_async.py --clients 100 --duration 10 --latency-ms 150
+
+Every request uses a fresh account id, so each one misses the cache and
+goes to the (mock) upstream — this measures the I/O path, not cache hits.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+from harness import drive, fresh_accounts, percentile, spawn, stop, wait_ready  # noqa: E402
+from mock_upstream import mock_env  # noqa: E402
+
+ROUTES = {
+    "balance": "/api/balance/{acct}",
+    "transactions": "/api/transactions/{acct}",
+    "stats": "/api/stats/{acct}",
+    "nfts": "/api/nfts/{acct}",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--threads", type=int, default=32, help="gunicorn threads for the sync server")
+    parser.add_argument("--routes", default="balance,transactions,stats,nfts")
+    args = parser.parse_args()
+
+    env = {k: v for k, v in os.environ.items() if k != "UPSTASH_REDIS_URL"}
+    env.update(mock_env(9900))
+    procs = [
+        spawn([sys.executable, "bench/mock_upstream.py", "--port", "9900", "--latency-ms", str(args.latency_ms)], env),
+        spawn([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "api:create_app()"],
+              {**env, "PORT": "9901", "WEB_CONCURRENCY": "1", "GUNICORN_THREADS": str(args.threads)}),
+        spawn([sys.executable, "-m", "uvicorn", "api_async:app", "--port", "9902", "--log-level", "warning"], env),
+    ]
+    try:
+        for port in (9900, 9901, 9902):
+            wait_ready(f"http://127.0.0.1:{port}/" + ("rpc" if port == 9900 else "api/health"))
+        print(f"{args.clients} clients, {args.duration:.0f}s per run, upstream latency {args.latency_ms:.0f} ms")
+        print(f"{'route':14s} {'server':22s} {'req/s':>8s} {'p50 ms':>8s} {'p99 ms':>8s} {'errors':>7s}")
+        for route in args.routes.split(","):
+            for label, port in ((f"sync 1×{args.threads} threads", 9901), ("async 1 worker", 9902)):
+                paths = fresh_accounts(ROUTES[route], "near")
+                rps, lat, errors = asyncio.run(drive(f"http://127.0.0.1:{port}", paths, args.clients, args.duration))
+                p50, p99 = percentile(lat, 0.50) * 1000, percentile(lat, 0.99) * 1000
+                print(f"{route:14s} {label:22s} {rps:8.1f} {p50:8.1f} {p99:8.1f} {errors:7d}")
+    finally:
+        stop(procs)
+
+
+if __name__ == "__main__":
+    main()
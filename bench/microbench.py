@@ -0,0 +1,280 @@
+"""
+Microbenchmarks of the CPU-heavy parts of a request, on the recorded
+fixtures (bench/fixtures/), without any network:
+
+  analyze_transaction_group  — every txn group of the profile's history
+  compute_analytics          — over the analyzed history
+  get_tokens_with_prices     — full call; upstream_module sends through an
+                               in-process transport serving the fixtures, so
+                               governor / metrics / tracing overhead is included
+  classify_tokens            — its pricing + spam/major split alone
+  classify_tokens airdrop    — the same plus --airdrops synthetic spam /
+                               dust tokens (wallets that got airdropped to)
+  build_nft_page             — fetch_all_nfts_paged normalization, one page of
+                               24 and 48 and the whole NFT inventory
+  nft10k                     — synthetic 10k-token inventory (12 contracts,
+                               3 KB data-URI icons): the old dict-per-token
+                               loop vs rows, rows + one page, rows + all;
+                               CPU and tracemalloc peak
+  prices_at                  — one batched history lookup: 90 daily points
+                               for 12 tokens with 90 days of hourly backfill
+
+    python bench/microbench.py
+    python bench/microbench.py --only analyze,nft --profiles nft_whale
+    python bench/microbench.py --only nft10k
+    python bench/microbench.py --save micro.json
+    python bench/microbench.py --baseline micro.json --tolerance 0.15   # exit 1 on regression
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+os.environ.pop("UPSTASH_REDIS_URL", None)
+os.environ.setdefault("UPSTREAM_LIMITS", "nearblocks=100000/100000,coingecko=100000/100000")
+
+import harness  # noqa: E402
+from replay_upstream import FIXTURES_DIR  # noqa: E402
+
+NEAR_PRICE = 3.21
+
+
+def _load(name):
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class _FixtureResponse:
+    def __init__(self, data, status_code=200):
+        from requests.structures import CaseInsensitiveDict
+        self._data, self.status_code, self.headers = data, status_code, CaseInsensitiveDict()
+
+    def json(self):
+        return self._data
+
+
+class _FixtureTransport:
+    """Подменяет requests внутри upstream_module: ответы из фикстур, без сокетов."""
+
+    def __init__(self, real, fixture, markets, ref_api):
+        self._real, self.fixture, self.markets, self.ref_api = real, fixture, markets, ref_api
+
+    def __getattr__(self, name):
+        return getattr(self._real, name)  # Timeout, exceptions, ...
+
+    def request(self, method, url, **kwargs):
+        if url.endswith("/inventory"):
+            return _FixtureResponse(self.fixture["inventory"])
+        if url.endswith("/list-token-price"):
+            return _FixtureResponse(self.markets["ref_list" if url.startswith(self.ref_api) else "intear_list"])
+        if url.endswith("/simple/price"):
+            ids = (kwargs.get("params") or {}).get("ids", "").split(",")
+            return _FixtureResponse({i: self.markets["coingecko"][i] for i in ids if i in self.markets["coingecko"]})
+        return _FixtureResponse({"error": "not in fixture"}, 404)
+
+
+def _time(fn, repeat):
+    """Лучшее из repeat прогонов, мкс на вызов."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def _airdrop_tokens(n):
+    """n токенов в духе массовых airdrop: ссылки в symbol/name, пыль без цены."""
+    out = []
+    for i in range(n):
+        kind = i % 4
+        out.append({
+            "name": ("Visit www.claim-%d.io" % i, "You won %d NEAR" % i, "Dust %d" % i, "Project %d" % i)[kind],
+            "symbol": ("CLAIM%d.COM" % i, "REWARD%d" % i, "DUST%d" % i, "PRJ%d" % i)[kind],
+            "contract": f"drop{i}.airdrop{i % 50}.near",
+            "amount": 1000.0, "rawAmount": str(1000 * 10**18), "decimals": 18,
+            "icon": None, "nearblocks_price": 0,
+        })
+    return out
+
+
+def bench_history(repeat):
+    import time
+    import price_history_module as price_history
+
+    now = time.time()
+    ids = [f"coin-{i}" for i in range(12)]
+    for k, gecko_id in enumerate(ids):
+        prices = [[(now - h * 3600) * 1000, 1 + k + (h % 24) / 100] for h in range(90 * 24, -1, -1)]
+        price_history.apply_backfill(gecko_id, {"prices": prices})
+    stamps = [now - d * 86400 for d in range(89, -1, -1)]
+    queries = [(g, ts) for g in ids for ts in stamps]
+    us = _time(lambda: price_history.prices_at(queries), repeat)
+    print(f"{'prices_at 90d x 12 tokens':34s} {'-':13s} {us:12.1f} {len(queries):7d} {us / len(queries):10.2f}")
+    return [{"bench": "prices_at 90d x 12 tokens", "profile": "-", "us_per_call": round(us, 2), "items": len(queries)}]
+
+
+def _peak_kb(fn):
+    """tracemalloc-пик одного вызова (вход создан заранее и не считается), КБ."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def _synthetic_nfts(n, contracts):
+    icon = "data:image/svg+xml;base64," + "A" * 3000
+    metas = [{"name": f"Collection {c}", "icon": icon + str(c), "base_uri": f"https://cdn{c}.example/"}
+             for c in range(contracts)]
+    return [{
+        "token_id": str(i),
+        "contract_account_id": f"collection{i % contracts}.near",
+        "nft_meta": metas[i % contracts],
+        "metadata": {"title": f"Token {i}", "media": f"{i}.png"},
+    } for i in range(n)]
+
+
+def _dict_per_token(raw_tokens):
+    """Цикл fetch_all_nfts_paged до normalize_nft_tokens — точка отсчёта."""
+    import nft_module
+
+    tokens = []
+    for t in raw_tokens:
+        nft_meta = t.get("nft", {}) or {}
+        contract = t.get("contract_account_id") or t.get("contract") or nft_meta.get("contract", "")
+        contract_meta = t.get("nft_meta") or t.get("contract_meta") or {}
+        media = t.get("media") or nft_meta.get("media") or (t.get("metadata") or {}).get("media")
+        base_uri = contract_meta.get("base_uri") or nft_meta.get("base_uri")
+        icon = contract_meta.get("icon", "")
+        tokens.append({
+            "tokenId": t.get("token_id") or nft_meta.get("token_id", ""),
+            "title": t.get("title") or nft_meta.get("title") or (t.get("metadata") or {}).get("title") or f"#{t.get('token_id','?')}",
+            "media": nft_module.normalize_media(media, base_uri),
+            "contract": contract,
+            "contractName": contract_meta.get("name") or nft_module._contract_display_name(contract),
+            "contractIcon": icon[:5000] if icon and len(str(icon)) < 50000 else None,
+        })
+    return tokens
+
+
+def bench_nft_synthetic(repeat, n=10_000, contracts=12, per_page=48):
+    import nft_module
+
+    raw = _synthetic_nfts(n, contracts)
+
+    def page():
+        rows, table = nft_module.normalize_nft_tokens(raw)
+        return nft_module.serialize_nft_rows(rows, table, 0, per_page)
+
+    cases = [
+        ("nft10k dict-per-token (before)", lambda: _dict_per_token(raw)),
+        ("nft10k rows", lambda: nft_module.normalize_nft_tokens(raw)),
+        (f"nft10k rows + page of {per_page}", page),
+        ("nft10k rows + all", lambda: nft_module.serialize_nft_rows(*nft_module.normalize_nft_tokens(raw))),
+    ]
+    results = []
+    for bench, fn in cases:
+        us, peak = _time(fn, repeat), _peak_kb(fn)
+        print(f"{bench:34s} {'synthetic':13s} {us:12.1f} {n:7d} {us / n:10.2f}  peak {peak / 1024:5.1f} MB")
+        results.append({"bench": bench, "profile": "synthetic", "us_per_call": round(us, 2), "items": n,
+                        "peak_kb": round(peak)})
+    return results
+
+
+def bench_profile(name, markets, only, repeat, airdrops=0):
+    import api
+    import nft_module
+    import upstream_module
+
+    fx = _load(name)
+    account = fx["account"]
+    results = []
+
+    def add(bench, us, items):
+        results.append({"bench": bench, "profile": name, "us_per_call": round(us, 2), "items": items})
+        print(f"{bench:34s} {name:13s} {us:12.1f} {items:7d} {us / max(items, 1):10.2f}")
+
+    if "analyze" in only:
+        txns = api.parse_transaction_history(fx["txns"])
+        grouped = defaultdict(list)
+        for tx in txns:
+            grouped[tx["transaction_hash"]].append(tx)
+        groups = list(grouped.values())
+        add("analyze_transaction_group", _time(lambda: [api.analyze_transaction_group(g, account) for g in groups], repeat),
+            len(groups))
+        analyzed = api.analyze_transactions(txns, account)
+        add("compute_analytics", _time(lambda: api.compute_analytics(analyzed, NEAR_PRICE), repeat), len(analyzed))
+
+    if "tokens" in only:
+        real = upstream_module.http_requests
+        upstream_module.http_requests = _FixtureTransport(real, fx, markets, api.REF_FINANCE_API)
+        try:
+            n = len(fx["inventory"]["inventory"]["fts"])
+            add("get_tokens_with_prices", _time(lambda: api.get_tokens_with_prices(account), repeat), n)
+        finally:
+            upstream_module.http_requests = real
+        tokens = api.priced_tokens(api.parse_inventory_tokens(fx["inventory"]))
+        contracts = [t["contract"] for t in tokens]
+        intear = api.parse_intear_prices(markets["intear_list"], contracts)
+        ref = api.parse_ref_finance_prices(markets["ref_list"], contracts)
+        cg = api.parse_coingecko_prices(markets["coingecko"], api.coingecko_ids(contracts))
+        add("classify_tokens", _time(lambda: api.classify_tokens(tokens, intear, ref, cg), repeat), len(tokens))
+        if airdrops:
+            dropped = tokens + _airdrop_tokens(airdrops)
+            add(f"classify_tokens airdrop={airdrops}",
+                _time(lambda: api.classify_tokens(dropped, intear, ref, cg), repeat), len(dropped))
+
+    if "nft" in only:
+        nfts = fx["inventory_nfts"]["nfts"]
+        for per_page in (24, 48):
+            page = {"nfts": nfts[:per_page], "total": len(nfts)}
+            add(f"build_nft_page per_page={per_page}",
+                _time(lambda: nft_module.build_nft_page(page, 1, per_page), repeat), len(page["nfts"]))
+        full = {"nfts": nfts, "total": len(nfts)}
+        add("build_nft_page all", _time(lambda: nft_module.build_nft_page(full, 1, len(nfts)), repeat), len(nfts))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", default="small_wallet,hot_claimer,nft_whale")
+    parser.add_argument("--only", default="analyze,tokens,nft,nft10k,history",
+                        help="comma list of analyze, tokens, nft, nft10k, history")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--airdrops", type=int, default=3000, help="spam tokens added for classify_tokens airdrop")
+    parser.add_argument("--save", metavar="PATH", help="write results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with a saved run; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, fraction")
+    args = parser.parse_args()
+
+    markets = _load("markets")
+    only = set(args.only.split(","))
+    print(f"{'bench':34s} {'profile':13s} {'µs/call':>12s} {'items':>7s} {'µs/item':>10s}")
+    results = []
+    for name in args.profiles.split(","):
+        results.extend(bench_profile(name, markets, only, args.repeat, args.airdrops))
+    if "nft10k" in only:
+        results.extend(bench_nft_synthetic(args.repeat))
+    if "history" in only:
+        results.extend(bench_history(args.repeat))
+
+    if args.save:
+        harness.save_results(args.save, results)
+    if args.baseline:
+        regressions = harness.compare(args.baseline, results, ("bench", "profile"),
+                                      [("us_per_call", "lower")], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Local stand-in for every upstream NearPulse talks to (RPC, NearBlocks,
+FastNEAR, Intear, Ref, CoinGecko, DexScreener), with configurable latency.
+
+    python bench/mock_upstream.py --port 9900 --latency-ms 150
+
+--nearblocks-rps N makes the NearBlocks stub rate-limit like the real free
+plan: over N req/s it answers 429 with Retry-After. --slow intear=3000
+overrides latency for one provider, --fail fastnear makes it answer 503.
+
+/anthropic/v1/messages is a mock model: after the provider latency (time
+to first token) it produces --model-tokens words, one per --model-token-ms,
+as a JSON reply or, with "stream": true, as Anthropic-style SSE events.
+/_stats counts streams the client dropped before the end
+(anthropic_cancelled). Set ANTHROPIC_API_KEY to any value to enable AI.
+
+POST /_activity/<account_id> simulates new on-chain activity: the account
+gets one more incoming transfer (newest in its txns) and +1 NEAR balance.
+
+The RPC also serves a mock chain for follower_module: block (by
+finality or height) and chunk. One block per second, height = unix time,
+one chunk per block with --chain-txs noise transfers between synthetic
+accounts plus a bob.near → <account> transfer for every /_activity call
+made during that second.
+
+Point the API at it with the env printed on startup (mock_env()).
+Responses are synthetic but shaped like the real APIs, and deterministic
+per account id so repeated runs are comparable.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+LATENCY = 0.0
+NEARBLOCKS_RPS = 0.0
+_nb_window = [0.0, 0]  # начало секундного окна, запросов в нём
+MODEL_TOKENS = 60
+MODEL_TOKEN_DELAY = 0.03
+SLOW = {}     # provider → latency, s
+FAIL = set()  # providers answering 503
+CHAIN_TXS = 50
+STATS = {"nearblocks_429": 0}
+ACTIVITY = {}  # account → [ts новых транзакций]
+HISTORY_NS = int(time.time() * 1e9)  # история «закончилась» на старте мока: у хэша постоянное время
+
+
+def mock_env(port):
+    base = f"http://127.0.0.1:{port}"
+    return {
+        "NEAR_RPC_URL": f"{base}/rpc",
+        "NEARBLOCKS_API": f"{base}/nearblocks/v1",
+        "FASTNEAR_API": f"{base}/fastnear/v1",
+        "INTEAR_API": f"{base}/intear",
+        "COINGECKO_API": f"{base}/coingecko/api/v3",
+        "REF_FINANCE_API": f"{base}/ref",
+        "DEXSCREENER_API": f"{base}/dexscreener",
+        "ANTHROPIC_API_URL": f"{base}/anthropic",
+    }
+
+
+def _seed(account_id):
+    return int(hashlib.md5(account_id.encode()).hexdigest()[:8], 16)
+
+
+def _fts(account_id, n=40):
+    s = _seed(account_id)
+    fts = [
+        {"contract": "game.hot.tg", "amount": str(123_456_789 + s % 1000), "ft_meta": {"symbol": "HOT", "decimals": 6}},
+        {"contract": "usdt.tether-token.near", "amount": str(25_000_000 + s % 1000), "ft_meta": {"symbol": "USDt", "decimals": 6}},
+        {"contract": "wrap.near", "amount": str(3 * 10**24), "ft_meta": {"symbol": "wNEAR", "decimals": 24}},
+    ]
+    for i in range(n):
+        fts.append({
+            "contract": f"tok{i}-{s % 97}.tkn.near",
+            "amount": str((i + 1) * 10**18),
+            "ft_meta": {"symbol": f"T{i}", "name": f"Token {i}", "decimals": 18},
+        })
+    return fts
+
+
+def _txns(account_id, n=50):
+    receivers = ["game.hot.tg", "v2.ref-finance.near", "harvest-moon.near", "bob.near", "token.sweat"]
+    txns = []
+    for i in range(n):
+        r = receivers[i % len(receivers)]
+        txns.append({
+            "transaction_hash": f"h{i // 2}-{account_id}",
+            "predecessor_account_id": account_id,
+            "receiver_account_id": r,
+            "block_timestamp": str(HISTORY_NS - i * 3_600 * 10**9),
+            "actions": [{"action": "FUNCTION_CALL", "method": "claim" if "hot" in r else "ft_transfer",
+                         "args": {"amount": "1000"}}],
+            "actions_agg": {"deposit": str(10**23 if r == "bob.near" else 0)},
+            "outcomes_agg": {"transaction_fee": str(4 * 10**20)},
+        })
+    for k, ts in enumerate(ACTIVITY.get(account_id, [])):
+        txns.insert(0, {
+            "transaction_hash": f"live{k}-{account_id}",
+            "predecessor_account_id": "bob.near",
+            "receiver_account_id": account_id,
+            "block_timestamp": str(int(ts * 1e9)),
+            "actions": [{"action": "TRANSFER", "method": None}],
+            "actions_agg": {"deposit": str(10**24)},
+            "outcomes_agg": {"transaction_fee": str(4 * 10**20)},
+        })
+    return txns
+
+
+async def _sleep(provider):
+    """Задержка провайдера; для --fail провайдера — готовый 503."""
+    STATS[provider] = STATS.get(provider, 0) + 1
+    delay = SLOW.get(provider, LATENCY)
+    if delay:
+        await asyncio.sleep(delay)
+    if provider in FAIL:
+        return JSONResponse({"error": "unavailable"}, status_code=503)
+    return None
+
+
+async def rpc(request):
+    body = await request.json()
+    params = body.get("params", {})
+    if body.get("method") in ("block", "chunk"):
+        # блоки считаются отдельно: это трафик follower, а не запросов к аккаунтам
+        if failed := await _sleep("chain"):
+            return failed
+        return JSONResponse(_chain(body["method"], params))
+    if failed := await _sleep("rpc"):
+        return failed
+    if params.get("request_type") == "view_account":
+        extra = len(ACTIVITY.get(params["account_id"], [])) * 10**24
+        return JSONResponse({"result": {"amount": str(12 * 10**24 + extra + _seed(params["account_id"])),
+                                        "locked": "0", "storage_usage": 500}})
+    if params.get("request_type") == "call_function":
+        user = {"firespace": 2, "last_claimed_at": int((time.time() - 3600) * 1e9)}
+        return JSONResponse({"result": {"result": list(json.dumps(user).encode())}})
+    return JSONResponse({"error": "unsupported"})
+
+
+def _chain(method, params):
+    head = int(time.time()) - 1  # финальный — предыдущий
+    if method == "block":
+        height = head if params.get("finality") else int(params.get("block_id", 0))
+        if height > head:
+            return {"error": {"message": "unknown block", "cause": {"name": "UNKNOWN_BLOCK"}}}
+        return {"result": {"header": {"height": height, "hash": f"b{height}"},
+                           "chunks": [{"chunk_hash": f"c{height}", "height_included": height, "shard_id": 0}]}}
+    height = int(str(params.get("chunk_id", "c0"))[1:])
+    txs = [{"hash": f"n{height}-{i}", "signer_id": f"user{(height + i) % 997}.near",
+            "receiver_id": f"user{(height * 7 + i) % 997}.near", "actions": ["Transfer"]}
+           for i in range(CHAIN_TXS)]
+    receipts = []
+    for account, stamps in ACTIVITY.items():
+        for ts in stamps:
+            if int(ts) == height:
+                txs.append({"hash": f"a{height}-{account}", "signer_id": "bob.near", "receiver_id": account,
+                            "actions": [{"Transfer": {"deposit": str(10**24)}}]})
+                receipts.append({"predecessor_id": "bob.near", "receiver_id": account,
+                                 "receipt": {"Action": {"actions": [{"Transfer": {"deposit": str(10**24)}}]}}})
+    return {"result": {"transactions": txs, "receipts": receipts}}
+
+
+def _nearblocks_limited():
+    if not NEARBLOCKS_RPS:
+        return None
+    now = time.time()
+    if now - _nb_window[0] >= 1:
+        _nb_window[0], _nb_window[1] = now, 0
+    _nb_window[1] += 1
+    if _nb_window[1] <= NEARBLOCKS_RPS:
+        return None
+    STATS["nearblocks_429"] += 1
+    retry = max(1, int(_nb_window[0] + 1 - now + 0.999))
+    return JSONResponse({"error": "rate limited"}, status_code=429, headers={"Retry-After": str(retry)})
+
+
+async def nearblocks(request):
+    if failed := await _sleep("nearblocks"):
+        return failed
+    limited = _nearblocks_limited()
+    if limited:
+        return limited
+    path = request.path_params["path"]
+    parts = path.split("/")
+    if parts[0] == "kitwallet":
+        return JSONResponse([{"deposit": str(5 * 10**24), "validator_id": "pool.near"}])
+    if parts[0] == "account" and len(parts) >= 3:
+        account_id = parts[1]
+        if parts[2] == "txns":
+            return JSONResponse({"txns": _txns(account_id)})
+        if parts[2] == "inventory" and len(parts) == 4:
+            page = int(request.query_params.get("page", 1))
+            per_page = int(request.query_params.get("per_page", 24))
+            nfts = [{"token_id": str((page - 1) * per_page + i), "contract_account_id": f"coll{i % 3}.mintbase1.near",
+                     "nft": {"media": f"bafy{i:040d}"}, "nft_meta": {"name": f"Coll {i % 3}"}}
+                    for i in range(per_page)]
+            return JSONResponse({"nfts": nfts, "total": per_page * 5})
+        if parts[2] == "inventory":
+            return JSONResponse({"inventory": {"fts": _fts(account_id), "nfts": []}})
+    if parts[0] == "nfts":
+        return JSONResponse({"contracts": [{"name": parts[1], "symbol": "NFT", "icon": None}]})
+    return JSONResponse({"error": "not found"}, status_code=404)
+
+
+async def fastnear(request):
+    if failed := await _sleep("fastnear"):
+        return failed
+    account_id = request.path_params["account_id"]
+    s = _seed(account_id)
+    return JSONResponse({"tokens": {f"coll{i}.near": [str(j) for j in range((s + i) % 9 + 1)] for i in range(30)}})
+
+
+async def intear_price(request):
+    if failed := await _sleep("intear"):
+        return failed
+    return JSONResponse({"price": 3.21})
+
+
+async def intear_list(request):
+    if failed := await _sleep("intear"):
+        return failed
+    prices = {"usdt.tether-token.near": 1.0, "wrap.near": 3.21}
+    prices.update({f"tok{i}-{j}.tkn.near": 0.01 * (i + 1) for i in range(40) for j in range(0, 97, 7)})
+    return JSONResponse(prices)
+
+
+async def ref_list(request):
+    if failed := await _sleep("ref"):
+        return failed
+    return JSONResponse({"token.v2.ref-finance.near": {"price": "0.12"}})
+
+
+async def coingecko(request):
+    if failed := await _sleep("coingecko"):
+        return failed
+    ids = request.query_params.get("ids", "").split(",")
+    return JSONResponse({i: {"usd": 3.21 if i == "near" else 1.0} for i in ids if i})
+
+
+async def dexscreener(request):
+    if failed := await _sleep("dexscreener"):
+        return failed
+    pairs = [{"chainId": "near", "pairAddress": f"p{i}", "priceUsd": "3.21", "volume": {"h24": 1000 * i},
+              "baseToken": {"symbol": f"T{i}", "name": f"Token {i}", "address": f"tok{i}.near"}}
+             for i in range(30)]
+    return JSONResponse({"pairs": pairs})
+
+
+def _model_words(messages):
+    last = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    seed = _seed(str(last))
+    words = ["NEAR", "стейкинг", "газ", "HOT", "ликвидность", "портфель", "Ref", "токен", "рынок", "комиссия"]
+    return [words[(seed + i * 7) % len(words)] + " " for i in range(MODEL_TOKENS)]
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def anthropic_messages(request):
+    """Mock model: Anthropic Messages API, plain and streaming."""
+    if failed := await _sleep("anthropic"):
+        return failed
+    body = await request.json()
+    words = _model_words(body.get("messages", []))
+    usage = {"input_tokens": len(json.dumps(body)) // 4, "output_tokens": len(words)}
+    if not body.get("stream"):
+        await asyncio.sleep(MODEL_TOKEN_DELAY * len(words))
+        return JSONResponse({
+            "id": "msg_mock", "type": "message", "role": "assistant", "model": body.get("model"),
+            "content": [{"type": "text", "text": "".join(words)}], "stop_reason": "end_turn", "usage": usage,
+        })
+
+    async def events():
+        done = False
+        try:
+            yield _sse("message_start", {"type": "message_start", "message": {
+                "id": "msg_mock", "type": "message", "role": "assistant", "model": body.get("model"),
+                "content": [], "usage": {**usage, "output_tokens": 1}}})
+            yield _sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                               "content_block": {"type": "text", "text": ""}})
+            yield _sse("ping", {"type": "ping"})
+            for word in words:
+                await asyncio.sleep(MODEL_TOKEN_DELAY)
+                yield _sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                   "delta": {"type": "text_delta", "text": word}})
+            yield _sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+            yield _sse("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                                         "usage": {"output_tokens": len(words)}})
+            yield _sse("message_stop", {"type": "message_stop"})
+            done = True
+        finally:
+            if not done:
+                STATS["anthropic_cancelled"] = STATS.get("anthropic_cancelled", 0) + 1
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+async def otlp_traces(request):
+    """OTLP/HTTP JSON collector stand-in (TRACE_OTLP_URL=<base>/otlp/v1/traces)."""
+    body = await request.json()
+    spans = sum(len(ss["spans"]) for rs in body.get("resourceSpans", []) for ss in rs.get("scopeSpans", []))
+    STATS["otlp_traces"] = STATS.get("otlp_traces", 0) + 1
+    STATS["otlp_spans"] = STATS.get("otlp_spans", 0) + spans
+    return JSONResponse({"partialSuccess": {}})
+
+
+async def stats(request):
+    return JSONResponse(STATS)
+
+
+async def activity(request):
+    ACTIVITY.setdefault(request.path_params["account_id"], []).append(time.time())
+    return JSONResponse({"ok": True})
+
+
+app = Starlette(routes=[
+    Route("/rpc", rpc, methods=["POST"]),
+    Route("/nearblocks/v1/{path:path}", nearblocks),
+    Route("/fastnear/v1/account/{account_id}/nft", fastnear),
+    Route("/intear/get-token-price", intear_price),
+    Route("/intear/list-token-price", intear_list),
+    Route("/ref/list-token-price", ref_list),
+    Route("/coingecko/api/v3/simple/price", coingecko),
+    Route("/dexscreener/{path:path}", dexscreener),
+    Route("/anthropic/v1/messages", anthropic_messages, methods=["POST"]),
+    Route("/otlp/v1/traces", otlp_traces, methods=["POST"]),
+    Route("/_stats", stats),
+    Route("/_activity/{account_id}", activity, methods=["POST"]),
+])
+
+
+def main():
+    global LATENCY, NEARBLOCKS_RPS, MODEL_TOKENS, MODEL_TOKEN_DELAY, CHAIN_TXS
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9900)
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--nearblocks-rps", type=float, default=0)
+    parser.add_argument("--slow", action="append", default=[], metavar="PROVIDER=MS")
+    parser.add_argument("--fail", action="append", default=[], metavar="PROVIDER")
+    parser.add_argument("--model-tokens", type=int, default=MODEL_TOKENS, help="words in a mock model reply")
+    parser.add_argument("--model-token-ms", type=float, default=MODEL_TOKEN_DELAY * 1000)
+    parser.add_argument("--chain-txs", type=int, default=CHAIN_TXS, help="noise transactions per mock block")
+    args = parser.parse_args()
+    for item in args.slow:
+        name, ms = item.split("=", 1)
+        SLOW[name] = float(ms) / 1000
+    FAIL.update(args.fail)
+    LATENCY = args.latency_ms / 1000
+    NEARBLOCKS_RPS = args.nearblocks_rps
+    MODEL_TOKENS, MODEL_TOKEN_DELAY = args.model_tokens, args.model_token_ms / 1000
+    CHAIN_TXS = args.chain_txs
+    for k, v in mock_env(args.port).items():
+        print(f"export {k}={v}")
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", backlog=4096)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Fixture server: replays recorded upstream responses (bench/fixtures/) on
+the same URL layout as bench/mock_upstream.py, so the API is pointed at it
+with mock_env().
+
+    python bench/replay_upstream.py --port 9900            # recorded latencies
+    python bench/replay_upstream.py --port 9900 --latency-ms 0
+
+Accounts resolve to a profile by suffix: "hot-claimer.near" and
+"r17.hot-claimer.near" both get the hot_claimer fixture, with the account id
+rewritten in the body — run_bench.py uses fresh sub-accounts to force cache
+misses. Transaction timestamps are shifted so the newest one is "now".
+NearBlocks NFT inventory is paginated from the full recorded list.
+"""
+import argparse
+import asyncio
+import base64
+import glob
+import json
+import math
+import os
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from mock_upstream import mock_env
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PROVIDERS = ("rpc", "nearblocks", "fastnear", "intear", "ref", "coingecko", "dexscreener")
+LATENCY = {}   # provider → s
+FIXTURES = {}  # account → fixture
+MARKETS = {}
+STATS = {}
+
+
+class _Fixture:
+    """Ответы одного профиля, заранее сериализованные в текст."""
+
+    def __init__(self, data):
+        self.profile = data["profile"]
+        self.account = data["account"]
+        shift = int((time.time() - data.get("recordedAt", time.time())) * 1e9)
+        for tx in data["txns"].get("txns", []):
+            tx["block_timestamp"] = str(int(tx["block_timestamp"]) + shift)
+        if isinstance(data["hot_claim"].get("result", {}).get("result"), list):
+            user = json.loads(bytes(data["hot_claim"]["result"]["result"]))
+            if user.get("last_claimed_at"):
+                user["last_claimed_at"] += shift
+            data["hot_claim"]["result"]["result"] = list(json.dumps(user).encode())
+        self.txns = data["txns"].get("txns", [])
+        self.nfts = data["inventory_nfts"].get("nfts", [])
+        self.text = {
+            name: json.dumps(data[name])
+            for name in ("view_account", "hot_claim", "staking_deposits", "inventory", "fastnear_nft")
+        }
+        self.meta = {c: json.dumps(m) for c, m in data.get("nft_meta", {}).items()}
+        self._pages = {}
+        self._txn_pages = {}
+
+    def nft_page(self, page, per_page):
+        text = self._pages.get((page, per_page))
+        if text is None:
+            start = (page - 1) * per_page
+            text = self._pages[(page, per_page)] = json.dumps(
+                {"nfts": self.nfts[start:start + per_page], "total": len(self.nfts)})
+        return text
+
+    def txn_page(self, limit):
+        text = self._txn_pages.get(limit)
+        if text is None:
+            text = self._txn_pages[limit] = json.dumps({"txns": self.txns[:limit]})
+        return text
+
+
+def load(directory=FIXTURES_DIR):
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if os.path.basename(path) == "markets.json":
+            MARKETS.update(data)
+            for provider, ms in data.get("latency_ms", {}).items():
+                LATENCY.setdefault(provider, ms / 1000)
+        else:
+            fx = _Fixture(data)
+            FIXTURES[fx.account] = fx
+
+
+def fixture_for(account_id):
+    fx = FIXTURES.get(account_id)
+    if fx is None:
+        fx = FIXTURES.get(account_id.split(".", 1)[-1])
+    return fx
+
+
+def _reply(fx, account_id, text):
+    if fx.account != account_id:
+        text = text.replace(fx.account, account_id)
+    return Response(text, media_type="application/json")
+
+
+async def _sleep(provider):
+    STATS[provider] = STATS.get(provider, 0) + 1
+    delay = LATENCY.get(provider, 0)
+    if delay:
+        await asyncio.sleep(delay)
+
+
+def _unknown(account_id):
+    return JSONResponse({"error": f"no fixture for {account_id}"}, status_code=404)
+
+
+async def rpc(request):
+    await _sleep("rpc")
+    body = await request.json()
+    params = body.get("params", {})
+    if params.get("request_type") == "view_account":
+        account_id, name = params["account_id"], "view_account"
+    elif params.get("request_type") == "call_function":
+        account_id = json.loads(base64.b64decode(params.get("args_base64", "")) or "{}").get("account_id", "")
+        name = "hot_claim"
+    else:
+        return JSONResponse({"error": "unsupported"})
+    fx = fixture_for(account_id)
+    if fx is None:
+        return JSONResponse({"jsonrpc": "2.0", "id": body.get("id"),
+                             "error": {"name": "HANDLER_ERROR", "cause": {"name": "UNKNOWN_ACCOUNT"}}})
+    return _reply(fx, account_id, fx.text[name])
+
+
+async def nearblocks(request):
+    await _sleep("nearblocks")
+    parts = request.path_params["path"].split("/")
+    if parts[0] == "kitwallet" and len(parts) == 3:
+        fx = fixture_for(parts[2])
+        return _reply(fx, parts[2], fx.text["staking_deposits"]) if fx else JSONResponse([])
+    if parts[0] == "nfts" and len(parts) == 2:
+        for fx in FIXTURES.values():
+            if parts[1] in fx.meta:
+                return Response(fx.meta[parts[1]], media_type="application/json")
+        return JSONResponse({"contracts": []})
+    if parts[0] == "account" and len(parts) >= 3:
+        account_id = parts[1]
+        fx = fixture_for(account_id)
+        if fx is None:
+            return _unknown(account_id)
+        q = request.query_params
+        if parts[2] == "txns":
+            limit = int(q.get("per_page") or q.get("limit") or 25)
+            return _reply(fx, account_id, fx.txn_page(limit))
+        if parts[2] == "inventory" and len(parts) == 4:
+            return _reply(fx, account_id, fx.nft_page(int(q.get("page", 1)), int(q.get("per_page", 24))))
+        if parts[2] == "inventory":
+            return _reply(fx, account_id, fx.text["inventory"])
+    return JSONResponse({"error": "not found"}, status_code=404)
+
+
+async def fastnear(request):
+    await _sleep("fastnear")
+    account_id = request.path_params["account_id"]
+    fx = fixture_for(account_id)
+    return _reply(fx, account_id, fx.text["fastnear_nft"]) if fx else JSONResponse({"tokens": {}})
+
+
+def _market(name, provider):
+    async def handler(request):
+        await _sleep(provider)
+        return JSONResponse(MARKETS[name])
+    return handler
+
+
+async def coingecko(request):
+    await _sleep("coingecko")
+    ids = request.query_params.get("ids", "").split(",")
+    return JSONResponse({i: MARKETS["coingecko"][i] for i in ids if i in MARKETS["coingecko"]})
+
+
+async def coingecko_chart(request):
+    """Почасовая история за ?days= вокруг цены из фикстуры (волна ±5%), как /coins/<id>/market_chart."""
+    await _sleep("coingecko")
+    base = (MARKETS["coingecko"].get(request.path_params["gecko_id"]) or {}).get("usd")
+    if base is None:
+        return JSONResponse({"error": "coin not found"}, status_code=404)
+    now = int(time.time()) // 3600 * 3600
+    hours = int(float(request.query_params.get("days", 1)) * 24)
+    prices = [[(now - h * 3600) * 1000, base * (1 + 0.05 * math.sin(h / 24))] for h in range(hours, -1, -1)]
+    return JSONResponse({"prices": prices})
+
+
+async def dexscreener(request):
+    await _sleep("dexscreener")
+    if request.path_params["path"].startswith("token-profiles"):
+        return JSONResponse(MARKETS["dex_token_profiles"])
+    if request.path_params["path"].startswith("tokens/") and "dex_tokens" in MARKETS:
+        return JSONResponse(MARKETS["dex_tokens"])
+    return JSONResponse(MARKETS["dex_search"])
+
+
+async def stats(request):
+    return JSONResponse(STATS)
+
+
+app = Starlette(routes=[
+    Route("/rpc", rpc, methods=["POST"]),
+    Route("/nearblocks/v1/{path:path}", nearblocks),
+    Route("/fastnear/v1/account/{account_id}/nft", fastnear),
+    Route("/intear/get-token-price", _market("intear_price", "intear")),
+    Route("/intear/list-token-price", _market("intear_list", "intear")),
+    Route("/ref/list-token-price", _market("ref_list", "ref")),
+    Route("/coingecko/api/v3/simple/price", coingecko),
+    Route("/coingecko/api/v3/coins/{gecko_id}/market_chart", coingecko_chart),
+    Route("/dexscreener/{path:path}", dexscreener),
+    Route("/_stats", stats),
+])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9900)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--latency-ms", type=float, default=None,
+                        help="same latency for every provider instead of the recorded medians")
+    args = parser.parse_args()
+    load(args.fixtures)
+    if args.latency_ms is not None:
+        for provider in PROVIDERS:
+            LATENCY[provider] = args.latency_ms / 1000
+    print(f"replaying {', '.join(f'{fx.profile} ({a})' for a, fx in FIXTURES.items())}")
+    for k, v in mock_env(args.port).items():
+        print(f"export {k}={v}")
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", backlog=4096)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Offline route benchmark: every GET route of the Flask app against the
+fixture server (bench/replay_upstream.py), per wallet profile and
+concurrency level. Reports req/s, p50/p95/p99, server CPU and peak RSS.
+
+    python bench/run_bench.py                                  # all routes, all profiles
+    python bench/run_bench.py --concurrency 1,16,64 --duration 10
+    python bench/run_bench.py --routes balance,stats --profiles hot_claimer --cache hit
+    python bench/run_bench.py --server async --latency-ms 0   # CPU-bound view
+    python bench/run_bench.py --save base.json                 # before a change
+    python bench/run_bench.py --baseline base.json             # after: exit 1 on regression
+
+--cache miss (default) gives every request a fresh sub-account
+("b17.hot-claimer.near"), so the upstream path and the analysis run each
+time; --cache hit repeats the profile account and measures the cached path.
+Market routes and /api/health do not depend on the account; market routes
+are served from the background poller's snapshot. POST /api/ai/chat is not covered (it calls the model API).
+
+CPU is user+system time of the server process tree during the run
+(cpu ms/req is that divided by requests); peak RSS is the sum of VmHWM
+over the tree at the end of the run. Both need Linux /proc.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+import harness  # noqa: E402
+from mock_upstream import mock_env  # noqa: E402
+from replay_upstream import FIXTURES_DIR  # noqa: E402
+
+ROUTES = {
+    "balance": "/api/balance/{acct}",
+    "transactions": "/api/transactions/{acct}",
+    "stats": "/api/stats/{acct}",
+    "analytics": "/api/analytics/{acct}",
+    "portfolio": "/api/portfolio-history/{acct}?period=30d",
+    "nfts": "/api/nfts/{acct}",
+    "nft-tokens": "/api/nft-tokens/{acct}?page=2&per_page=24",
+    "nft-meta": "/api/nft-meta/{acct}/{contract}",
+    "nft-ids": "/api/nft-ids/{acct}/{contract}?limit=100",
+    "market-near": "/api/market/near",
+    "market-new": "/api/market/new-tokens",
+    "market-tokens": "/api/market/tokens",
+    "market-chart": "/api/market/chart/near?range=7d",
+    "health": "/api/health",
+    "index": "/",
+    "metrics": "/metrics",
+}
+ACCOUNT_FREE = {"market-near", "market-new", "market-tokens", "market-chart", "health", "index", "metrics"}
+UPSTREAM_PORT, SERVER_PORT = 9910, 9911
+
+
+def _profiles(names):
+    out = {}
+    for name in names:
+        with open(os.path.join(FIXTURES_DIR, f"{name}.json"), encoding="utf-8") as f:
+            data = json.load(f)
+        tokens = data["fastnear_nft"].get("tokens") or {}
+        # самая крупная коллекция — для nft-meta / nft-ids
+        contract = max(tokens, key=lambda c: len(tokens[c]), default="none.near")
+        out[name] = (data["account"], contract)
+    return out
+
+
+def _paths(route, account, contract, cache):
+    template = ROUTES[route].replace("{contract}", contract)
+    if route in ACCOUNT_FREE or cache == "hit":
+        return itertools.repeat(template.format(acct=account))
+    return harness.fresh_accounts(template, account)
+
+
+def _server_cmd(args):
+    if args.server == "async":
+        return [sys.executable, "-m", "uvicorn", "api_async:app", "--port", str(SERVER_PORT), "--log-level", "warning"]
+    return [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "api:create_app()"]
+
+
+def _env(args):
+    env = dict(os.environ)
+    if not args.redis:
+        env.pop("UPSTASH_REDIS_URL", None)
+    env.update(mock_env(UPSTREAM_PORT))
+    env.update({"PORT": str(SERVER_PORT), "WEB_CONCURRENCY": str(args.workers), "GUNICORN_THREADS": str(args.threads)})
+    if not args.real_limits:
+        # бюджеты free-плана NearBlocks/CoinGecko превратили бы прогон в замер governor'а
+        env["UPSTREAM_LIMITS"] = "nearblocks=100000/100000,coingecko=100000/100000,dexscreener=100000/100000"
+    return env
+
+
+def run(args):
+    profiles = _profiles(args.profiles.split(","))
+    routes = list(ROUTES) if args.routes == "all" else args.routes.split(",")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    env = _env(args)
+    replay = [sys.executable, "bench/replay_upstream.py", "--port", str(UPSTREAM_PORT)]
+    if args.latency_ms is not None:
+        replay += ["--latency-ms", str(args.latency_ms)]
+    procs = [harness.spawn(replay, env)]
+    harness.wait_ready(f"http://127.0.0.1:{UPSTREAM_PORT}/_stats")
+    server = harness.spawn(_server_cmd(args), env)
+    procs.append(server)
+    results = []
+    try:
+        harness.wait_ready(f"http://127.0.0.1:{SERVER_PORT}/api/health", timeout=60)
+        have_proc = harness.proc_stats_available()
+        latency = "recorded" if args.latency_ms is None else f"{args.latency_ms:.0f} ms"
+        print(f"server={args.server} cache={args.cache} upstream latency={latency} {args.duration:.0f}s per run")
+        print(f"{'route':13s} {'profile':13s} {'conc':>4s} {'req/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} "
+              f"{'p99 ms':>8s} {'err':>5s} {'cpu%':>6s} {'cpu ms/req':>10s} {'rss MB':>7s}")
+        for route in routes:
+            for profile, (account, contract) in profiles.items():
+                if route in ACCOUNT_FREE and profile != next(iter(profiles)):
+                    continue
+                for clients in levels:
+                    paths = _paths(route, account, contract, args.cache)
+                    if args.cache == "hit":
+                        asyncio.run(harness.drive(f"http://127.0.0.1:{SERVER_PORT}", paths, 1, 0.01))
+                    cpu0 = harness.cpu_seconds(server.pid) if have_proc else 0
+                    t0 = time.perf_counter()
+                    rps, lat, errors = asyncio.run(
+                        harness.drive(f"http://127.0.0.1:{SERVER_PORT}", paths, clients, args.duration))
+                    wall = time.perf_counter() - t0
+                    cpu = harness.cpu_seconds(server.pid) - cpu0 if have_proc else None
+                    row = {
+                        "server": args.server, "cache": args.cache, "route": route,
+                        "profile": "-" if route in ACCOUNT_FREE else profile, "concurrency": clients,
+                        "rps": round(rps, 1), "requests": len(lat), "errors": errors,
+                        "p50_ms": round(harness.percentile(lat, 0.50) * 1000, 2),
+                        "p95_ms": round(harness.percentile(lat, 0.95) * 1000, 2),
+                        "p99_ms": round(harness.percentile(lat, 0.99) * 1000, 2),
+                        "cpu_pct": round(cpu / wall * 100, 1) if cpu is not None else None,
+                        "cpu_ms_per_req": round(cpu / len(lat) * 1000, 3) if cpu is not None and lat else None,
+                        "peak_rss_mb": round(harness.peak_rss_mb(server.pid), 1) if have_proc else None,
+                    }
+                    results.append(row)
+                    print(f"{route:13s} {row['profile']:13s} {clients:4d} {rps:8.1f} {row['p50_ms']:8.1f} "
+                          f"{row['p95_ms']:8.1f} {row['p99_ms']:8.1f} {errors:5d} "
+                          f"{_fmt(row['cpu_pct'], 6, 1)} {_fmt(row['cpu_ms_per_req'], 10, 2)} "
+                          f"{_fmt(row['peak_rss_mb'], 7, 1)}")
+    finally:
+        harness.stop(procs)
+    return results
+
+
+def _fmt(value, width, digits):
+    return f"{value:{width}.{digits}f}" if value is not None else f"{'n/a':>{width}s}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=("sync", "async"), default="sync",
+                        help="sync: gunicorn api:create_app(); async: uvicorn api_async:app")
+    parser.add_argument("--routes", default="all", help=f"comma list of {', '.join(ROUTES)}")
+    parser.add_argument("--profiles", default="small_wallet,hot_claimer,nft_whale")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--cache", choices=("miss", "hit"), default="miss")
+    parser.add_argument("--latency-ms", type=float, default=None,
+                        help="override the recorded per-provider latency (0 = CPU-bound)")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--redis", action="store_true", help="keep UPSTASH_REDIS_URL from the environment")
+    parser.add_argument("--real-limits", action="store_true", help="keep the upstream rate limits")
+    parser.add_argument("--save", metavar="PATH", help="write results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with a saved run; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, fraction")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.save:
+        harness.save_results(args.save, results)
+    if args.baseline:
+        regressions = harness.compare(
+            args.baseline, results, ("server", "cache", "route", "profile", "concurrency"),
+            [("rps", "higher"), ("p95_ms", "lower"), ("cpu_ms_per_req", "lower")], args.tolerance,
+        )
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
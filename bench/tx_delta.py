@@ -0,0 +1,125 @@
+"""
+Delta transactions (?since=<cursor>) against the mock upstream and mock
+chain (bench/mock_upstream.py): each of N accounts is loaded once with the
+full list, then refreshed --rounds times either with the full list again
+(what the webapp did) or with ?since=<cursor>. Between rounds one
+transaction arrives on every --active-th account (mock /_activity); the
+chain follower drops its cached entries. Reports bytes on the wire per
+refresh for both modes and checks that every delta brought exactly the
+new transaction.
+
+With --workers N every request opens a new connection, so the full list
+and the delta of one account are usually served by different workers:
+a worker still holding the old txns_all: answers "nothing new" and the
+delta counts as missed. --redis keeps UPSTASH_REDIS_URL from the
+environment.
+
+    python bench/tx_delta.py
+    python bench/tx_delta.py --server sync --limit 50
+    UPSTASH_REDIS_URL=redis://localhost:6379 python bench/tx_delta.py --workers 2 --redis
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+import harness  # noqa: E402
+from mock_upstream import mock_env  # noqa: E402
+
+MOCK_PORT, SERVER_PORT = 9960, 9961
+
+
+def _activity(account):
+    req = urllib.request.Request(f"http://127.0.0.1:{MOCK_PORT}/_activity/{account}", method="POST")
+    with urllib.request.urlopen(req) as r:
+        r.read()
+
+
+async def _get(client, path):
+    """(байт по сети — Content-Length, со сжатием, если сервер сжал; JSON)."""
+    async with client.get(path) as r:
+        body = await r.read()
+        r.raise_for_status()
+    return int(r.headers.get("Content-Length", len(body))), json.loads(body)
+
+
+async def _scenario(base, accounts, active, rounds, limit, settle, workers):
+    sizes = {"full": [], "since": []}
+    missed = 0
+    # с несколькими воркерами keep-alive прилип бы к одному из них
+    connector = aiohttp.TCPConnector(force_close=workers > 1)
+    async with aiohttp.ClientSession(base, connector=connector) as client:
+        cursors = {}
+        for account in accounts:
+            _, data = await _get(client, f"/api/transactions/{account}?limit={limit}")
+            cursors[account] = data["cursor"]
+        for _ in range(rounds):
+            for account in active:
+                await asyncio.to_thread(_activity, account)
+            await asyncio.sleep(settle)  # блок с активностью + follower
+            for account in accounts:
+                size, _ = await _get(client, f"/api/transactions/{account}?limit={limit}")
+                sizes["full"].append(size)
+                size, data = await _get(client, f"/api/transactions/{account}?limit={limit}&since={cursors[account]}")
+                sizes["since"].append(size)
+                cursors[account] = data["cursor"]
+                expected = 1 if account in active else 0
+                if data["reset"] or len(data["transactions"]) != expected:
+                    missed += 1
+    return sizes, missed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=("sync", "async"), default="async")
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--active", type=int, default=4, help="every N-th account gets a transaction per round")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--redis", action="store_true", help="keep UPSTASH_REDIS_URL from the environment")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if not args.redis:
+        env.pop("UPSTASH_REDIS_URL", None)
+    env.update(mock_env(MOCK_PORT))
+    env.update({"PORT": str(SERVER_PORT), "WEB_CONCURRENCY": str(args.workers), "MARKET_POLL_SECONDS": "0",
+                "CHAIN_FOLLOW_SECONDS": "1", "FOLLOW_TTL": "3600"})
+    mock = [sys.executable, "bench/mock_upstream.py", "--port", str(MOCK_PORT), "--latency-ms", "20"]
+    if args.server == "async":
+        server = [sys.executable, "-m", "uvicorn", "api_async:app", "--port", str(SERVER_PORT), "--log-level", "warning",
+                  "--workers", str(args.workers)]
+    else:
+        server = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "api:create_app()"]
+    procs = [harness.spawn(mock, {**env, "WEB_CONCURRENCY": "1"})]  # мок — uvicorn, WEB_CONCURRENCY и его касается
+    try:
+        harness.wait_ready(f"http://127.0.0.1:{MOCK_PORT}/_stats")
+        procs.append(harness.spawn(server, env))
+        base = f"http://127.0.0.1:{SERVER_PORT}"
+        harness.wait_ready(f"{base}/api/health", timeout=60)
+        accounts = [f"acct{i}.near" for i in range(args.accounts)]
+        active = accounts[::args.active]
+        t0 = time.perf_counter()
+        sizes, missed = asyncio.run(_scenario(base, accounts, active, args.rounds, args.limit, 3, args.workers))
+        print(f"server={args.server} workers={args.workers} redis={'yes' if args.redis else 'no'} "
+              f"accounts={args.accounts} active={len(active)} rounds={args.rounds} "
+              f"limit={args.limit} ({time.perf_counter() - t0:.0f}s)")
+        for mode, values in sizes.items():
+            values.sort()
+            print(f"  {mode:6s} bytes/refresh  p50 {harness.percentile(values, 0.5):7.0f}  "
+                  f"max {values[-1]:7d}  total {sum(values):8d}")
+        print(f"  deltas with a missing/extra transaction or reset: {missed}")
+    finally:
+        harness.stop(procs)
+
+
+if __name__ == "__main__":
+    main()
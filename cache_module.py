@@ -0,0 +1,589 @@
+"""
+NearPulse — кэш (Upstash Redis + in-memory fallback) и HTTP-слой поверх него.
+
+Каждая запись хранит готовое тело ответа (JSON в байтах), хэш содержимого
+(ETag), время заполнения и сжатые варианты (gzip, br — если установлен
+brotli): вариант сжимается при первом ответе с этим Content-Encoding и
+дальше хранится в записи. Попадание в кэш отдаётся как есть: без json.loads
+и повторного jsonify; повторный запрос с If-None-Match отвечается 304.
+Данные (data) разбираются лениво — только если их просит cached().
+Тела меньше COMPRESS_MIN_BYTES не сжимаются — заголовки дороже выигрыша.
+
+?fields= проецирует ответ: "address,tokens.major" оставляет только эти
+поля, "-tokens.hidden" выбрасывает поле. Путь проходит сквозь списки
+("pairs.priceUsd" — только цена у каждой пары).
+
+Формат значения в Redis: "np1|<etag>|<ts>|<ttl>|<json>". При Redis копия
+записи в памяти процесса отдаётся без Upstash только CACHE_LOCAL_SECONDS:
+дальше её сверяют с Redis (там могла появиться запись другого воркера или
+сброс). Если ETag в Redis тот же, остаётся прежняя копия — вместе с
+разобранными данными и уже сжатыми вариантами. Без Redis копия процесса
+живёт весь TTL записи.
+
+Запись в Redis — write-behind: set_cache() кладёт SETEX в очередь фонового
+потока и не ждёт Upstash; поток отправляет накопившиеся записи одним
+pipeline. Чтение нескольких ключей (cached_entries, get_many,
+cached_response(prefetch=...)) — один MGET. flush_cache_writes() дожидается очереди — его
+зовут atexit и хук worker_exit в gunicorn.conf.py. invalidate() удаляет ключи
+через ту же очередь (DEL не обгонит SETEX того же ключа); on_store() —
+подписка на ключи, попавшие в память процесса: записанные им и прочитанные
+из Redis (индекс аккаунтов follower_module). ttl_policy() задаёт TTL записи
+при чтении: follower_module держит FOLLOW_TTL, только пока он здоров.
+
+Подключение к Redis не блокирует старт: connect_redis() поднимает фоновый
+поток (импорт redis, connect, ping), а до его успеха кэш работает только в
+памяти процесса. Обрыв соединения (redis_failed) сбрасывает клиента, и поток
+переподключается с backoff до REDIS_RETRY_MAX секунд — неудачный ping на
+старте больше не выключает Redis до перезапуска.
+
+Если запрос собран из ответов, которые upstream не дал (throttle, таймаут,
+5xx — см. upstream_module.degraded()), set_cache() ничего не сохраняет и
+отдаёт запись с ttl=0, чтобы не закэшировать нулевой баланс на 5 минут.
+"""
+import os
+import json
+import gzip
+import time
+import queue
+import atexit
+import hashlib
+import threading
+from email.utils import formatdate
+from flask import Response, request
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from upstream_module import degraded, failed_providers
+import metrics_module
+import tracing_module
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+UPSTASH_REDIS_URL = os.environ.get("UPSTASH_REDIS_URL", "")
+CACHE_TTL = 300  # 5 minutes
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+CACHE_LOCAL_SECONDS = float(os.environ.get("CACHE_LOCAL_SECONDS", 5))
+_ENVELOPE = "np1"
+_EMPTY_BODIES = {b"{}", b"[]", b"null", b"0", b"0.0", b'""', b"false"}
+_redis_client = None
+_mem_cache = {}
+_write_queue = None
+_writer_pid = None
+
+if not UPSTASH_REDIS_URL:
+    print("[Cache] No UPSTASH_REDIS_URL, using in-memory cache")
+
+
+# ─── Redis connection ──────────────────────────────────────────────────────
+# Ни импорт redis (~130 мс), ни соединение с Upstash не происходят при
+# импорте модуля. Первый redis_client() (или connect_redis() из warm_up /
+# post_fork) запускает фоновое подключение; пока его нет, кэш работает
+# только в памяти процесса, и запросы не ждут Upstash. Обрыв соединения
+# (redis_failed) переводит в тот же режим до успешного фонового переподключения
+# с backoff до REDIS_RETRY_MAX секунд.
+REDIS_CONNECT_TIMEOUT = float(os.environ.get("REDIS_CONNECT_TIMEOUT", 2))
+REDIS_RETRY_MAX = 30
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 16))
+REDIS_POOL_TIMEOUT = 2
+WRITE_BATCH = 64  # SETEX / DEL в одном pipeline фонового писателя
+_redis_lock = threading.Lock()
+_redis_lib = None
+_redis_connecting = False
+_redis_pid = None
+
+
+def _open_redis():
+    global _redis_lib
+    if _redis_lib is None:
+        import redis as redis_lib
+        _redis_lib = redis_lib
+    # Один ограниченный пул на процесс: потоки gthread берут соединение на
+    # время команды и ждут свободного до REDIS_POOL_TIMEOUT, а не открывают
+    # новое TLS-соединение к Upstash на каждый всплеск
+    pool = _redis_lib.BlockingConnectionPool.from_url(
+        UPSTASH_REDIS_URL, decode_responses=True,
+        max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=3, socket_connect_timeout=REDIS_CONNECT_TIMEOUT, health_check_interval=30,
+    )
+    client = _redis_lib.Redis(connection_pool=pool)
+    client.ping()
+    return client
+
+
+def _connect_loop(first):
+    global _redis_client, _redis_connecting
+    delay = 1.0
+    while True:
+        t0 = time.perf_counter()
+        try:
+            client = _open_redis()
+        except Exception as e:
+            if first:
+                print(f"[Cache] Redis connection failed ({e}), using in-memory cache; retrying in background")
+                first = False
+            time.sleep(delay)
+            delay = min(delay * 2, REDIS_RETRY_MAX)
+            continue
+        with _redis_lock:
+            _redis_client, _redis_connecting = client, False
+        print(f"[Cache] Upstash Redis connected in {(time.perf_counter() - t0) * 1000:.0f} ms")
+        return
+
+
+def connect_redis():
+    """Запустить фоновое подключение, если его ещё нет (в этом процессе)."""
+    global _redis_client, _redis_connecting, _redis_pid
+    if not UPSTASH_REDIS_URL:
+        return
+    with _redis_lock:
+        if _redis_pid != os.getpid():  # после fork соединение и поток master не наследуются
+            _redis_client, _redis_connecting, _redis_pid = None, False, os.getpid()
+        if _redis_client is not None or _redis_connecting:
+            return
+        _redis_connecting = True
+    threading.Thread(target=_connect_loop, args=(True,), name="redis-connect", daemon=True).start()
+
+
+def redis_failed(error):
+    """Сбой соединения на операции: отключить Redis до переподключения в фоне."""
+    global _redis_client
+    if _redis_lib is None or not isinstance(error, (_redis_lib.ConnectionError, _redis_lib.TimeoutError)):
+        return
+    with _redis_lock:
+        if _redis_client is None:
+            return
+        _redis_client = None
+    print(f"[Cache] Redis connection lost ({error}), using in-memory cache until reconnect")
+    connect_redis()
+
+
+def dump_json(data):
+    return json.dumps(data, default=str, ensure_ascii=False, separators=(",", ":"))
+
+
+def content_etag(body):
+    if isinstance(body, str):
+        body = body.encode()
+    return hashlib.blake2b(body, digest_size=8).hexdigest()
+
+
+def _encoded(entry, encoding):
+    """Сжатое тело записи; считается при первом запросе варианта и остаётся в записи."""
+    body = entry.get(encoding)
+    if body is None:
+        raw = entry["body"]
+        body = entry[encoding] = brotli.compress(raw, quality=5) if encoding == "br" else gzip.compress(raw, 6, mtime=0)
+    return body
+
+
+def _make_entry(body, etag, ts, ttl, data=None):
+    # at — когда копия появилась в памяти процесса (см. CACHE_LOCAL_SECONDS)
+    entry = {"body": body, "etag": etag, "ts": ts, "ttl": ttl, "at": time.time()}
+    if data is not None:
+        entry["data"] = data
+    return entry
+
+
+def _pack(entry):
+    return f"{_ENVELOPE}|{entry['etag']}|{entry['ts']:.0f}|{entry['ttl']}|{entry['body'].decode()}"
+
+
+def _unpack(raw, local=None):
+    """Значение из Redis → запись. local — копия процесса: при том же ETag она и остаётся."""
+    if raw.startswith(_ENVELOPE + "|"):
+        _, etag, ts, ttl, body = raw.split("|", 4)
+        if local is not None and local["etag"] == etag:
+            local["ts"], local["ttl"], local["at"] = float(ts), int(ttl), time.time()
+            return local
+        return _make_entry(body.encode(), etag, float(ts), int(ttl))
+    # Значение старого формата (чистый JSON) — досчитываем ETag на лету
+    return _make_entry(raw.encode(), content_etag(raw), time.time(), CACHE_TTL)
+
+
+_ttl_policy = None
+
+
+def ttl_policy(fn):
+    """fn(key, ttl записи) → TTL, с которым она свежа при чтении (follower_module.read_ttl)."""
+    global _ttl_policy
+    _ttl_policy = fn
+
+
+def _fresh(key, entry):
+    if entry is None:
+        return False
+    ttl = entry["ttl"] if _ttl_policy is None else _ttl_policy(key, entry["ttl"])
+    return time.time() - entry["ts"] < ttl
+
+
+def _local(entry):
+    """Копию процесса можно отдать, не сверяясь с Redis."""
+    return time.time() - entry["at"] < CACHE_LOCAL_SECONDS
+
+
+def redis_client():
+    """Клиент, если соединение уже есть; иначе None (и фоновое подключение). Не блокирует."""
+    if _redis_client is None or _redis_pid != os.getpid():
+        connect_redis()
+    return _redis_client
+
+
+def has_redis():
+    return redis_client() is not None
+
+
+def local_entry(key):
+    """Копия процесса, если её можно отдать без Redis; без учёта в метриках."""
+    entry = _mem_cache.get(key)
+    return entry if _fresh(key, entry) and (_local(entry) or not has_redis()) else None
+
+
+def cached_entry(key, use_redis=True):
+    """use_redis=False — только копия процесса (event loop в api_async)."""
+    return cached_entries((key,), use_redis)[key]
+
+
+def cached_entries(keys, use_redis=True):
+    """
+    Записи нескольких ключей → {key: entry | None}. Чего нет в памяти
+    процесса, читается из Redis одним MGET, а не GET на каждый ключ.
+    """
+    client = redis_client() if use_redis else None
+    found, missing = {}, {}
+    for key in keys:
+        entry = _mem_cache.get(key)
+        if _fresh(key, entry) and (client is None or _local(entry)):
+            metrics_module.cache_lookup(key, "hit")
+            found[key] = entry
+        else:
+            found[key] = None
+            missing[key] = "miss" if entry is None else "stale"
+    filled = []
+    if client is not None and missing:
+        try:
+            with tracing_module.span("cache.redis", keys=len(missing)):
+                values = client.mget([f"np:{key}" for key in missing])
+            for key, raw in zip(list(missing), values):
+                if not raw:
+                    _mem_cache.pop(key, None)  # в Redis записи нет: истекла или сброшена другим воркером
+                    continue
+                entry = _mem_cache[key] = _unpack(raw, _mem_cache.get(key))
+                if _fresh(key, entry):
+                    found[key] = entry
+                    filled.append(key)
+                    metrics_module.cache_lookup(key, "redis_hit")
+                    del missing[key]
+        except Exception as e:
+            redis_failed(e)
+            missing = dict.fromkeys(missing, "error")
+    if filled:
+        # копия из Redis — тоже ключ этого процесса: сброс по активности должен её найти
+        stored(filled)
+    for key, result in missing.items():
+        metrics_module.cache_lookup(key, result)
+    return found
+
+
+def entry_data(entry):
+    if "data" not in entry:
+        entry["data"] = json.loads(entry["body"])
+    return entry["data"]
+
+
+def cached(key):
+    entry = cached_entry(key)
+    return entry_data(entry) if entry else None
+
+
+def get_many(keys):
+    """{key: data | None} за один поход в Redis."""
+    return {key: entry_data(entry) if entry else None for key, entry in cached_entries(keys).items()}
+
+
+def _writer_loop(q):
+    while True:
+        batch = [q.get()]
+        while len(batch) < WRITE_BATCH:
+            try:
+                batch.append(q.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            client = redis_client()
+            if client is not None:
+                # Всё, что накопилось в очереди, уходит одним round-trip
+                pipe = client.pipeline(transaction=False)
+                for key, ttl, value in batch:
+                    if ttl is None:
+                        pipe.delete(key)  # invalidate(): в той же очереди, чтобы не обогнать SETEX
+                    else:
+                        pipe.setex(key, ttl, value)
+                pipe.execute()
+        except Exception as e:
+            print(f"[Cache] Redis write failed for {len(batch)} keys ({batch[0][0]}, ...): {e}")
+            redis_failed(e)
+        finally:
+            for _ in batch:
+                q.task_done()
+
+
+def _writes():
+    """Очередь записи текущего процесса (после fork поток нужно поднять заново)."""
+    global _write_queue, _writer_pid
+    if _writer_pid != os.getpid():
+        _write_queue = queue.Queue()
+        _writer_pid = os.getpid()
+        threading.Thread(target=_writer_loop, args=(_write_queue,), name="cache-writer", daemon=True).start()
+    return _write_queue
+
+
+def flush_cache_writes(timeout=5):
+    """Дождаться незаписанных SETEX (graceful shutdown)."""
+    q = _write_queue
+    if q is None or _writer_pid != os.getpid():
+        return True
+    deadline = time.time() + timeout
+    while q.unfinished_tasks and time.time() < deadline:
+        time.sleep(0.02)
+    return not q.unfinished_tasks
+
+
+atexit.register(flush_cache_writes)
+
+
+def set_cache(key, data, ttl=CACHE_TTL):
+    return set_many({key: data}, ttl)[key]
+
+
+def set_many(items, ttl=CACHE_TTL):
+    """{key: data} → {key: entry}. SETEX уходят в Redis одним pipeline фонового писателя."""
+    with tracing_module.span("cache.store"):
+        now = time.time()
+        entries = {}
+        skip = degraded()
+        for key, data in items.items():
+            body = dump_json(data).encode()
+            entries[key] = _make_entry(body, content_etag(body), now, 0 if skip else ttl, data)
+        if skip:
+            print(f"[Cache] Not caching {', '.join(items)}: upstream failed ({', '.join(failed_providers())})")
+            for key in items:
+                metrics_module.cache_skipped(key)
+            return entries
+    _mem_cache.update(entries)
+    if redis_client() is not None:
+        q = _writes()
+        for key, entry in entries.items():
+            q.put((f"np:{key}", ttl, _pack(entry)))
+    stored(entries)
+    return entries
+
+
+_store_hooks = []
+
+
+def on_store(fn):
+    """fn(keys) после каждой записи в кэш и чтения из Redis (индекс ключей аккаунтов в follower_module)."""
+    if fn not in _store_hooks:
+        _store_hooks.append(fn)
+
+
+def stored(keys):
+    for fn in _store_hooks:
+        fn(keys)
+
+
+def invalidate(keys):
+    """Удалить ключи из памяти процесса и (через очередь write-behind) из Redis."""
+    keys = list(keys)
+    for key in keys:
+        _mem_cache.pop(key, None)
+    if keys and redis_client() is not None:
+        q = _writes()
+        for key in keys:
+            q.put((f"np:{key}", None, None))
+
+
+# ─── HTTP ──────────────────────────────────────────────────────────────────
+# render_* не зависят от фреймворка: возвращают (status, body, headers) и
+# используются и Flask-обёртками ниже, и api_async.py.
+def _cache_headers(etag, ts, ttl, cap=None):
+    max_age = max(0, int(ttl - (time.time() - ts)))
+    if cap:
+        max_age, ttl = min(max_age, cap), min(ttl, cap)
+    return {
+        "ETag": quote_etag(etag),
+        "Last-Modified": formatdate(ts, usegmt=True),
+        "Cache-Control": f"public, max-age={max_age}, stale-while-revalidate={ttl}",
+    }
+
+
+def _negotiate(entry, accept):
+    if len(entry["body"]) < COMPRESS_MIN_BYTES:
+        return None
+    if brotli is not None and accept.quality("br") > 0:
+        return "br"
+    if accept.quality("gzip") > 0:
+        return "gzip"
+    return None
+
+
+def encode_body(body, accept_encoding):
+    """Сжатие «на лету» для ответов вне кэша → (encoding | None, body)."""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return None, body
+    accept = parse_accept_header(accept_encoding)
+    if brotli is not None and accept.quality("br") > 0:
+        return "br", brotli.compress(body, quality=4)
+    if accept.quality("gzip") > 0:
+        return "gzip", gzip.compress(body, 5, mtime=0)
+    return None, body
+
+
+def _render(etag, ts, ttl, if_none_match, make_body, cap=None):
+    headers = _cache_headers(etag, ts, ttl, cap)
+    if parse_etags(if_none_match).contains(etag):
+        return 304, b"", headers
+    encoding, body = make_body()
+    headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return 200, body, headers
+
+
+def render_entry(entry, if_none_match=None, accept_encoding=None, fields=None):
+    """Запись кэша → 304 при совпадении If-None-Match, иначе готовые байты."""
+    etag = f"{entry['etag']}.{content_etag(fields)[:8]}" if fields else entry["etag"]
+
+    def make_body():
+        if fields:
+            # Проекция — по требованию, сжимается на лету
+            return encode_body(dump_json(project(entry_data(entry), fields)).encode(), accept_encoding)
+        encoding = _negotiate(entry, parse_accept_header(accept_encoding))
+        return encoding, _encoded(entry, encoding) if encoding else entry["body"]
+
+    # запись может жить на сервере часами (follower_module сбросит её при новой
+    # активности аккаунта) — клиенту не дольше CACHE_TTL, дальше — If-None-Match
+    return _render(etag, entry["ts"], entry["ttl"], if_none_match, make_body, cap=CACHE_TTL)
+
+
+def render_json(data, ttl=CACHE_TTL, etag=None, if_none_match=None, accept_encoding=None, fields=None):
+    """Данные из локальных кэшей модулей (NFT): ETag по содержимому."""
+    if fields:
+        data = project(data, fields)
+        etag = f"{etag}.{content_etag(fields)[:8]}" if etag else None
+    body = dump_json(data).encode()
+    etag = etag or content_etag(body)
+    return _render(etag, time.time(), ttl, if_none_match, lambda: encode_body(body, accept_encoding))
+
+
+def is_empty(entry):
+    return entry is None or entry["body"] in _EMPTY_BODIES
+
+
+def _flask_response(rendered):
+    status, body, headers = rendered
+    resp = Response(body, status=status, mimetype="application/json" if status == 200 else None)
+    vary = headers.pop("Vary", None)
+    resp.headers.update(headers)
+    if vary:
+        resp.vary.add(vary)
+    return resp
+
+
+def _request_conditions():
+    return {
+        "if_none_match": request.headers.get("If-None-Match"),
+        "accept_encoding": request.headers.get("Accept-Encoding"),
+        "fields": request.args.get("fields"),
+    }
+
+
+def entry_response(entry):
+    return _flask_response(render_entry(entry, **_request_conditions()))
+
+
+def cached_response(key, prefetch=()):
+    """
+    Готовый ответ для ключа или None, если в кэше пусто. prefetch — ключи,
+    которые обработчик прочитает на промахе (near_price): тем же MGET.
+    """
+    entry = cached_entries((key, *prefetch))[key]
+    if is_empty(entry):
+        return None
+    return entry_response(entry)
+
+
+def cache_response(key, data, ttl=CACHE_TTL):
+    """Кладёт данные в кэш и возвращает ответ с ETag / Cache-Control."""
+    return entry_response(set_cache(key, data, ttl))
+
+
+def conditional_json(data, ttl=CACHE_TTL, etag=None):
+    return _flask_response(render_json(data, ttl, etag, **_request_conditions()))
+
+
+# ─── Field projection ──────────────────────────────────────────────────────
+def _pick(data, paths):
+    if isinstance(data, list):
+        return [_pick(item, paths) for item in data]
+    if not isinstance(data, dict):
+        return data
+    heads = {}
+    for path in paths:
+        heads.setdefault(path[0], []).append(path[1:])
+    out = {}
+    for head, tails in heads.items():
+        if head not in data:
+            continue
+        out[head] = data[head] if any(not t for t in tails) else _pick(data[head], tails)
+    return out
+
+
+def _drop(data, path):
+    if isinstance(data, list):
+        return [_drop(item, path) for item in data]
+    if not isinstance(data, dict) or path[0] not in data:
+        return data
+    if len(path) == 1:
+        return {k: v for k, v in data.items() if k != path[0]}
+    return {**data, path[0]: _drop(data[path[0]], path[1:])}
+
+
+def project(data, fields):
+    """Проекция по ?fields= без изменения исходных (закэшированных) данных."""
+    include, exclude = [], []
+    for f in fields.split(","):
+        f = f.strip()
+        if f.startswith("-") and len(f) > 1:
+            exclude.append(f[1:].split("."))
+        elif f:
+            include.append(f.split("."))
+    if include:
+        data = _pick(data, include)
+    for path in exclude:
+        data = _drop(data, path)
+    return data
+
+
+# ─── Compression middleware ────────────────────────────────────────────────
+def _compress_response(resp):
+    if (
+        resp.status_code != 200
+        or resp.direct_passthrough
+        or resp.is_streamed
+        or resp.mimetype != "application/json"
+        or "Content-Encoding" in resp.headers
+    ):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    encoding, body = encode_body(resp.get_data(), request.headers.get("Accept-Encoding"))
+    if encoding:
+        resp.set_data(body)
+        resp.headers["Content-Encoding"] = encoding
+    return resp
+
+
+def register_compression(app):
+    """Сжимает JSON-ответы, собранные на лету (промахи кэша, NFT, AI)."""
+    app.after_request(_compress_response)
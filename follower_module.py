@@ -0,0 +1,396 @@
+"""
+NearPulse — follower блоков NEAR: сброс кэша аккаунтов по активности в сети.
+
+Без него свежесть кэша — только TTL: данные либо устаревают до 5 минут,
+либо перезапрашиваются, хотя ничего не менялось. Follower читает финальные
+блоки (RPC block + chunk на каждый новый чанк) и для каждой транзакции и
+квитанции берёт затронутые аккаунты:
+
+  • signer_id / receiver_id транзакции, predecessor_id / receiver_id квитанции;
+  • receiver_id / account_id / owner_id / new_owner_id из аргументов
+    FunctionCall (ft_transfer, nft_transfer, storage_deposit...) — так
+    перевод токена находит получателя, а не только контракт.
+
+Аккаунты сверяются с индексом отслеживаемых (set — O(1) на аккаунт), и
+сбрасываются ровно их записи: balance:, txns:, txns_all:, stats:, nft_contracts:,
+nft_all:..., portfolio_history:... Индекс ключей строится из самих записей
+кэша (cache_module.on_store, nft_module) — и из копий, которые воркер
+прочитал из Redis, а не записал сам, — так что отслеживается каждый
+аккаунт, который кто-то запрашивал, в каждом воркере, где он лежит в памяти.
+
+Пока follower здоров (последний блок не старше HEALTHY_SECONDS), записи,
+которые зависят только от цепочки (txns:, txns_all:, списки NFT), живут FOLLOW_TTL
+вместо 5–10 минут: новая активность их сбросит. balance: и stats: держат
+обычный TTL — в них цены и таймер клейма HOT, которые меняются без блоков,
+но сбрасываются при активности так же. Здоровье проверяется и при чтении
+(read_ttl): если follower встал, записи с FOLLOW_TTL старше CACHE_TTL
+считаются устаревшими (только эти семейства: у token: и price_hist: свои
+долгие TTL).
+
+С Redis (несколько воркеров):
+  • цепочку читает один лидер (SET NX np:chain:leader, продление каждый тик);
+  • отслеживаемые аккаунты всех воркеров — ZSET np:chain:tracked (score —
+    время записи); лидер каждый тик дочитывает новые, целиком — раз в
+    TRACKED_SYNC_SECONDS;
+  • лидер кладёт затронутые аккаунты в ZSET np:chain:touched (score — высота)
+    и сразу удаляет из Redis ключи фиксированного вида (family:account);
+  • каждый воркер раз в тик читает ленту после своей высоты и сбрасывает
+    свои ключи (память процесса и Redis).
+Без Redis тот же процесс и читает цепочку, и сбрасывает.
+
+Разрыв — лидер отстал больше MAX_CATCHUP блоков или стартовал без
+сохранённой высоты рядом с головой — сбрасывает все отслеживаемые аккаунты
+("*"): что случилось в пропуске, неизвестно.
+
+Env:
+  CHAIN_FOLLOW_SECONDS — период опроса головы цепочки (0 — follower выключен; 1 — каждый блок)
+  CHAIN_RPC_URL        — RPC для block/chunk (по умолчанию NEAR_RPC_URL)
+  FOLLOW_TTL           — TTL txns: и списков NFT при здоровом follower, секунд (21600)
+"""
+import os
+import json
+import time
+import base64
+import socket
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import cache_module
+import metrics_module
+import upstream_module as upstream
+
+CHAIN_FOLLOW_SECONDS = float(os.environ.get("CHAIN_FOLLOW_SECONDS", 0))
+CHAIN_RPC_URL = os.environ.get("CHAIN_RPC_URL") or os.environ.get("NEAR_RPC_URL", "https://rpc.mainnet.near.org")
+FOLLOW_TTL = int(os.environ.get("FOLLOW_TTL", 6 * 3600))
+MAX_CATCHUP = 30            # блоков за тик; больше — разрыв
+HEALTHY_SECONDS = 30
+LEADER_TTL = 10
+TRACKED_SYNC_SECONDS = 10
+TRACKED_SKEW = 5            # запас при дочитывании np:chain:tracked: часы воркеров, запоздавший ZADD
+TOUCHED_KEEP = 600          # высот в ленте np:chain:touched
+CHUNK_WORKERS = 4
+REQUEST_TIMEOUT = 10
+ARGS_MAX = 4096             # аргументы FunctionCall длиннее не разбираем
+ARG_FIELDS = ("receiver_id", "account_id", "owner_id", "new_owner_id")
+ALL = "*"
+
+ACCOUNT_FAMILIES = ("balance", "txns", "txns_all", "stats", "nft_contracts", "nft_all", "portfolio_history")
+FIXED_FAMILIES = ("balance", "txns", "txns_all", "stats", "nft_contracts")  # ключ — ровно family:account
+FOLLOWED_FAMILIES = ("txns", "txns_all", "nft_contracts", "nft_all")  # пишутся с ttl(): FOLLOW_TTL при здоровом follower
+
+R_LEADER = "np:chain:leader"
+R_HEAD = "np:chain:head"        # "высота|ts" последнего обработанного блока
+R_TRACKED = "np:chain:tracked"  # аккаунт → время последней записи
+R_TOUCHED = "np:chain:touched"  # аккаунт → высота последней активности
+
+
+# ─── Key index ─────────────────────────────────────────────────────────────
+_keys = {}              # аккаунт → ключи кэша этого процесса
+_stored_at = {}         # аккаунт → время последней записи (старше FOLLOW_TTL — из индекса)
+_new_tracked = set()    # ещё не отправленные в np:chain:tracked
+_hooks = []             # fn(accounts, keys) после сброса
+_lock = threading.Lock()
+
+
+def account_of(key):
+    family, _, rest = key.partition(":")
+    if family not in ACCOUNT_FAMILIES or not rest:
+        return None
+    return rest.split(":", 1)[0]
+
+
+def track_keys(keys):
+    """Записанные ключи кэша → индекс аккаунтов (хук cache_module.on_store)."""
+    now = time.time()
+    with _lock:
+        for key in keys:
+            account = account_of(key)
+            if account:
+                _keys.setdefault(account, set()).add(key)
+                _stored_at[account] = now
+                _new_tracked.add(account)
+
+
+def _prune(now):
+    with _lock:
+        for account in [a for a, ts in _stored_at.items() if now - ts > FOLLOW_TTL]:
+            del _stored_at[account]
+            _keys.pop(account, None)
+
+
+def on_touch(fn):
+    """fn(accounts, keys) после сброса: NFT-кэш модуля, live-хаб."""
+    _hooks.append(fn)
+
+
+def apply(accounts):
+    """Сбросить ключи аккаунтов (ALL — все) в этом процессе и в Redis."""
+    with _lock:
+        if ALL in accounts:
+            accounts = set(_keys)
+        keys = set()
+        for account in accounts:
+            keys |= _keys.pop(account, set())
+            _stored_at.pop(account, None)
+    if not accounts:
+        return
+    cache_module.invalidate(keys)
+    metrics_module.chain_invalidated(len(accounts), len(keys))
+    for fn in _hooks:
+        try:
+            fn(accounts, keys)
+        except Exception as e:
+            print(f"[Follower] touch hook failed: {e}")
+
+
+# ─── Chain ─────────────────────────────────────────────────────────────────
+class UnknownBlock(Exception):
+    pass
+
+
+def _rpc(method, params, endpoint):
+    r = upstream.post("rpc", CHAIN_RPC_URL, endpoint=endpoint, timeout=REQUEST_TIMEOUT,
+                      json={"jsonrpc": "2.0", "id": "np", "method": method, "params": params})
+    if r.status_code != 200:
+        raise upstream.UpstreamError(f"RPC HTTP {r.status_code}")
+    data = r.json()
+    error = data.get("error")
+    if error:
+        if (error.get("cause") or {}).get("name") in ("UNKNOWN_BLOCK", "UNKNOWN_CHUNK"):
+            raise UnknownBlock(str(error.get("cause")))
+        raise upstream.UpstreamError(f"RPC error: {error.get('message') or error}")
+    return data["result"]
+
+
+def _arg_accounts(action, out):
+    call = action.get("FunctionCall") if isinstance(action, dict) else None
+    args = call.get("args") if call else None
+    if not args or len(args) > ARGS_MAX:
+        return
+    try:
+        decoded = json.loads(base64.b64decode(args))
+    except (ValueError, TypeError):
+        return
+    if isinstance(decoded, dict):
+        for field in ARG_FIELDS:
+            value = decoded.get(field)
+            if isinstance(value, str):
+                out.add(value)
+
+
+def chunk_accounts(chunk):
+    """Все аккаунты, которых касаются транзакции и квитанции чанка."""
+    out = set()
+    for tx in chunk.get("transactions") or []:
+        out.add(tx.get("signer_id"))
+        out.add(tx.get("receiver_id"))
+        for action in tx.get("actions") or []:
+            _arg_accounts(action, out)
+    for receipt in chunk.get("receipts") or []:
+        out.add(receipt.get("predecessor_id"))
+        out.add(receipt.get("receiver_id"))
+        body = (receipt.get("receipt") or {}).get("Action") or {}
+        for action in body.get("actions") or []:
+            _arg_accounts(action, out)
+    out.discard(None)
+    return out
+
+
+_pool = ThreadPoolExecutor(max_workers=CHUNK_WORKERS, thread_name_prefix="chain")
+
+
+def block_accounts(height):
+    """Аккаунты блока height (только чанки, включённые в этот блок). UnknownBlock — высота пропущена."""
+    block = _rpc("block", {"block_id": height}, "block")
+    hashes = [c["chunk_hash"] for c in block.get("chunks") or [] if c.get("height_included") == height]
+    # свой контекст на вызов — scope BACKGROUND доходит до потоков пула
+    futures = [_pool.submit(contextvars.copy_context().run, _rpc, "chunk", {"chunk_id": h}, "chunk") for h in hashes]
+    out = set()
+    for f in futures:
+        out |= chunk_accounts(f.result())
+    return out
+
+
+# ─── Leader: tail the chain ────────────────────────────────────────────────
+_height = None          # последняя обработанная лидером высота
+_leading = False
+_tracked = set()        # отслеживаемые всеми воркерами (копия np:chain:tracked)
+_tracked_at = 0.0
+_tracked_polled = 0.0
+
+
+def _is_leader(client):
+    global _leading, _height
+    if client is None:
+        return True
+    me = f"{socket.gethostname()}:{os.getpid()}"
+    leading = bool(client.set(R_LEADER, me, nx=True, ex=LEADER_TTL))
+    if not leading and client.get(R_LEADER) == me:
+        client.expire(R_LEADER, LEADER_TTL)
+        leading = True
+    if leading and not _leading:
+        _height = None  # пока лидером был другой воркер, высота ушла: продолжаем с np:chain:head
+    _leading = leading
+    return leading
+
+
+def _tracked_accounts(client):
+    global _tracked, _tracked_at, _tracked_polled
+    if client is None:
+        _prune(time.time())
+        with _lock:
+            return set(_keys)
+    with _lock:
+        local = set(_keys)
+    now = time.time()
+    if now - _tracked_at >= TRACKED_SYNC_SECONDS:
+        _prune(now)
+        client.zremrangebyscore(R_TRACKED, "-inf", now - FOLLOW_TTL)
+        _tracked, _tracked_at = set(client.zrangebyscore(R_TRACKED, now - FOLLOW_TTL, "+inf")), now
+    else:
+        # аккаунт, закэшированный другим воркером, иначе ждал бы полной синхронизации — и его активность терялась
+        _tracked |= set(client.zrangebyscore(R_TRACKED, _tracked_polled - TRACKED_SKEW, "+inf"))
+    _tracked_polled = now
+    return _tracked | local
+
+
+def publish(client, height, accounts):
+    """Затронутые на height аккаунты → лента (Redis) или сразу сброс (без Redis)."""
+    if client is None:
+        _set_head(height, time.time())
+        if accounts:
+            apply(accounts)
+        return
+    pipe = client.pipeline(transaction=False)
+    if accounts:
+        pipe.zadd(R_TOUCHED, {account: height for account in accounts})
+        if ALL not in accounts:
+            # ключи фиксированного вида — сразу, в том числе записанные уже ушедшим воркером
+            pipe.delete(*(f"np:{family}:{account}" for account in accounts for family in FIXED_FAMILIES))
+    pipe.zremrangebyscore(R_TOUCHED, "-inf", height - TOUCHED_KEEP)
+    pipe.set(R_HEAD, f"{height}|{time.time()}")
+    pipe.execute()
+
+
+def follow_once(client):
+    """Обработать блоки от прошлой высоты до финальной головы."""
+    global _height
+    head = _rpc("block", {"finality": "final"}, "block_final")["header"]["height"]
+    if _height is None:
+        stored = client.get(R_HEAD) if client is not None else None
+        _height = int(stored.split("|")[0]) if stored else head - 1
+    if head - _height > MAX_CATCHUP:
+        print(f"[Follower] gap {_height} → {head}: invalidating all tracked accounts")
+        metrics_module.chain_block("gap")
+        publish(client, head, {ALL})
+        _height = head
+        return
+    tracked = _tracked_accounts(client)
+    for height in range(_height + 1, head + 1):
+        try:
+            touched = block_accounts(height) & tracked
+            metrics_module.chain_block("ok")
+        except UnknownBlock:
+            touched = set()  # пропущенная высота — блока нет
+            metrics_module.chain_block("skipped")
+        publish(client, height, touched)
+        _height = height
+
+
+# ─── Every worker: apply the feed ──────────────────────────────────────────
+_seen = None            # высота, до которой лента уже применена
+_head = (0, 0.0)        # (высота, ts) последнего блока, который видел этот процесс
+
+
+def _set_head(height, ts):
+    global _head
+    _head = (height, ts)
+    metrics_module.chain_height(height)
+
+
+def sync_worker(client):
+    """Отправить новые отслеживаемые аккаунты и применить ленту после _seen."""
+    global _seen
+    with _lock:
+        fresh = set(_new_tracked)
+        _new_tracked.clear()
+    if fresh:
+        now = time.time()
+        client.zadd(R_TRACKED, {account: now for account in fresh})
+    stored = client.get(R_HEAD)
+    if not stored:
+        return
+    height, ts = stored.split("|")
+    height = int(height)
+    _set_head(height, float(ts))
+    if _seen is None:
+        _seen = height  # старую ленту не применяем: кэш этого процесса новее
+        return
+    if height <= _seen:
+        return
+    touched = client.zrangebyscore(R_TOUCHED, f"({_seen}", height)
+    _seen = height
+    if touched:
+        apply(set(touched))
+
+
+def healthy():
+    return CHAIN_FOLLOW_SECONDS > 0 and time.time() - _head[1] < HEALTHY_SECONDS
+
+
+def ttl(default):
+    """TTL для записи, которую сбросит follower: FOLLOW_TTL, пока он здоров."""
+    return max(FOLLOW_TTL, default) if healthy() else default
+
+
+def read_ttl(key, ttl):
+    """
+    TTL записи при чтении (cache_module.ttl_policy, NFT-кэш). Записи
+    FOLLOWED_FAMILIES с FOLLOW_TTL свежи, только пока follower здоров: если
+    он встал после записи (лидер умер, RPC не отвечает), сбросов больше не
+    будет, и они живут не дольше CACHE_TTL. Остальные ключи (token:,
+    price_hist: — свои долгие TTL) не трогаются.
+    """
+    if ttl < FOLLOW_TTL or healthy() or key.partition(":")[0] not in FOLLOWED_FAMILIES:
+        return ttl
+    return min(ttl, cache_module.CACHE_TTL)
+
+
+cache_module.ttl_policy(read_ttl)
+
+
+def _loop():
+    while True:
+        t0 = time.monotonic()
+        client = cache_module.redis_client()
+        with upstream.scope(upstream.BACKGROUND):
+            try:
+                if client is not None:
+                    sync_worker(client)
+                if _is_leader(client):
+                    follow_once(client)
+            except Exception as e:
+                metrics_module.chain_block("error")
+                print(f"[Follower] {e}")
+                cache_module.redis_failed(e)
+        time.sleep(max(CHAIN_FOLLOW_SECONDS - (time.monotonic() - t0), 0.2))
+
+
+_follower = None        # (pid, поток)
+
+
+def start():
+    """Запустить follower в этом процессе (повторный вызов и вызов после fork — безопасны)."""
+    global _follower, _seen, _height, _leading
+    if CHAIN_FOLLOW_SECONDS <= 0:
+        return False
+    cache_module.on_store(track_keys)
+    pid = os.getpid()
+    with _lock:
+        if _follower and _follower[0] == pid and _follower[1].is_alive():
+            return False
+        thread = threading.Thread(target=_loop, name="chain-follower", daemon=True)
+        _follower, _seen, _height, _leading = (pid, thread), None, None, False
+    thread.start()
+    print(f"[Follower] started: every {CHAIN_FOLLOW_SECONDS:g}s via {CHAIN_RPC_URL}")
+    return True
@@ -0,0 +1,48 @@
+"""
+Gunicorn config for the NearPulse Flask API (production).
+
+    gunicorn -c gunicorn.conf.py "api:create_app()"
+
+Env:
+  PORT              — порт (Render задаёт сам), по умолчанию 8080
+  WEB_CONCURRENCY   — процессы-воркеры, по умолчанию 2
+  GUNICORN_THREADS  — потоки на воркер, по умолчанию 32 (запросы в основном ждут upstream)
+  GUNICORN_TIMEOUT  — таймаут запроса, по умолчанию 60 с
+  GUNICORN_PRELOAD  — "0" отключает preload (фабрика и прогрев в каждом воркере)
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8080)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 32))
+worker_class = "gthread"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+# preload: api импортируется и прогревается (цена NEAR) один раз в master,
+# воркеры получают готовое состояние через fork
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # Соединение с Redis через fork не наследуется — воркер подключается в фоне сразу,
+    # не дожидаясь первого запроса
+    from cache_module import connect_redis
+    connect_redis()
+    # Поллер рынка — свой в каждом воркере (поток master через fork не переходит)
+    from market_module import start_poller
+    start_poller()
+    # Follower блоков: цепочку читает один воркер-лидер (через Redis), ленту сбросов — каждый
+    from follower_module import start as start_follower
+    start_follower()
+
+
+def worker_exit(server, worker):
+    # Дописываем в Redis всё, что осталось в очереди write-behind
+    from cache_module import flush_cache_writes
+    if not flush_cache_writes(timeout=10):
+        server.log.warning("cache writes not flushed before exit")
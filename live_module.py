@@ -0,0 +1,271 @@
+"""
+NearPulse — live-обновления: подписки на аккаунты и раздача изменений (SSE).
+
+Вместо того чтобы webapp опрашивал /api/balance и /api/transactions (да ещё
+с ?_=... мимо кэша), клиент открывает один поток /api/live?accounts=a,b и
+получает события, когда сервер сам замечает изменения:
+
+    event: snapshot    — текущая сводка аккаунта (сразу после подписки)
+    event: balance     — изменились near / staking / hot / totalUSD / суммы токенов
+    event: tx          — новые разобранные транзакции (как в /api/transactions) и cursor
+    event: hot_claim   — HOT снова можно клеймить (readyToClaim: false → true)
+    event: resync      — клиент не успевал читать, события выброшены: перечитать REST
+    : ping             — heartbeat раз в LIVE_HEARTBEAT_SECONDS (держит прокси)
+
+Хаб — один на процесс. Аккаунт с подписчиками обновляется одним фоновым
+потоком раз в LIVE_REFRESH_SECONDS, сколько бы клиентов на него ни смотрело:
+одно обновление → diff с прошлым состоянием → событие каждому подписчику.
+Само обновление (refresh) передаёт api.py через configure(): оно берёт
+balance:/txns: из общего кэша, если их записали после прошлого обновления
+этого хаба (запрос клиента или хаб другого воркера), иначе идёт в upstream
+и кладёт результат в кэш — REST-запросы клиентов после события попадают в кэш.
+Обновление, собранное из неудавшихся ответов upstream (degraded), не
+сравнивается — иначе нулевой баланс ушёл бы подписчикам как изменение.
+
+Подписка не зависит от фреймворка: Flask читает её блокирующим take(),
+api_async будит свой event loop через wake (call_soon_threadsafe).
+
+Env:
+  LIVE_REFRESH_SECONDS   — период обновления аккаунта с подписчиками (20)
+  LIVE_MAX_STREAMS       — одновременных потоков /api/live на процесс (100; 0 — выключено)
+  LIVE_SYNC_STREAMS      — из них во Flask (8): там каждый поток держит поток gunicorn
+  LIVE_HEARTBEAT_SECONDS — период heartbeat (15)
+"""
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import metrics_module
+import upstream_module as upstream
+
+LIVE_REFRESH_SECONDS = float(os.environ.get("LIVE_REFRESH_SECONDS", 20))
+LIVE_MAX_STREAMS = int(os.environ.get("LIVE_MAX_STREAMS", 100))
+LIVE_SYNC_STREAMS = int(os.environ.get("LIVE_SYNC_STREAMS", 8))
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get("LIVE_HEARTBEAT_SECONDS", 15))
+LIVE_MAX_ACCOUNTS = 10      # аккаунтов в одной подписке
+LIVE_QUEUE = 64             # непрочитанных событий на подписчика, дальше — resync
+LIVE_WORKERS = 4            # аккаунтов обновляется параллельно
+TICK = 1.0
+
+BALANCE_FIELDS = ("near", "staking", "hot", "totalUSD")
+
+
+# ─── Subscription ──────────────────────────────────────────────────────────
+class Subscription:
+    """Очередь событий одного клиента. push() — из потока хаба, take() — из обработчика."""
+
+    def __init__(self, accounts, wake=None):
+        self.accounts = accounts
+        self.wake = wake
+        self.closed = False
+        self._events = deque()
+        self._cond = threading.Condition()
+
+    def push(self, event, data):
+        with self._cond:
+            if len(self._events) >= LIVE_QUEUE:
+                # медленный клиент: копить бессмысленно — пусть перечитает состояние
+                self._events.clear()
+                event, data = "resync", {"accounts": self.accounts}
+            self._events.append((event, data))
+            self._cond.notify()
+        if self.wake and not self.closed:
+            self.wake()
+
+    def take(self, timeout=None):
+        """Все накопленные события [(event, data), ...]; [] — истёк timeout."""
+        with self._cond:
+            if not self._events and not self.closed:
+                self._cond.wait(timeout)
+            out = list(self._events)
+            self._events.clear()
+            return out
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+# ─── Diff ──────────────────────────────────────────────────────────────────
+class State:
+    """То, с чем сравнивается следующее обновление аккаунта."""
+
+    __slots__ = ("summary", "tokens", "tx_ids", "tx_since", "hot_ready")
+
+    def __init__(self, balance, txns):
+        self.summary = {f: balance.get(f) for f in BALANCE_FIELDS}
+        self.summary["hotClaim"] = balance.get("hotClaim")
+        self.tokens = {}
+        for category in ("major", "filtered"):
+            for t in (balance.get("tokens") or {}).get(category, []):
+                if t.get("contract"):
+                    self.tokens[t["contract"]] = t.get("amount")
+        listed = [tx for tx in txns.get("transactions", []) if tx.get("id")]
+        self.summary["latestTx"] = listed[0]["id"] if listed else None
+        self.tx_ids = {tx["id"] for tx in listed}
+        self.tx_since = max((tx.get("timestamp") or 0 for tx in listed), default=0)
+        self.hot_ready = bool((balance.get("hotClaim") or {}).get("readyToClaim"))
+
+
+def diff(account, old, new, txns):
+    """События [(event, data), ...] между двумя State одного аккаунта."""
+    events = []
+    changes = {f: {"from": old.summary[f], "to": new.summary[f]}
+               for f in BALANCE_FIELDS if old.summary[f] != new.summary[f]}
+    tokens = [{"contract": c, "from": old.tokens.get(c), "to": new.tokens.get(c)}
+              for c in old.tokens.keys() | new.tokens.keys() if old.tokens.get(c) != new.tokens.get(c)]
+    if changes or tokens:
+        events.append(("balance", {"account": account, "changes": changes, "tokens": tokens}))
+    # новые — не старше последней известной: кэш txns: мог быть записан с другим limit,
+    # и хвост длинного списка — это старые транзакции, а не новые
+    fresh = [tx for tx in txns.get("transactions", [])
+             if tx.get("id") and tx["id"] not in old.tx_ids and (tx.get("timestamp") or 0) >= old.tx_since]
+    if fresh:
+        # cursor — для /api/transactions?since=: клиент, добавивший fresh, догоняет с него
+        events.append(("tx", {"account": account, "transactions": fresh, "nearPrice": txns.get("nearPrice"),
+                              "cursor": txns.get("cursor")}))
+    if new.hot_ready and not old.hot_ready:
+        events.append(("hot_claim", {"account": account, "hotClaim": new.summary["hotClaim"]}))
+    return events
+
+
+def snapshot_event(account, state):
+    return "snapshot", {"account": account, **state.summary}
+
+
+# ─── Hub ───────────────────────────────────────────────────────────────────
+_refresh = None     # (account, since) → (balance_result, txns_result); задаёт api.py через configure()
+_subs = {}          # аккаунт → set(Subscription)
+_states = {}        # аккаунт → State последнего удачного обновления
+_due = {}           # аккаунт → monotonic-время следующего обновления
+_refreshed = {}     # аккаунт → время конца прошлого обновления (time.time())
+_streams = 0
+_lock = threading.Lock()
+_refresher = None   # (pid, поток)
+_pool = ThreadPoolExecutor(max_workers=LIVE_WORKERS, thread_name_prefix="live")
+
+
+def configure(refresh):
+    global _refresh
+    _refresh = refresh
+
+
+def parse_accounts(raw):
+    """"a.near,b.near" → список без повторов; ValueError — пусто или больше LIVE_MAX_ACCOUNTS."""
+    accounts = list(dict.fromkeys(a.strip().lower() for a in (raw or "").split(",") if a.strip()))
+    if not accounts:
+        raise ValueError("accounts is required")
+    if len(accounts) > LIVE_MAX_ACCOUNTS:
+        raise ValueError(f"at most {LIVE_MAX_ACCOUNTS} accounts per stream")
+    return accounts
+
+
+def subscribe(accounts, wake=None, limit=LIVE_MAX_STREAMS):
+    """Subscription или None, если открытых потоков уже limit (не больше LIVE_MAX_STREAMS)."""
+    global _streams
+    sub = Subscription(accounts, wake)
+    with _lock:
+        if _refresh is None or _streams >= min(limit, LIVE_MAX_STREAMS):
+            metrics_module.live_rejected()
+            return None
+        _streams += 1
+        for account in accounts:
+            _subs.setdefault(account, set()).add(sub)
+            _due.setdefault(account, 0.0)
+            state = _states.get(account)
+            if state is not None:
+                sub.push(*snapshot_event(account, state))
+    metrics_module.live_streams(1)
+    _start_refresher()
+    return sub
+
+
+def unsubscribe(sub):
+    global _streams
+    with _lock:
+        if sub.closed:
+            return
+        sub.close()
+        _streams -= 1
+        for account in sub.accounts:
+            subs = _subs.get(account)
+            if subs is None:
+                continue
+            subs.discard(sub)
+            if not subs:
+                # без подписчиков аккаунт не обновляется и состояние не держится
+                del _subs[account]
+                _states.pop(account, None)
+                _due.pop(account, None)
+                _refreshed.pop(account, None)
+    metrics_module.live_streams(-1)
+
+
+def touch(accounts):
+    """Активность в сети (follower_module): обновить подписанные аккаунты на ближайшем тике."""
+    with _lock:
+        for account in accounts:
+            if account in _due:
+                _due[account] = 0.0
+
+
+def publish(account, events):
+    with _lock:
+        subs = list(_subs.get(account, ()))
+    for event, data in events:
+        metrics_module.live_event(event, len(subs))
+        for sub in subs:
+            sub.push(event, data)
+
+
+def refresh_account(account):
+    """Одно обновление аккаунта → события подписчикам. False — обновление не удалось."""
+    with _lock:
+        since = _refreshed.get(account, time.time() - LIVE_REFRESH_SECONDS)
+    with upstream.scope(upstream.BACKGROUND):
+        try:
+            balance, txns = _refresh(account, since)
+        except Exception as e:
+            print(f"[Live] refresh {account} failed: {e}")
+            metrics_module.live_refresh("error")
+            return False
+        if upstream.degraded():
+            metrics_module.live_refresh("degraded")
+            return False
+    new = State(balance, txns)
+    with _lock:
+        if account not in _subs:
+            return True  # все отписались, пока шло обновление
+        old = _states.get(account)
+        _states[account] = new
+        _refreshed[account] = time.time()  # после записи в кэш: свои записи не считаются чужими
+    metrics_module.live_refresh("ok")
+    publish(account, [snapshot_event(account, new)] if old is None else diff(account, old, new, txns))
+    return True
+
+
+def _refresh_loop():
+    while True:
+        now = time.monotonic()
+        with _lock:
+            due = [a for a, at in _due.items() if at <= now]
+            for account in due:
+                _due[account] = now + LIVE_REFRESH_SECONDS
+        if due:
+            # дождаться всего пакета: аккаунт не обновляется двумя потоками сразу
+            list(_pool.map(refresh_account, due))
+        time.sleep(TICK)
+
+
+def _start_refresher():
+    global _refresher
+    pid = os.getpid()
+    with _lock:
+        if _refresher and _refresher[0] == pid and _refresher[1].is_alive():
+            return
+        thread = threading.Thread(target=_refresh_loop, name="live-refresher", daemon=True)
+        _refresher = (pid, thread)
+    thread.start()
+    print(f"[Live] refresher started: every {LIVE_REFRESH_SECONDS:.0f}s")
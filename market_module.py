@@ -0,0 +1,337 @@
+"""
+NearPulse — рыночные данные DexScreener: фоновый опрос и временные ряды в памяти.
+
+Маршруты /api/market/* больше не ходят в DexScreener на запросе: один
+фоновый поток на процесс раз в MARKET_POLL_SECONDS снимает
+
+  • поиск "near" — пары сети NEAR (ответ /api/market/near);
+  • цены и объёмы MARKET_TOKENS одним запросом /tokens/v1/near/<a,b,...>
+    (лучшая по объёму 24ч пара каждого токена) — точки временных рядов;
+  • раз в MARKET_PROFILES_SECONDS — новые профили токенов (/api/market/new-tokens).
+
+Ряды — кольцевые буферы на array('d') фиксированного размера: точка
+[ts, open, high, low, close, volume24h], где ts — начало интервала. Каждый
+снимок попадает сразу во все уровни (TIERS), чем длиннее диапазон — тем
+крупнее интервал:
+
+    24h — 5 мин × 288      30d — 2 ч × 360
+    7d  — 30 мин × 336     90d — 6 ч × 360
+
+Без поллера в процессе (MARKET_POLL_SECONDS=0, flask run, отладка) read()
+опрашивает нужный фид разово на запросе — не чаще ON_DEMAND_SECONDS.
+
+Пропуски (поллер стоял, DexScreener не ответил) остаются пропусками —
+точки не выдумываются. История живёт в памяти процесса и начинается с его
+старта; каждый воркер gunicorn опрашивает сам (2 воркера — 2–3 запроса в
+минуту, лимит DexScreener — 300). Цены токенов с id CoinGecko заодно идут в
+price_history_module как текущие закрытия.
+
+Env:
+  MARKET_POLL_SECONDS      — период опроса (60; 0 — поллер выключен)
+  MARKET_PROFILES_SECONDS  — период опроса новых профилей (300)
+  MARKET_TOKENS            — контракты через запятую (по умолчанию как в MarketScreen)
+"""
+import os
+import math
+import time
+import threading
+from array import array
+import metrics_module
+import price_history_module as price_history
+import token_registry_module as token_registry
+import upstream_module as upstream
+
+DEXSCREENER_API = os.environ.get("DEXSCREENER_API", "https://api.dexscreener.com")
+MARKET_POLL_SECONDS = float(os.environ.get("MARKET_POLL_SECONDS", 60))
+MARKET_PROFILES_SECONDS = float(os.environ.get("MARKET_PROFILES_SECONDS", 300))
+MARKET_TOKENS = [t.strip().lower() for t in os.environ.get("MARKET_TOKENS", ",".join([
+    "wrap.near",
+    "token.v2.ref-finance.near",
+    "meta-pool.near",
+    "token.burrow.near",
+    "ftv2.nekotoken.near",
+    "blackdragon.tkn.near",
+    "token.0xshitzu.near",
+])).split(",") if t.strip()][:30]  # /tokens/v1 принимает до 30 адресов
+NEAR_TOKEN = "wrap.near"
+NEW_TOKENS_LIMIT = 10
+REQUEST_TIMEOUT = 10
+ON_DEMAND_SECONDS = 60      # без поллера: снимок старше — перечитать на запросе
+
+# диапазон → (интервал, секунд; точек)
+TIERS = {
+    "24h": (300, 288),
+    "7d": (1800, 336),
+    "30d": (7200, 360),
+    "90d": (21600, 360),
+}
+
+# Поля пары, которые читает webapp (MarketScreen); остальное (info, txns, boosts...) не отдаём
+PAIR_FIELDS = ("chainId", "dexId", "url", "pairAddress", "priceUsd", "priceNative", "fdv", "marketCap", "pairCreatedAt")
+PAIR_NESTED = {
+    "baseToken": ("address", "name", "symbol"),
+    "quoteToken": ("address", "symbol"),
+    "priceChange": ("m5", "h1", "h6", "h24"),
+    "volume": ("h24",),
+    "liquidity": ("usd",),
+}
+
+
+# ─── Ring buffer ───────────────────────────────────────────────────────────
+class Ring:
+    """OHLC-ряд фиксированной длины: интервал step секунд, capacity интервалов."""
+
+    __slots__ = ("step", "capacity", "ts", "open", "high", "low", "close", "volume", "head", "size")
+
+    def __init__(self, step, capacity):
+        self.step, self.capacity = step, capacity
+        self.ts = array("d", [0.0]) * capacity
+        self.open = array("d", [0.0]) * capacity
+        self.high = array("d", [0.0]) * capacity
+        self.low = array("d", [0.0]) * capacity
+        self.close = array("d", [0.0]) * capacity
+        self.volume = array("d", [0.0]) * capacity
+        self.head = -1  # индекс последнего интервала
+        self.size = 0
+
+    def add(self, ts, price, volume):
+        bucket = ts - ts % self.step
+        i = self.head
+        if i >= 0 and self.ts[i] == bucket:
+            if price > self.high[i]:
+                self.high[i] = price
+            if price < self.low[i]:
+                self.low[i] = price
+            self.close[i], self.volume[i] = price, volume
+            return
+        if i >= 0 and bucket < self.ts[i]:
+            return  # снимок из прошлого интервала — часы ушли назад
+        i = self.head = (i + 1) % self.capacity
+        self.ts[i] = bucket
+        self.open[i] = self.high[i] = self.low[i] = self.close[i] = price
+        self.volume[i] = volume
+        self.size = min(self.size + 1, self.capacity)
+
+    def points(self, since=0.0):
+        """[[ts, o, h, l, c, v], ...] от старых к новым; интервалы старше since не входят."""
+        out = []
+        start = self.head - self.size + 1
+        for k in range(start, self.head + 1):
+            i = k % self.capacity
+            if self.ts[i] >= since:
+                out.append([int(self.ts[i]), self.open[i], self.high[i], self.low[i], self.close[i], self.volume[i]])
+        return out
+
+
+class Series:
+    """Все уровни TIERS одного токена."""
+
+    def __init__(self):
+        self.tiers = {name: Ring(step, capacity) for name, (step, capacity) in TIERS.items()}
+
+    def add(self, ts, price, volume):
+        for ring in self.tiers.values():
+            ring.add(ts, price, volume)
+
+
+# ─── State ─────────────────────────────────────────────────────────────────
+_series = {}        # контракт → Series
+_latest = {}        # контракт → slim-пара последнего снимка
+_snapshot = {"pairs": [], "pairsAt": None, "tokens": [], "tokensAt": None, "newTokens": [], "newTokensAt": None}
+_lock = threading.Lock()
+_poller = None      # (pid, поток)
+_on_demand_lock = threading.Lock()
+_on_demand_at = {}  # фид → время последнего разового опроса
+
+
+def _num(value):
+    try:
+        n = float(value)
+    except (TypeError, ValueError):
+        return None
+    return n if math.isfinite(n) else None
+
+
+def slim_pair(pair):
+    """Пара DexScreener без info / txns / boosts — только то, что показывает webapp."""
+    out = {k: pair[k] for k in PAIR_FIELDS if pair.get(k) is not None}
+    for key, fields in PAIR_NESTED.items():
+        nested = pair.get(key)
+        if isinstance(nested, dict):
+            out[key] = {f: nested[f] for f in fields if nested.get(f) is not None}
+    return out
+
+
+def _pairs(data):
+    pairs = data.get("pairs") if isinstance(data, dict) else data
+    return [p for p in (pairs or []) if isinstance(p, dict)]
+
+
+def best_pairs(pairs, tokens):
+    """{контракт: пара с наибольшим объёмом 24ч} для tokens (по baseToken.address)."""
+    wanted = set(tokens)
+    best = {}
+    for p in pairs:
+        if p.get("chainId") not in (None, "near") or _num(p.get("priceUsd")) is None:
+            continue
+        address = ((p.get("baseToken") or {}).get("address") or "").lower()
+        if address not in wanted:
+            continue
+        volume = _num((p.get("volume") or {}).get("h24")) or 0
+        current = best.get(address)
+        if current is None or volume > (_num((current.get("volume") or {}).get("h24")) or 0):
+            best[address] = p
+    return best
+
+
+def record(pairs_by_token, ts=None):
+    """Снимок цен → точки рядов и последние пары токенов."""
+    ts = time.time() if ts is None else ts
+    with _lock:
+        for token, pair in pairs_by_token.items():
+            price = _num(pair.get("priceUsd"))
+            if price is None:
+                continue
+            volume = _num((pair.get("volume") or {}).get("h24")) or 0.0
+            series = _series.get(token)
+            if series is None:
+                series = _series[token] = Series()
+            series.add(ts, price, volume)
+            _latest[token] = slim_pair(pair)
+        _snapshot["tokens"] = [_latest[t] for t in MARKET_TOKENS if t in _latest]
+        _snapshot["tokensAt"] = int(ts)
+
+
+# ─── Poller ────────────────────────────────────────────────────────────────
+def _fetch(endpoint, url, **kwargs):
+    r = upstream.get("dexscreener", url, endpoint=endpoint, timeout=REQUEST_TIMEOUT, **kwargs)
+    if r.status_code != 200:
+        raise RuntimeError(f"status {r.status_code}")
+    return r.json()
+
+
+def poll_tokens():
+    data = _fetch("tokens", f"{DEXSCREENER_API}/tokens/v1/near/{','.join(MARKET_TOKENS)}")
+    best = best_pairs(_pairs(data), MARKET_TOKENS)
+    record(best)
+    # те же цены — текущие закрытия истории (токены с id CoinGecko)
+    for token, pair in best.items():
+        price_history.observe(token_registry.coingecko_id(token), _num(pair.get("priceUsd")))
+
+
+def poll_search():
+    data = _fetch("search", f"{DEXSCREENER_API}/latest/dex/search", params={"q": "near"})
+    pairs = [slim_pair(p) for p in _pairs(data) if p.get("chainId") == "near"]
+    with _lock:
+        _snapshot["pairs"], _snapshot["pairsAt"] = pairs, int(time.time())
+
+
+def poll_profiles():
+    data = _fetch("token_profiles", f"{DEXSCREENER_API}/token-profiles/latest/v1")
+    tokens = [t for t in data if isinstance(t, dict) and t.get("chainId") == "near"][:NEW_TOKENS_LIMIT] \
+        if isinstance(data, list) else []
+    with _lock:
+        _snapshot["newTokens"], _snapshot["newTokensAt"] = tokens, int(time.time())
+
+
+def poll_once(profiles=True):
+    feeds = [("tokens", poll_tokens), ("search", poll_search)]
+    if profiles:
+        feeds.append(("profiles", poll_profiles))
+    with upstream.scope(upstream.BACKGROUND):
+        for name, fn in feeds:
+            try:
+                fn()
+                metrics_module.market_poll(name, "ok")
+            except Exception as e:
+                metrics_module.market_poll(name, "error")
+                print(f"[Market] {name} poll failed: {e}")
+
+
+def _poll_loop():
+    next_profiles = 0.0
+    while True:
+        t0 = time.monotonic()
+        profiles = t0 >= next_profiles
+        if profiles:
+            next_profiles = t0 + MARKET_PROFILES_SECONDS
+        poll_once(profiles)
+        time.sleep(max(MARKET_POLL_SECONDS - (time.monotonic() - t0), 1))
+
+
+def poller_running():
+    with _lock:
+        return bool(_poller and _poller[0] == os.getpid() and _poller[1].is_alive())
+
+
+def start_poller():
+    """Запустить фоновый опрос в этом процессе (повторный вызов и вызов после fork — безопасны)."""
+    global _poller
+    if MARKET_POLL_SECONDS <= 0:
+        return False
+    pid = os.getpid()
+    with _lock:
+        if _poller and _poller[0] == pid and _poller[1].is_alive():
+            return False
+        thread = threading.Thread(target=_poll_loop, name="market-poller", daemon=True)
+        _poller = (pid, thread)
+    thread.start()
+    print(f"[Market] poller started: every {MARKET_POLL_SECONDS:.0f}s, {len(MARKET_TOKENS)} tokens")
+    return True
+
+
+# ─── Reads (request path: memory only) ─────────────────────────────────────
+def snapshot(name):
+    """(данные, ts снимка) — name: pairs / tokens / newTokens; ts None, если снимка ещё не было."""
+    with _lock:
+        return _snapshot.get(name) or [], _snapshot.get(f"{name}At")
+
+
+_FEEDS = {"pairs": ("search", poll_search), "tokens": ("tokens", poll_tokens), "newTokens": ("profiles", poll_profiles)}
+
+
+def read(name):
+    """
+    snapshot(name); если поллера в этом процессе нет — сначала разовый опрос
+    фида (не чаще ON_DEMAND_SECONDS, параллельные запросы ждут один опрос).
+    """
+    if poller_running():
+        return snapshot(name)
+    feed, fn = _FEEDS[name]
+    with _on_demand_lock:
+        if time.time() - _on_demand_at.get(feed, 0.0) >= ON_DEMAND_SECONDS:
+            _on_demand_at[feed] = time.time()
+            try:
+                fn()
+                metrics_module.market_poll(feed, "ok")
+            except Exception as e:
+                metrics_module.market_poll(feed, "error")
+                print(f"[Market] {feed} on-demand poll failed: {e}")
+    return snapshot(name)
+
+
+def resolve_token(token):
+    token = (token or "").lower()
+    return NEAR_TOKEN if token in ("near", "wnear") else token
+
+
+def chart(token, period="24h"):
+    """OHLC-ряд токена за period или None, если токен не отслеживается."""
+    token = resolve_token(token)
+    step, capacity = TIERS[period]
+    with _lock:
+        series = _series.get(token)
+        if series is None:
+            return None
+        ring = series.tiers[period]
+        points = ring.points(since=time.time() - step * capacity)
+        pair = _latest.get(token)
+    return {
+        "token": token,
+        "range": period,
+        "step": step,
+        "fields": ["ts", "open", "high", "low", "close", "volume24h"],
+        "points": points,
+        "pair": pair,
+    }
+
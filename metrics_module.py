@@ -0,0 +1,283 @@
+"""
+NearPulse — метрики в текстовом формате Prometheus (GET /metrics).
+
+Без внешних зависимостей: счётчики, gauge и гистограммы с метками живут в
+памяти процесса. С gunicorn у каждого воркера свои значения — Prometheus
+видит тот воркер, который ответил на scrape; для точных сумм по процессу
+держите WEB_CONCURRENCY=1 или скрейпьте каждый инстанс отдельно.
+
+Источники:
+  • Flask — before/after/teardown_request: латентность и in-flight по
+    шаблону маршрута (/api/balance/<account_id>, не по конкретному адресу).
+  • api_async.py — то же для ASGI-маршрутов (MetricsMiddleware там).
+  • upstream_module — каждый вызов: провайдер, endpoint, исход, время;
+    отказы без вызова (throttle, открытый breaker) и hedge-запросы.
+  • cache_module / nft_module — hit / redis_hit / stale / miss по семейству
+    ключа (часть до первого ":") и пропущенные из-за сбоя записи.
+
+Env:
+  METRICS_TOKEN — если задан, /metrics требует "Authorization: Bearer <token>"
+"""
+import os
+import hmac
+import time
+import threading
+from flask import Response, g, request
+
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_labels(self.labels, key)} {value:g}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels):
+        self.inc(*labels, amount=-1)
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                # [счётчики по корзинам (не кумулятивно)..., +Inf, sum]
+                series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted((k, list(v)) for k, v in self.values.items())
+        for key, series in items:
+            total = 0
+            for bound, n in zip(self.buckets + ("+Inf",), series):
+                total += n
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {total}")
+        return lines
+
+
+# ─── Metrics ───────────────────────────────────────────────────────────────
+HTTP_DURATION = Histogram(
+    "nearpulse_http_request_duration_seconds", "Request latency by route template.",
+    ("route", "method", "status"),
+)
+HTTP_IN_FLIGHT = Gauge("nearpulse_http_requests_in_flight", "Requests being served.", ("route",))
+UPSTREAM_DURATION = Histogram(
+    "nearpulse_upstream_request_duration_seconds",
+    "Upstream call latency; outcome is 2xx/4xx/429/5xx/timeout/error.",
+    ("provider", "endpoint", "outcome"),
+)
+UPSTREAM_REJECTED = Counter(
+    "nearpulse_upstream_rejected_total", "Calls not sent: throttled or circuit open.",
+    ("provider", "endpoint", "reason"),
+)
+UPSTREAM_HEDGES = Counter("nearpulse_upstream_hedges_total", "Secondary source launched by hedged().", ("provider",))
+CACHE_LOOKUPS = Counter("nearpulse_cache_lookups_total", "Cache lookups by key family.", ("family", "result"))
+AI_SESSIONS = Gauge("nearpulse_ai_sessions_active", "Model calls in progress; mode is sync/stream.", ("mode",))
+AI_REJECTED = Counter("nearpulse_ai_sessions_rejected_total", "Chats refused at AI_MAX_SESSIONS.", ("mode",))
+AI_FIRST_TOKEN = Histogram(
+    "nearpulse_ai_first_token_seconds", "Time from the model request to the first streamed text.", ("mode",),
+)
+AI_ANSWER_CACHE = Counter(
+    "nearpulse_ai_answer_cache_total", "Answer cache lookups; result is hit/miss/stale/personal.", ("result",),
+)
+MARKET_POLLS = Counter(
+    "nearpulse_market_polls_total", "Background DexScreener polls; feed is tokens/search/profiles.", ("feed", "result"),
+)
+LIVE_STREAMS = Gauge("nearpulse_live_streams_active", "Open /api/live event streams.", ())
+LIVE_REJECTED = Counter("nearpulse_live_streams_rejected_total", "Streams refused at LIVE_MAX_STREAMS.", ())
+LIVE_REFRESHES = Counter(
+    "nearpulse_live_refreshes_total", "Live hub account refreshes; result is ok/degraded/error.", ("result",),
+)
+LIVE_DELIVERIES = Counter("nearpulse_live_deliveries_total", "Events pushed to live subscribers.", ("event",))
+CHAIN_BLOCKS = Counter(
+    "nearpulse_chain_blocks_total", "Blocks seen by the chain follower; result is ok/skipped/gap/error.", ("result",),
+)
+CHAIN_HEIGHT = Gauge("nearpulse_chain_height", "Last block height applied by this process.", ())
+CHAIN_INVALIDATED = Counter(
+    "nearpulse_chain_invalidations_total", "Cache invalidations by chain activity; kind is accounts/keys.", ("kind",),
+)
+CACHE_SKIPPED = Counter(
+    "nearpulse_cache_skipped_writes_total", "Writes dropped because an upstream failed.", ("family",),
+)
+
+
+def key_family(key):
+    return key.split(":", 1)[0]
+
+
+def observe_request(route, method, status, seconds):
+    HTTP_DURATION.observe(seconds, route, method, str(status))
+
+
+def upstream_call(provider, endpoint, outcome, seconds):
+    UPSTREAM_DURATION.observe(seconds, provider, endpoint or "-", outcome)
+
+
+def upstream_rejected(provider, endpoint, reason):
+    UPSTREAM_REJECTED.inc(provider, endpoint or "-", reason)
+
+
+def upstream_hedge(provider):
+    UPSTREAM_HEDGES.inc(provider)
+
+
+def cache_lookup(key, result):
+    CACHE_LOOKUPS.inc(key_family(key), result)
+
+
+def cache_skipped(key):
+    CACHE_SKIPPED.inc(key_family(key))
+
+
+def ai_session(mode, delta):
+    AI_SESSIONS.inc(mode, amount=delta)
+
+
+def ai_rejected(mode):
+    AI_REJECTED.inc(mode)
+
+
+def ai_first_token(mode, seconds):
+    AI_FIRST_TOKEN.observe(seconds, mode)
+
+
+def ai_answer_cache(result):
+    AI_ANSWER_CACHE.inc(result)
+
+
+def market_poll(feed, result):
+    MARKET_POLLS.inc(feed, result)
+
+
+def live_streams(delta):
+    LIVE_STREAMS.inc(amount=delta)
+
+
+def live_rejected():
+    LIVE_REJECTED.inc()
+
+
+def live_refresh(result):
+    LIVE_REFRESHES.inc(result)
+
+
+def live_event(event, subscribers):
+    LIVE_DELIVERIES.inc(event, amount=subscribers)
+
+
+def chain_block(result):
+    CHAIN_BLOCKS.inc(result)
+
+
+def chain_height(height):
+    CHAIN_HEIGHT.set(height)
+
+
+def chain_invalidated(accounts, keys):
+    CHAIN_INVALIDATED.inc("accounts", amount=accounts)
+    CHAIN_INVALIDATED.inc("keys", amount=keys)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ─── Flask ─────────────────────────────────────────────────────────────────
+def _route():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def _before():
+    g.metrics_t0 = time.perf_counter()
+    g.metrics_route = _route()
+    HTTP_IN_FLIGHT.inc(g.metrics_route)
+
+
+def _after(resp):
+    t0 = g.pop("metrics_t0", None)
+    if t0 is not None:
+        observe_request(g.metrics_route, request.method, resp.status_code, time.perf_counter() - t0)
+    return resp
+
+
+def _teardown(exc):
+    route = g.pop("metrics_route", None)
+    if route is not None:
+        HTTP_IN_FLIGHT.dec(route)
+
+
+def metrics_endpoint():
+    # compare_digest: время сравнения не зависит от того, сколько символов совпало
+    given = request.headers.get("Authorization", "").encode()
+    if METRICS_TOKEN and not hmac.compare_digest(given, f"Bearer {METRICS_TOKEN}".encode()):
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+def register_metrics(app):
+    app.before_request(_before)
+    app.after_request(_after)
+    app.teardown_request(_teardown)
+    app.add_url_rule("/metrics", "metrics", metrics_endpoint)
@@ -7,13 +7,23 @@ Endpoints:
   GET /api/nfts/<account>                          → список коллекций
   GET /api/nft-tokens/<account>?page=1&per_page=24 → все NFT с медиа, пагинация
   GET /api/nft-meta/<account>/<contract>           → метаданные контракта
+  GET /api/nft-ids/<account>/<contract>            → token_id коллекции (без запроса к upstream)
+
+/api/nfts поддерживает ?cursor= (курсор из nextCursor) и If-None-Match.
 """
-import os, json, time
+import os, json, time, base64, hashlib
+from bisect import bisect_right
+from itertools import islice
 import requests as http_requests
 from flask import jsonify, request
+from cache_module import conditional_json, stored
+import upstream_module as upstream
+import follower_module as follower
+import metrics_module
+from tracing_module import traced
 
-NEARBLOCKS_API = "https://api.nearblocks.io/v1"
-FASTNEAR_API   = "https://api.fastnear.com/v1"
+NEARBLOCKS_API = os.environ.get("NEARBLOCKS_API", "https://api.nearblocks.io/v1")
+FASTNEAR_API   = os.environ.get("FASTNEAR_API", "https://api.fastnear.com/v1")
 API_TIMEOUT    = 10
 NFT_CACHE_TTL  = 600
 META_CACHE_TTL = 3600
@@ -22,12 +32,28 @@ _mem_cache = {}
 
 def _cached(key, ttl=NFT_CACHE_TTL):
     e = _mem_cache.get(key)
-    if e and time.time() - e["ts"] < ttl:
+    # ttl записи: списки аккаунта при работающем follower живут дольше NFT_CACHE_TTL
+    if e and time.time() - e["ts"] < max(ttl, follower.read_ttl(key, e["ttl"])):
+        metrics_module.cache_lookup(key, "hit")
         return e["data"]
+    metrics_module.cache_lookup(key, "stale" if e else "miss")
     return None
 
 def _set_cache(key, data, ttl=NFT_CACHE_TTL):
+    if upstream.degraded():
+        metrics_module.cache_skipped(key)
+        return  # пустой список из-за сбоя upstream не кэшируем
     _mem_cache[key] = {"data": data, "ts": time.time(), "ttl": ttl}
+    stored([key])
+
+
+def invalidate(accounts, keys):
+    """Сброс по активности аккаунтов (хук follower_module)."""
+    for key in keys:
+        _mem_cache.pop(key, None)
+
+
+follower.on_touch(invalidate)
 
 def _nb_headers():
     key = os.environ.get("NEARBLOCKS_API_KEY", "")
@@ -61,44 +87,196 @@ def _contract_display_name(contract_id):
     return name[:24].replace("-", " ").title()
 
 
-def fetch_nft_contracts(account_id):
+def _truncate_icon(icon):
+    return icon[:5000] if icon and len(str(icon)) < 50000 else None
+
+
+class _NftRow:
+    """Компактная запись токена: только поля, уникальные для токена.
+    Всё, что зависит от контракта, лежит один раз в таблице контрактов."""
+    __slots__ = ("token_id", "title", "media", "contract")
+
+    def __init__(self, token_id, title, media, contract):
+        self.token_id = token_id
+        self.title = title
+        self.media = media
+        self.contract = contract
+
+
+def normalize_nft_tokens(raw_tokens):
+    """
+    Нормализует сырые NFT из NearBlocks в (rows, contracts).
+    contracts: contract → (contractName, contractIcon, base_uri) — считается
+    один раз на контракт, а не на каждый токен (у китов тысячи токенов
+    в нескольких коллекциях). Если у первого токена контракта метаданных
+    контракта нет, они берутся у первого следующего, у кого они есть;
+    base_uri для media — свой у токена, затем контракта, затем nft.base_uri.
+    """
+    contracts = {}
+    bare = set()    # контракты, чья запись пока собрана без метаданных
+    rows = []
+    append = rows.append
+    for t in raw_tokens:
+        nft_meta = t.get("nft") or {}
+        contract = t.get("contract_account_id") or t.get("contract") or nft_meta.get("contract", "")
+        contract_meta = t.get("nft_meta") or t.get("contract_meta")
+        info = contracts.get(contract)
+        if info is None or (contract_meta and contract in bare):
+            meta = contract_meta or {}
+            info = contracts[contract] = (
+                meta.get("name") or _contract_display_name(contract),
+                _truncate_icon(meta.get("icon", "")),
+                meta.get("base_uri"),
+            )
+            if contract_meta:
+                bare.discard(contract)
+            else:
+                bare.add(contract)
+        metadata = t.get("metadata") or {}
+        token_id = t.get("token_id")
+        media = t.get("media") or nft_meta.get("media") or metadata.get("media")
+        base_uri = (contract_meta or {}).get("base_uri") or info[2] or nft_meta.get("base_uri")
+        append(_NftRow(
+            token_id or nft_meta.get("token_id", ""),
+            t.get("title") or nft_meta.get("title") or metadata.get("title") or f"#{t.get('token_id', '?')}",
+            normalize_media(media, base_uri),
+            contract,
+        ))
+    return rows, contracts
+
+
+def serialize_nft_rows(rows, contracts, start=0, stop=None):
+    """
+    Финальная сериализация rows[start:stop] в формат ответа /api/nft-tokens.
+    Dict на токен строится только для отдаваемого среза: поля контракта
+    присоединяются из таблицы contracts на выходе.
+    """
+    out = []
+    for row in islice(rows, start, stop):
+        name, icon, _ = contracts[row.contract]
+        out.append({
+            "tokenId": row.token_id,
+            "title": row.title,
+            "media": row.media,
+            "contract": row.contract,
+            "contractName": name,
+            "contractIcon": icon,
+        })
+    return out
+
+
+@traced("build_nft_listing")
+def _build_listing(entries):
+    """
+    entries: [(contract, count, token_ids)] → листинг с устойчивой сортировкой
+    (по убыванию count, затем по имени контракта), заранее посчитанными
+    итогами и версией для ETag. token_ids сохраняются для drill-down.
+    """
+    entries.sort(key=lambda e: (-e[1], e[0]))
+    contracts = [{"contract": c, "count": n} for c, n, _ in entries]
+    version = hashlib.blake2b(
+        json.dumps([[c, n] for c, n, _ in entries]).encode(), digest_size=8
+    ).hexdigest()
+    return {
+        "contracts": contracts,
+        "sortKeys": [(-n, c) for c, n, _ in entries],
+        "tokenIds": {c: ids for c, _, ids in entries},
+        "totalNfts": sum(n for _, n, _ in entries),
+        "version": version,
+    }
+
+
+def parse_fastnear_nfts(data):
+    """Ответ FastNEAR /account/<id>/nft → [(contract, count, token_ids)]."""
+    entries = []
+    tokens = data.get("tokens", data) if isinstance(data, dict) else data
+    if isinstance(tokens, dict):
+        for contract_id, token_ids in tokens.items():
+            ids = token_ids if isinstance(token_ids, list) else []
+            entries.append((contract_id, len(ids), ids))
+    elif isinstance(tokens, list):
+        for item in tokens:
+            if isinstance(item, dict):
+                ids = item.get("token_ids")
+                entries.append((
+                    item.get("contract_id", item.get("contract", "")),
+                    item.get("count", 0),
+                    ids if isinstance(ids, list) else [],
+                ))
+            elif isinstance(item, str):
+                entries.append((item, 0, []))
+    return entries
+
+
+def parse_inventory_nfts(data):
+    """Фолбэк NearBlocks /inventory → [(contract, quantity, [])]."""
+    return [
+        (item.get("contract", ""), item.get("quantity", 0), [])
+        for item in data.get("inventory", {}).get("nfts", [])
+    ]
+
+
+def fastnear_nft_entries(account_id):
+    r = upstream.get("fastnear", f"{FASTNEAR_API}/account/{account_id}/nft",
+                     endpoint="nft", degrade=False, timeout=API_TIMEOUT)
+    if r.status_code != 200:
+        raise upstream.UpstreamError(f"FastNEAR HTTP {r.status_code}")
+    return parse_fastnear_nfts(r.json())
+
+
+def inventory_nft_entries(account_id):
+    r = upstream.get(
+        "nearblocks", f"{NEARBLOCKS_API}/account/{account_id}/inventory",
+        endpoint="inventory", degrade=False, headers=_nb_headers(), timeout=API_TIMEOUT
+    )
+    if r.status_code != 200:
+        raise upstream.UpstreamError(f"NearBlocks HTTP {r.status_code}")
+    return parse_inventory_nfts(r.json())
+
+
+def fetch_nft_listing(account_id):
     key = f"nft_contracts:{account_id}"
     cached = _cached(key, NFT_CACHE_TTL)
     if cached is not None:
         return cached
-    result = []
     try:
-        r = http_requests.get(f"{FASTNEAR_API}/account/{account_id}/nft", timeout=API_TIMEOUT)
-        if r.status_code == 200:
-            data = r.json()
-            tokens = data.get("tokens", data) if isinstance(data, dict) else data
-            if isinstance(tokens, dict):
-                for contract_id, token_ids in tokens.items():
-                    ids = token_ids if isinstance(token_ids, list) else []
-                    result.append({"contract": contract_id, "count": len(ids)})
-            elif isinstance(tokens, list):
-                for item in tokens:
-                    if isinstance(item, dict):
-                        result.append({
-                            "contract": item.get("contract_id", item.get("contract", "")),
-                            "count": item.get("count", 0),
-                        })
-                    elif isinstance(item, str):
-                        result.append({"contract": item, "count": 0})
+        # NearBlocks стартует, если FastNEAR не ответил за свой p95 или упал
+        entries = upstream.hedged(
+            ("fastnear", lambda: fastnear_nft_entries(account_id)),
+            ("nearblocks", lambda: inventory_nft_entries(account_id)),
+        )
     except Exception as e:
         print(f"[NFT contracts] error: {e}")
-        try:
-            r = http_requests.get(
-                f"{NEARBLOCKS_API}/account/{account_id}/inventory",
-                headers=_nb_headers(), timeout=API_TIMEOUT
-            )
-            if r.status_code == 200:
-                for item in r.json().get("inventory", {}).get("nfts", []):
-                    result.append({"contract": item.get("contract", ""), "count": item.get("quantity", 0)})
-        except Exception as e2:
-            print(f"[NFT contracts fallback] error: {e2}")
-    _set_cache(key, result, NFT_CACHE_TTL)
-    return result
+        entries = []
+    listing = _build_listing(entries)
+    _set_cache(key, listing, follower.ttl(NFT_CACHE_TTL))
+    return listing
+
+
+def fetch_nft_contracts(account_id):
+    return fetch_nft_listing(account_id)["contracts"]
+
+
+def encode_cursor(sort_key):
+    """Непрозрачный курсор: позиция после последнего отданного контракта."""
+    return base64.urlsafe_b64encode(json.dumps(list(sort_key)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    neg_count, contract = json.loads(raw)
+    return (int(neg_count), str(contract))
+
+
+@traced()
+def build_nft_page(data, page, per_page):
+    raw_tokens = data.get("nfts", data.get("tokens", []))
+    total = data.get("total", len(raw_tokens))
+    rows, contracts = normalize_nft_tokens(raw_tokens)
+    # больше per_page строк — upstream листает своим размером страницы:
+    # отрезанное не пришло бы и со следующей, поэтому отдаём все строки
+    tokens = serialize_nft_rows(rows, contracts)
+    return {"tokens": tokens, "page": page, "perPage": per_page, "total": total, "hasMore": len(rows) >= per_page}
 
 
 def fetch_all_nfts_paged(account_id, page=1, per_page=24):
@@ -107,35 +285,17 @@ def fetch_all_nfts_paged(account_id, page=1, per_page=24):
     if cached is not None:
         return cached
     try:
-        r = http_requests.get(
-            f"{NEARBLOCKS_API}/account/{account_id}/inventory/nfts",
+        r = upstream.get(
+            "nearblocks", f"{NEARBLOCKS_API}/account/{account_id}/inventory/nfts",
+            endpoint="inventory_nfts",
             params={"page": page, "per_page": per_page},
             headers=_nb_headers(),
             timeout=15,
         )
         if r.status_code != 200:
             return {"tokens": [], "hasMore": False, "total": 0, "error": f"HTTP {r.status_code}"}
-        data = r.json()
-        raw_tokens = data.get("nfts", data.get("tokens", []))
-        total = data.get("total", len(raw_tokens))
-        tokens = []
-        for t in raw_tokens:
-            nft_meta = t.get("nft", {}) or {}
-            contract = t.get("contract_account_id") or t.get("contract") or nft_meta.get("contract", "")
-            contract_meta = t.get("nft_meta") or t.get("contract_meta") or {}
-            media = t.get("media") or nft_meta.get("media") or (t.get("metadata") or {}).get("media")
-            base_uri = contract_meta.get("base_uri") or nft_meta.get("base_uri")
-            icon = contract_meta.get("icon", "")
-            tokens.append({
-                "tokenId": t.get("token_id") or nft_meta.get("token_id", ""),
-                "title": t.get("title") or nft_meta.get("title") or (t.get("metadata") or {}).get("title") or f"#{t.get('token_id','?')}",
-                "media": normalize_media(media, base_uri),
-                "contract": contract,
-                "contractName": contract_meta.get("name") or _contract_display_name(contract),
-                "contractIcon": icon[:5000] if icon and len(str(icon)) < 50000 else None,
-            })
-        result = {"tokens": tokens, "page": page, "perPage": per_page, "total": total, "hasMore": len(raw_tokens) == per_page}
-        _set_cache(key, result, NFT_CACHE_TTL)
+        result = build_nft_page(r.json(), page, per_page)
+        _set_cache(key, result, follower.ttl(NFT_CACHE_TTL))
         return result
     except http_requests.exceptions.Timeout:
         print(f"[fetch_all_nfts_paged] Timeout for {account_id} p{page}")
@@ -145,31 +305,38 @@ def fetch_all_nfts_paged(account_id, page=1, per_page=24):
         return {"tokens": [], "hasMore": False, "total": 0, "error": str(e)}
 
 
+def default_contract_meta(contract_id):
+    return {"name": _contract_display_name(contract_id), "symbol": None, "icon": None}
+
+
+def parse_contract_meta(contract_id, data):
+    # NearBlocks wraps in {"contracts": [...]} or returns the object directly
+    contracts = data.get("contracts") if isinstance(data, dict) else None
+    nft_data = contracts[0] if contracts else (data if isinstance(data, dict) else {})
+    return {
+        "name": nft_data.get("name") or _contract_display_name(contract_id),
+        "symbol": nft_data.get("symbol"),
+        "icon": _truncate_icon(nft_data.get("icon", "")),
+        "baseUri": nft_data.get("base_uri"),
+    }
+
+
 def fetch_contract_meta(contract_id):
     key = f"nft_meta:{contract_id}"
     cached = _cached(key, META_CACHE_TTL)
     if cached is not None:
         return cached
-    meta = {"name": _contract_display_name(contract_id), "symbol": None, "icon": None}
+    meta = default_contract_meta(contract_id)
     try:
         # Use NearBlocks API instead of direct RPC to avoid hammering the node
-        r = http_requests.get(
-            f"{NEARBLOCKS_API}/nfts/{contract_id}",
+        r = upstream.get(
+            "nearblocks", f"{NEARBLOCKS_API}/nfts/{contract_id}",
+            endpoint="nft_meta",
             headers=_nb_headers(),
             timeout=API_TIMEOUT,
         )
         if r.status_code == 200:
-            data = r.json()
-            # NearBlocks wraps in {"contracts": [...]} or returns the object directly
-            contracts = data.get("contracts") if isinstance(data, dict) else None
-            nft_data = contracts[0] if contracts else (data if isinstance(data, dict) else {})
-            icon = nft_data.get("icon", "")
-            meta = {
-                "name": nft_data.get("name") or _contract_display_name(contract_id),
-                "symbol": nft_data.get("symbol"),
-                "icon": icon[:5000] if icon and len(str(icon)) < 50000 else None,
-                "baseUri": nft_data.get("base_uri"),
-            }
+            meta = parse_contract_meta(contract_id, r.json())
         else:
             print(f"[contract_meta] NearBlocks {r.status_code} for {contract_id}")
     except Exception as e:
@@ -178,6 +345,41 @@ def fetch_contract_meta(contract_id):
     return meta
 
 
+def check_page(page, per_page):
+    """ValueError — page или limit вне допустимого (до запроса листинга у upstream)."""
+    if per_page < 1:
+        raise ValueError("limit must be at least 1")
+    if page < 1:
+        raise ValueError("page must be at least 1")
+
+
+def contracts_page(listing, account_id, page, per_page, cursor=None):
+    """Страница листинга → (payload, etag). ValueError — битый курсор, page < 1 или limit < 1."""
+    check_page(page, per_page)
+    if cursor:
+        try:
+            start = bisect_right(listing["sortKeys"], decode_cursor(cursor))
+        except Exception as e:
+            raise ValueError("Invalid cursor") from e
+        page = start // per_page + 1
+    else:
+        start = (page - 1) * per_page
+    all_contracts = listing["contracts"]
+    total = len(all_contracts)
+    has_more = start + per_page < total
+    payload = {
+        "account": account_id,
+        "nfts": all_contracts[start : start + per_page],
+        "totalContracts": total,
+        "totalNfts": listing["totalNfts"],
+        "page": page, "perPage": per_page,
+        "totalPages": max(1, -(-total // per_page)),
+        "hasMore": has_more,
+        "nextCursor": encode_cursor(listing["sortKeys"][start + per_page - 1]) if has_more else None,
+    }
+    return payload, f"{listing['version']}.{start}.{per_page}"
+
+
 def register_nft_routes(app, cached_fn=None, set_cache_fn=None):
 
     @app.route("/api/nfts/<account_id>")
@@ -189,26 +391,37 @@ def register_nft_routes(app, cached_fn=None, set_cache_fn=None):
             request.args.get("limit", request.args.get("per_page", 20, type=int), type=int),
             50,
         )
-        all_contracts = fetch_nft_contracts(account_id)
-        total = len(all_contracts)
-        start = (page - 1) * per_page
-        page_data = all_contracts[start : start + per_page]
-        return jsonify({
-            "account": account_id,
-            "nfts": page_data,
-            "totalContracts": total,
-            "totalNfts": sum(c.get("count", 0) for c in all_contracts),
-            "page": page, "perPage": per_page,
-            "totalPages": max(1, -(-total // per_page)),
-            "hasMore": start + per_page < total,
-        })
+        try:
+            check_page(page, per_page)
+            payload, etag = contracts_page(fetch_nft_listing(account_id), account_id, page, per_page, request.args.get("cursor"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return conditional_json(payload, NFT_CACHE_TTL, etag=etag)
 
     @app.route("/api/nft-tokens/<account_id>")
     def api_nft_tokens_all(account_id):
         page     = request.args.get("page", 1, type=int)
         per_page = min(request.args.get("per_page", 24, type=int), 48)
-        return jsonify(fetch_all_nfts_paged(account_id, page, per_page))
+        result = fetch_all_nfts_paged(account_id, page, per_page)
+        if result.get("error"):
+            return jsonify(result)
+        return conditional_json(result, NFT_CACHE_TTL)
 
     @app.route("/api/nft-meta/<account_id>/<path:contract_id>")
     def api_nft_meta(account_id, contract_id):
-        return jsonify({"contract": contract_id, **fetch_contract_meta(contract_id)})
+        return conditional_json({"contract": contract_id, **fetch_contract_meta(contract_id)}, META_CACHE_TTL)
+
+    @app.route("/api/nft-ids/<account_id>/<path:contract_id>")
+    def api_nft_ids(account_id, contract_id):
+        ids = fetch_nft_listing(account_id)["tokenIds"].get(contract_id)
+        if ids is None:
+            return jsonify({"error": "Collection not found"}), 404
+        offset = max(request.args.get("offset", 0, type=int), 0)
+        limit  = min(max(request.args.get("limit", 100, type=int), 1), 500)
+        return conditional_json({
+            "account": account_id,
+            "contract": contract_id,
+            "tokenIds": ids[offset : offset + limit],
+            "total": len(ids),
+            "hasMore": offset + limit < len(ids),
+        }, NFT_CACHE_TTL)
@@ -0,0 +1,267 @@
+"""
+NearPulse — история цен токенов в USD: часовые и дневные закрытия.
+
+Ключ токена — id CoinGecko ("near", "tether", ...; контракт → id даёт
+token_registry.coingecko_id). На каждый токен два ряда закрытий:
+
+    hour — интервал 1 ч, последние HOURLY_DAYS дней
+    day  — интервал 1 сутки, последние PRICE_HISTORY_DAYS дней
+
+Источники:
+  • backfill — CoinGecko-совместимый /coins/<id>/market_chart (api.py
+    вызывает его через upstream для токенов, у которых истории нет или она
+    с дырой больше суток); ответ раскладывается в оба ряда;
+  • observe() — текущая цена: api.get_near_price() и поллер рынка
+    (market_module) дописывают закрытие текущего часа и дня.
+
+Ряды хранятся в памяти процесса (отсортированные array('d')) и в общем
+кэше (Redis, price_hist:<id>, не чаще раза в PERSIST_SECONDS на токен), так
+что история переживает рестарт и общая для воркеров.
+
+prices_at([(id, ts), ...]) отвечает на весь пакет за один проход: запросы
+группируются по токену, сортируются по времени и идут слиянием с рядом —
+O(запросов + точек) вместо бинарного поиска на каждую пару. Цена в момент
+ts — закрытие интервала, содержащего ts (или последнего до него, если
+ближе MAX_GAP интервалов); для ts внутри часового окна — из часового ряда.
+
+Env:
+  PRICE_HISTORY_DAYS — глубина дневного ряда и backfill, дней (90)
+"""
+import os
+import time
+import threading
+from array import array
+from bisect import bisect_right
+from cache_module import UPSTASH_REDIS_URL, get_many, has_redis, set_cache
+
+PRICE_HISTORY_DAYS = int(os.environ.get("PRICE_HISTORY_DAYS", 90))
+HOURLY_DAYS = 30
+HOUR, DAY = 3600, 86400
+MAX_GAP = 3                 # интервалов: дальше последней точки цена неизвестна
+PERSIST_SECONDS = 600
+BACKFILL_RETRY = 3600       # неудачный / свежий backfill не повторяем чаще
+BACKFILLS_PER_REQUEST = 4
+HISTORY_TTL = 30 * DAY
+
+TIERS = {
+    "hour": (HOUR, HOURLY_DAYS * DAY),
+    "day": (DAY, PRICE_HISTORY_DAYS * DAY),
+}
+
+
+class Closes:
+    """Закрытия одного ряда: ts начала интервала → цена, по возрастанию ts."""
+
+    __slots__ = ("step", "span", "ts", "close")
+
+    def __init__(self, step, span):
+        self.step, self.span = step, span
+        self.ts = array("d")
+        self.close = array("d")
+
+    def put(self, ts, price):
+        bucket = ts - ts % self.step
+        if self.ts and bucket == self.ts[-1]:
+            self.close[-1] = price
+        elif not self.ts or bucket > self.ts[-1]:
+            self.ts.append(bucket)
+            self.close.append(price)
+            self._trim(bucket)
+        else:
+            self.merge([(ts, price)])
+
+    def merge(self, points):
+        """Пакет (ts, цена) в любом порядке: в интервале — самая поздняя точка пакета;
+        уже записанные интервалы (живые закрытия observe) не перезаписываются."""
+        buckets = {}
+        for ts, price in sorted(points):
+            buckets[ts - ts % self.step] = price
+        buckets.update(zip(self.ts, self.close))
+        keys = sorted(buckets)
+        self.ts = array("d", keys)
+        self.close = array("d", (buckets[k] for k in keys))
+        if keys:
+            self._trim(keys[-1])
+
+    def _trim(self, newest):
+        cut = bisect_right(self.ts, newest - self.span)
+        if cut:
+            del self.ts[:cut]
+            del self.close[:cut]
+
+    def covers(self, since):
+        """Есть ли ряд от since до сейчас без дыры больше суток."""
+        if not self.ts or self.ts[0] > since + self.step:
+            return False
+        return time.time() - self.ts[-1] <= DAY + self.step
+
+    def walk(self, stamps):
+        """Цены для отсортированных stamps одним проходом (None — нет точки рядом)."""
+        out = []
+        j, n = 0, len(self.ts)
+        limit = MAX_GAP * self.step
+        for ts in stamps:
+            while j < n and self.ts[j] <= ts:
+                j += 1
+            k = j - 1
+            out.append(self.close[k] if k >= 0 and ts - self.ts[k] < limit else None)
+        return out
+
+    def dump(self):
+        return [[int(t), c] for t, c in zip(self.ts, self.close)]
+
+
+class History:
+    def __init__(self):
+        self.tiers = {name: Closes(step, span) for name, (step, span) in TIERS.items()}
+        self.persisted_at = 0.0
+        self.backfilled_at = 0.0
+
+    def put(self, ts, price):
+        for closes in self.tiers.values():
+            closes.put(ts, price)
+
+    def merge(self, points):
+        for closes in self.tiers.values():
+            closes.merge(points)
+
+
+_histories = {}   # id → History
+_loaded = set()   # id, для которых общий кэш уже прочитан (при Redis — из Redis)
+_lock = threading.Lock()
+
+
+def _key(token):
+    return f"price_hist:{token}"
+
+
+def _shared():
+    """Чтение кэша видит общие ряды: Redis не настроен или подключён."""
+    return not UPSTASH_REDIS_URL or has_redis()
+
+
+def _load(tokens):
+    """
+    Ряды из общего кэша для ещё не загруженных tokens — один MGET. Пока
+    Redis подключается в фоне (или соединение оборвалось на чтении), токены
+    не считаются загруженными: следующий вызов прочитает их снова.
+    """
+    with _lock:
+        missing = [t for t in tokens if t not in _loaded]
+    if not missing:
+        return
+    shared = _shared()
+    stored = get_many([_key(t) for t in missing])
+    shared = shared and _shared()
+    with _lock:
+        for token in missing:
+            if shared:
+                _loaded.add(token)
+            data = stored.get(_key(token))
+            if not data:
+                continue
+            history = _histories.setdefault(token, History())
+            for name, points in (data.get("tiers") or {}).items():
+                if name in history.tiers:
+                    history.tiers[name].merge([(ts, close) for ts, close in points])
+            history.backfilled_at = max(history.backfilled_at, data.get("backfilledAt", 0))
+
+
+def _persist(token, history, force=False):
+    now = time.time()
+    if not force and now - history.persisted_at < PERSIST_SECONDS:
+        return
+    history.persisted_at = now
+    set_cache(_key(token), {
+        "tiers": {name: closes.dump() for name, closes in history.tiers.items()},
+        "backfilledAt": history.backfilled_at,
+    }, HISTORY_TTL)
+
+
+def observe(token, price, ts=None):
+    """Текущая цена token → закрытие текущего часа и дня."""
+    if not token or not isinstance(price, (int, float)) or price <= 0:
+        return
+    ts = time.time() if ts is None else ts
+    with _lock:
+        history = _histories.setdefault(token, History())
+        history.put(ts, float(price))
+    _persist(token, history)
+
+
+# ─── Backfill ──────────────────────────────────────────────────────────────
+def needs_backfill(tokens, days=PRICE_HISTORY_DAYS):
+    """Токены без дневного ряда на days дней (не чаще BACKFILL_RETRY на токен)."""
+    tokens = [t for t in dict.fromkeys(tokens) if t]
+    _load(tokens)
+    since = time.time() - days * DAY
+    now = time.time()
+    out = []
+    with _lock:
+        for token in tokens:
+            history = _histories.get(token)
+            if history is None or (
+                not history.tiers["day"].covers(since) and now - history.backfilled_at >= BACKFILL_RETRY
+            ):
+                out.append(token)
+    return out[:BACKFILLS_PER_REQUEST]
+
+
+def market_chart_params(days=PRICE_HISTORY_DAYS):
+    # 2..90 дней CoinGecko отдаёт почасово — хватает на оба ряда
+    return {"vs_currency": "usd", "days": str(days)}
+
+
+def apply_backfill(token, data):
+    """Ответ market_chart ({"prices": [[ms, price], ...]}) → ряды token. None/ошибка — попытка учтена."""
+    points = []
+    raw = data.get("prices") if isinstance(data, dict) else None
+    for item in raw or []:
+        try:
+            ms, price = item
+            if price and price > 0:
+                points.append((ms / 1000, float(price)))
+        except (TypeError, ValueError):
+            continue
+    with _lock:
+        history = _histories.setdefault(token, History())
+        history.backfilled_at = time.time()
+        if points:
+            history.merge(points)
+    if points:
+        _persist(token, history, force=True)
+    return len(points)
+
+
+# ─── Lookup ────────────────────────────────────────────────────────────────
+def prices_at(queries):
+    """
+    [(id, ts), ...] → [цена | None, ...] в том же порядке. Один проход слиянием
+    на токен и ряд; ts внутри часового окна — часовой ряд, старше — дневной.
+    """
+    queries = list(queries)
+    out = [None] * len(queries)
+    by_token = {}
+    for i, (token, ts) in enumerate(queries):
+        by_token.setdefault(token, []).append(i)
+    _load(by_token)
+    hourly_since = time.time() - HOURLY_DAYS * DAY
+    with _lock:
+        for token, idx in by_token.items():
+            history = _histories.get(token)
+            if history is None:
+                continue
+            idx.sort(key=lambda i: queries[i][1])
+            recent = [i for i in idx if queries[i][1] >= hourly_since]
+            older = [i for i in idx if queries[i][1] < hourly_since]
+            hourly = history.tiers["hour"].walk([queries[i][1] for i in recent])
+            for i, price in zip(recent, hourly):
+                out[i] = price
+            # старые точки и дыры часового ряда — из дневного
+            rest = older + [i for i in recent if out[i] is None]
+            rest.sort(key=lambda i: queries[i][1])
+            daily = history.tiers["day"].walk([queries[i][1] for i in rest])
+            for i, price in zip(rest, daily):
+                out[i] = price
+    return out
+
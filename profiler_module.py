@@ -0,0 +1,202 @@
+"""
+NearPulse — профилирование на живом инстансе (админ-доступ).
+
+  GET /admin/profile?seconds=10
+      Статистический профайлер: поток админ-запроса каждые interval_ms снимает
+      стеки всех остальных потоков (sys._current_frames) и отдаёт их в collapsed-формате
+      ("root;frame;frame N") — его понимают flamegraph.pl, speedscope,
+      inferno. Корневой кадр — маршрут запроса, который обслуживал поток
+      ("GET /api/balance/<account_id>"), или имя потока.
+      Параметры:
+        seconds     — длительность, по умолчанию 10, максимум 60
+        interval_ms — период выборки, по умолчанию 10 (≈100 Гц)
+        route       — только потоки, обслуживающие маршрут (подстрока шаблона или пути)
+        account     — только запросы этого account_id
+        idle=1      — включать потоки, ждущие в select/recv/lock (wall-clock вид)
+
+  ?profile=1 на /api/balance и /api/stats (декоратор @profiled)
+      Вызов выполняется под cProfile мимо кэша ответа; вместо JSON
+      возвращается текст pstats (sort=cumulative|tottime|ncalls, limit=40).
+      cProfile видит только поток запроса: источники, запущенные через
+      upstream.hedged(), выглядят как ожидание future.
+
+Оба режима требуют "Authorization: Bearer <ADMIN_TOKEN>"; без ADMIN_TOKEN
+они выключены (/admin/profile → 404, ?profile=1 игнорируется). С gunicorn
+профилируется только воркер, принявший запрос. В api_async.py фильтр по
+маршруту работает для смонтированных Flask-маршрутов; ASGI-маршруты живут
+в потоке event loop и попадают в выборку без фильтра.
+
+Env:
+  ADMIN_TOKEN — токен админ-endpoints
+"""
+import os
+import sys
+import hmac
+import time
+import functools
+import threading
+from collections import Counter
+from flask import Response, request
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+MAX_SECONDS = 60
+DEFAULT_INTERVAL_MS = 10
+
+# (файл, функция) листового кадра, на котором поток просто ждёт
+IDLE_LEAVES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"), ("socket.py", "accept"), ("socket.py", "readinto"),
+    ("ssl.py", "read"), ("ssl.py", "recv_into"), ("queue.py", "get"),
+    ("base_events.py", "_run_once"), ("thread.py", "_worker"),
+    ("sync.py", "wait_for_new_connections"), ("gthread.py", "wait_for_and_dispatch_events"),
+}
+
+_active = {}  # thread id → (маршрут, путь, account_id) — только пока идёт выборка
+_session_lock = threading.Lock()
+_sampling = False
+_labels = {}
+
+
+def authorized():
+    given = request.headers.get("Authorization", "").encode()
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(given, f"Bearer {ADMIN_TOKEN}".encode())
+
+
+# ─── Sampler ───────────────────────────────────────────────────────────────
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+def _stack(frame):
+    """Code-объекты кадров от корня к листу."""
+    frames = []
+    while frame is not None:
+        frames.append(frame.f_code)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _is_idle(code):
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES
+
+
+def sample(seconds, interval, route=None, account=None, idle=False):
+    """Снимает стеки в течение seconds → (Counter collapsed-строк, число снимков)."""
+    counts = Counter()
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    deadline = time.perf_counter() + seconds
+    ticks = 0
+    while time.perf_counter() < deadline:
+        ticks += 1
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            req = _active.get(ident)
+            if (route or account) and (
+                req is None
+                or (route and route not in req[0] and route not in req[1])
+                or (account and req[2] != account)
+            ):
+                continue
+            codes = _stack(frame)
+            if not codes or (not idle and _is_idle(codes[-1])):
+                continue
+            if req:
+                root = req[0]
+            else:
+                root = names.get(ident)
+                if root is None:  # поток появился после начала выборки
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                    root = names.get(ident, f"thread-{ident}")
+            counts[";".join([root.replace(";", ":")] + [_label(c) for c in codes])] += 1
+        time.sleep(interval)
+    return counts, ticks
+
+
+def collapsed(counts):
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+
+
+# ─── Flask ─────────────────────────────────────────────────────────────────
+def _before():
+    if _sampling:
+        rule = request.url_rule.rule if request.url_rule else "unmatched"
+        _active[threading.get_ident()] = (
+            f"{request.method} {rule}", request.path, (request.view_args or {}).get("account_id"),
+        )
+
+
+def _teardown(exc):
+    _active.pop(threading.get_ident(), None)
+
+
+def profile_endpoint():
+    global _sampling
+    if not authorized():
+        return Response("not found\n", status=404, mimetype="text/plain")
+    seconds = min(max(request.args.get("seconds", 10, type=float), 0.1), MAX_SECONDS)
+    interval = max(request.args.get("interval_ms", DEFAULT_INTERVAL_MS, type=float), 1) / 1000
+    if not _session_lock.acquire(blocking=False):
+        return Response("profiler busy\n", status=409, mimetype="text/plain")
+    try:
+        _sampling = True
+        t0 = time.perf_counter()
+        counts, ticks = sample(
+            seconds, interval,
+            route=request.args.get("route") or None,
+            account=request.args.get("account") or None,
+            idle=request.args.get("idle") == "1",
+        )
+        elapsed = time.perf_counter() - t0
+    finally:
+        _sampling = False
+        _active.clear()
+        _session_lock.release()
+    print(f"[Profiler] {ticks} ticks in {elapsed:.1f}s, {sum(counts.values())} samples, {len(counts)} stacks")
+    return Response(collapsed(counts), mimetype="text/plain", headers={
+        "X-Profile-Ticks": str(ticks),
+        "X-Profile-Samples": str(sum(counts.values())),
+        "Cache-Control": "no-store",
+    })
+
+
+def profile_requested():
+    """?profile=1 от админа: view пропускает чтение кэша и идёт под cProfile."""
+    return request.args.get("profile") == "1" and authorized()
+
+
+def profiled(view):
+    """Декоратор view: ?profile=1 → текст pstats вместо ответа."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not profile_requested():
+            return view(*args, **kwargs)
+        import io, pstats, cProfile  # только по запросу: не тянем при старте
+        profiler = cProfile.Profile()
+        t0 = time.perf_counter()
+        profiler.enable()
+        try:
+            view(*args, **kwargs)
+        finally:
+            profiler.disable()
+        total = time.perf_counter() - t0
+        sort = request.args.get("sort", "cumulative")
+        if sort not in ("cumulative", "tottime", "ncalls"):
+            sort = "cumulative"
+        out = io.StringIO()
+        stats = pstats.Stats(profiler, stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(request.args.get("limit", 40, type=int))
+        return Response(f"{request.path} {total * 1000:.1f} ms\n{out.getvalue()}", mimetype="text/plain",
+                        headers={"Cache-Control": "no-store"})
+    return wrapper
+
+
+def register_profiler(app):
+    app.before_request(_before)
+    app.teardown_request(_teardown)
+    app.add_url_rule("/admin/profile", "admin_profile", profile_endpoint, methods=["GET", "POST"])
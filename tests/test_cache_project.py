@@ -0,0 +1,53 @@
+"""?fields= (cache_module.project): выбор и исключение полей без порчи кэша."""
+import copy
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+
+from cache_module import project  # noqa: E402
+
+DATA = {
+    "account": "a.near",
+    "near": {"balance": 12.5, "usd": 40.0},
+    "tokens": {"major": [{"symbol": "USDT", "price": 1.0, "icon": "data:..."}], "hidden": []},
+    "nearPrice": 3.2,
+}
+
+
+def test_include_top_level_and_nested():
+    assert project(DATA, "account,near.usd") == {"account": "a.near", "near": {"usd": 40.0}}
+
+
+def test_include_walks_into_lists():
+    assert project(DATA, "tokens.major.symbol") == {"tokens": {"major": [{"symbol": "USDT"}]}}
+
+
+def test_exclude_nested_field_in_list():
+    out = project(DATA, "-tokens.major.icon")
+    assert out["tokens"]["major"] == [{"symbol": "USDT", "price": 1.0}]
+    assert out["near"] == DATA["near"]
+
+
+def test_include_then_exclude():
+    assert project(DATA, "near,tokens,-tokens.hidden,-near.balance") == {
+        "near": {"usd": 40.0},
+        "tokens": {"major": DATA["tokens"]["major"]},
+    }
+
+
+def test_whole_field_wins_over_its_subpath():
+    assert project(DATA, "near,near.usd") == {"near": DATA["near"]}
+
+
+def test_unknown_fields_and_blanks_are_ignored():
+    assert project(DATA, " ,-nope,-also.nope") == DATA
+    assert project(DATA, "nope") == {}
+
+
+def test_source_is_not_modified():
+    before = copy.deepcopy(DATA)
+    project(DATA, "-tokens.major.icon,-near")
+    project(DATA, "tokens.major.symbol")
+    assert DATA == before
@@ -0,0 +1,37 @@
+"""TTL при чтении (follower_module.read_ttl): кап CACHE_TTL — только для семейств follower."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+os.environ.pop("CHAIN_FOLLOW_SECONDS", None)
+
+import cache_module  # noqa: E402
+import follower_module  # noqa: E402
+import price_history_module  # noqa: E402
+import token_registry_module  # noqa: E402
+
+
+def _aged(key, data, ttl, age):
+    cache_module.set_cache(key, data, ttl)
+    cache_module._mem_cache[key]["ts"] -= age
+
+
+def test_registry_and_history_survive_with_follower_disabled():
+    assert not follower_module.healthy()
+    age = cache_module.CACHE_TTL + 1
+    _aged("token:wrap.near", {"symbol": "wNEAR", "decimals": 24}, token_registry_module.REGISTRY_TTL, age)
+    _aged("price_hist:near", {"points": [[1, 2.5]]}, price_history_module.HISTORY_TTL, age)
+    assert cache_module.cached("token:wrap.near") == {"symbol": "wNEAR", "decimals": 24}
+    assert cache_module.cached("price_hist:near") == {"points": [[1, 2.5]]}
+
+
+def test_follow_ttl_entry_is_capped_while_follower_is_down():
+    _aged("txns_all:a.near", {"transactions": []}, follower_module.FOLLOW_TTL, cache_module.CACHE_TTL + 1)
+    assert cache_module.cached("txns_all:a.near") is None
+
+
+def test_follow_ttl_entry_lives_while_follower_is_healthy(monkeypatch):
+    monkeypatch.setattr(follower_module, "healthy", lambda: True)
+    _aged("txns_all:b.near", {"transactions": []}, follower_module.FOLLOW_TTL, cache_module.CACHE_TTL + 1)
+    assert cache_module.cached("txns_all:b.near") == {"transactions": []}
@@ -0,0 +1,39 @@
+"""parse_chat_request: какие вопросы попадают в общий кэш ответов (answer_cache_module)."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+
+import api  # noqa: E402
+
+FOLLOW_UP = "А что насчёт второго пункта?"
+
+
+def _long_history(chars=18_000):
+    """Вопрос и длинный ответ (~18 КБ): последний ответ сам больше AI_HISTORY_TOKENS."""
+    answer = "Стейкинг NEAR — это делегирование токенов валидатору за вознаграждение. "
+    return [
+        {"role": "user", "content": "Расскажи подробно про стейкинг NEAR и риски валидаторов."},
+        {"role": "assistant", "content": answer * (chars // len(answer))},
+    ]
+
+
+def test_follow_up_over_history_budget_is_not_shared():
+    history = _long_history()
+    assert api.trim_history(history) == []  # обрезанная история пуста — вопрос выглядел первым ходом
+    _, _, question = api.parse_chat_request({"message": FOLLOW_UP, "history": history})
+    assert question is None
+
+
+def test_follow_up_after_assistant_only_history_is_not_shared():
+    history = [{"role": "assistant", "content": "1. Рынок. 2. Стейкинг. 3. HOT."}]
+    assert api.trim_history(history) == []
+    _, _, question = api.parse_chat_request({"message": FOLLOW_UP, "history": history})
+    assert question is None
+
+
+def test_first_turn_generic_question_is_shared():
+    messages, _, question = api.parse_chat_request({"message": "Как работает стейкинг HOT?", "history": []})
+    assert question == "как работает стейкинг hot"
+    assert messages == [{"role": "user", "content": "Как работает стейкинг HOT?"}]
@@ -0,0 +1,84 @@
+"""api.classify_tokens: major / filtered / hidden по token_rules.json."""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+
+import api  # noqa: E402
+import token_registry_module as token_registry  # noqa: E402
+
+
+@pytest.fixture
+def rules_file(tmp_path, monkeypatch):
+    """Свой файл правил вместо token_rules.json; после теста — снова штатный."""
+    def use(data):
+        path = tmp_path / "rules.json"
+        path.write_text(json.dumps(data))
+        monkeypatch.setattr(token_registry, "TOKEN_RULES_FILE", str(path))
+        token_registry.load_rules()
+
+    yield use
+    monkeypatch.undo()
+    token_registry.load_rules()
+
+
+def _token(contract, raw, decimals=6, symbol="TKN", name="Token", price=0):
+    return {"contract": contract, "rawAmount": str(raw), "decimals": decimals,
+            "symbol": symbol, "name": name, "nearblocks_price": price}
+
+
+def _contracts(rows):
+    return [t["contract"] for t in rows]
+
+
+def test_shipped_rules_split_major_filtered_hidden():
+    token_registry.load_rules()
+    tokens = [
+        _token("usdt.tether-token.near", 25_000_000),                       # major, 25 USD
+        _token("token.v2.ref-finance.near", 3 * 10**18, decimals=18),     # обычный, 0.6 USD
+        _token("spam.near", 10**6, symbol="www.claim.io"),                  # spam по symbol
+        _token("laboratory.jumpfinance.near", 10**9),                       # spam по контракту
+        _token("dust.near", 1),                                             # дешевле min_usd
+        _token("wrap.near", 10**20, decimals=24),                           # major без цены
+    ]
+    prices = {"usdt.tether-token.near": 1.0, "token.v2.ref-finance.near": 0.2, "spam.near": 1.0,
+              "laboratory.jumpfinance.near": 1.0, "dust.near": 1.0}
+    out = api.classify_tokens(tokens, prices, {}, {})
+    assert _contracts(out["major"]) == ["usdt.tether-token.near"]
+    assert out["major"][0]["usdValue"] == pytest.approx(25.0)
+    assert _contracts(out["filtered"]) == ["token.v2.ref-finance.near"]
+    assert _contracts(out["hidden"]) == ["spam.near", "laboratory.jumpfinance.near", "dust.near"]
+    assert all(t["isSpam"] for t in out["hidden"][:2])
+
+
+def test_price_sources_in_order():
+    tokens = [_token("a.near", 10**6, price=9.0), _token("b.near", 10**6, price=9.0), _token("c.near", 10**6, price=9.0)]
+    out = api.classify_tokens(tokens, {"a.near": 1.0}, {"a.near": 2.0, "b.near": 2.0}, {"c.near": 3.0})
+    assert {t["contract"]: t["price"] for t in out["filtered"]} == {"a.near": 1.0, "b.near": 2.0, "c.near": 3.0}
+
+
+def test_filtered_sorted_by_usd_value():
+    tokens = [_token("small.near", 10**6), _token("big.near", 10**8)]
+    out = api.classify_tokens(tokens, {"small.near": 1.0, "big.near": 1.0}, {}, {})
+    assert _contracts(out["filtered"]) == ["big.near", "small.near"]
+
+
+def test_allow_and_deny_override_keywords(rules_file):
+    rules_file({"major": [], "spam": {"symbol_keywords": ["reward"]},
+                "allow": ["rewards.near"], "deny": ["clean.near"]})
+    tokens = [_token("rewards.near", 10**7, symbol="REWARD"), _token("clean.near", 10**7, symbol="CLEAN")]
+    out = api.classify_tokens(tokens, {"rewards.near": 1.0, "clean.near": 1.0}, {}, {})
+    assert _contracts(out["filtered"]) == ["rewards.near"]
+    assert _contracts(out["hidden"]) == ["clean.near"]
+
+
+def test_rules_reload_changes_verdict(rules_file):
+    token = _token("new.near", 10**7, symbol="NEW")
+    rules_file({"major": ["new.near"]})
+    assert _contracts(api.classify_tokens([token], {"new.near": 1.0}, {}, {})["major"]) == ["new.near"]
+    rules_file({"major": [], "deny": ["new.near"]})
+    assert _contracts(api.classify_tokens([token], {"new.near": 1.0}, {}, {})["hidden"]) == ["new.near"]
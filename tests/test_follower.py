@@ -0,0 +1,91 @@
+"""follower_module: аккаунты из чанка и сброс ключей по активности (без Redis)."""
+import base64
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+
+import cache_module  # noqa: E402
+import follower_module as follower  # noqa: E402
+
+
+def _call(method, **args):
+    return {"FunctionCall": {"method_name": method, "args": base64.b64encode(json.dumps(args).encode()).decode()}}
+
+
+def test_chunk_accounts_from_transactions_receipts_and_args():
+    chunk = {
+        "transactions": [
+            {"signer_id": "alice.near", "receiver_id": "usdt.tether-token.near",
+             "actions": [_call("ft_transfer", receiver_id="bob.near", amount="1")]},
+            {"signer_id": "carol.near", "receiver_id": "carol.near", "actions": ["CreateAccount"]},
+        ],
+        "receipts": [
+            {"predecessor_id": "paras.near", "receiver_id": "x.paras.near",
+             "receipt": {"Action": {"actions": [_call("nft_transfer", new_owner_id="dave.near")]}}},
+            {"predecessor_id": "system", "receiver_id": "erin.near", "receipt": {"Data": {}}},
+        ],
+    }
+    assert follower.chunk_accounts(chunk) == {
+        "alice.near", "usdt.tether-token.near", "bob.near", "carol.near",
+        "paras.near", "x.paras.near", "dave.near", "system", "erin.near",
+    }
+
+
+@pytest.mark.parametrize("action", [
+    {"FunctionCall": {"args": "not base64 json"}},
+    {"FunctionCall": {"args": base64.b64encode(b"[1, 2]").decode()}},
+    _call("ft_transfer", receiver_id=42),
+    {"FunctionCall": {"args": "A" * (follower.ARGS_MAX + 4)}},
+])
+def test_unparsable_or_oversized_args_are_skipped(action):
+    chunk = {"transactions": [{"signer_id": "a.near", "receiver_id": "b.near", "actions": [action]}]}
+    assert follower.chunk_accounts(chunk) == {"a.near", "b.near"}
+
+
+@pytest.mark.parametrize("key, account", [
+    ("balance:a.near", "a.near"),
+    ("nft_all:a.near:p2:pp24", "a.near"),
+    ("portfolio_history:a.near:7d", "a.near"),
+    ("token:wrap.near", None),
+    ("txns:", None),
+])
+def test_account_of(key, account):
+    assert follower.account_of(key) == account
+
+
+@pytest.fixture
+def clean_index(monkeypatch):
+    monkeypatch.setattr(follower, "_keys", {})
+    monkeypatch.setattr(follower, "_stored_at", {})
+    monkeypatch.setattr(follower, "_new_tracked", set())
+    monkeypatch.setattr(follower, "_hooks", [])
+
+
+def test_publish_drops_only_touched_accounts(clean_index):
+    cache_module.on_store(follower.track_keys)
+    for key in ("balance:a.near", "txns:a.near", "balance:b.near", "token:wrap.near"):
+        cache_module.set_cache(key, {"v": key})
+    seen = []
+    follower.on_touch(lambda accounts, keys: seen.append((set(accounts), set(keys))))
+
+    follower.publish(None, 100, {"a.near", "stranger.near"})
+
+    assert cache_module.cached("balance:a.near") is None
+    assert cache_module.cached("txns:a.near") is None
+    assert cache_module.cached("balance:b.near") == {"v": "balance:b.near"}
+    assert cache_module.cached("token:wrap.near") == {"v": "token:wrap.near"}
+    assert seen == [({"a.near", "stranger.near"}, {"balance:a.near", "txns:a.near"})]
+    assert "a.near" not in follower._keys and "b.near" in follower._keys
+
+
+def test_gap_invalidates_every_tracked_account(clean_index):
+    follower.track_keys(["stats:a.near", "nft_contracts:b.near"])
+    cache_module.set_cache("stats:a.near", {"n": 1})
+    follower.publish(None, 100, {follower.ALL})
+    assert follower._keys == {}
+    assert cache_module.cached("stats:a.near") is None
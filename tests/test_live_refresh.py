@@ -0,0 +1,23 @@
+"""api.live_refresh: записи хаба живут столько же, сколько записи REST-маршрутов."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+
+import api  # noqa: E402
+import cache_module  # noqa: E402
+import follower_module  # noqa: E402
+
+
+def test_live_refresh_keeps_follower_ttl_for_txns(monkeypatch):
+    monkeypatch.setattr(follower_module, "healthy", lambda: True)
+    monkeypatch.setattr(api, "fetch_balance_result", lambda account: {"near": 1.0})
+    monkeypatch.setattr(api, "fetch_transactions_result", lambda account: {"transactions": [], "cursor": None})
+
+    balance, txns = api.live_refresh("live.near", since=0)
+
+    assert balance == {"near": 1.0} and txns["transactions"] == []
+    assert cache_module._mem_cache["txns:live.near"]["ttl"] == follower_module.ttl(cache_module.CACHE_TTL)
+    assert cache_module._mem_cache["txns:live.near"]["ttl"] == follower_module.FOLLOW_TTL
+    assert cache_module._mem_cache["balance:live.near"]["ttl"] == cache_module.CACHE_TTL
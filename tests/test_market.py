@@ -0,0 +1,102 @@
+"""market_module: кольцевые буферы OHLC, ряды по уровням TIERS и опрос без поллера."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+
+import market_module  # noqa: E402
+from market_module import Ring  # noqa: E402
+
+
+def test_snapshots_in_one_interval_build_ohlc():
+    ring = Ring(300, 4)
+    for ts, price, volume in ((600, 2.0, 10), (650, 3.0, 11), (700, 1.5, 12), (899, 2.5, 13)):
+        ring.add(ts, price, volume)
+    assert ring.points() == [[600, 2.0, 3.0, 1.5, 2.5, 13]]
+
+
+def test_ring_keeps_last_capacity_intervals_in_order():
+    ring = Ring(60, 3)
+    for k in range(5):
+        ring.add(k * 60, float(k), 0)
+    assert [p[0] for p in ring.points()] == [120, 180, 240]
+    assert ring.size == 3
+
+
+def test_gaps_stay_gaps():
+    ring = Ring(60, 10)
+    ring.add(0, 1.0, 0)
+    ring.add(600, 2.0, 0)  # поллер стоял 10 минут
+    assert [p[0] for p in ring.points()] == [0, 600]
+
+
+def test_snapshot_from_the_past_is_dropped():
+    ring = Ring(60, 10)
+    ring.add(120, 1.0, 0)
+    ring.add(30, 9.0, 0)
+    assert ring.points() == [[120, 1.0, 1.0, 1.0, 1.0, 0]]
+
+
+def test_points_since():
+    ring = Ring(60, 10)
+    for k in range(4):
+        ring.add(k * 60, 1.0, 0)
+    assert [p[0] for p in ring.points(since=120)] == [120, 180]
+
+
+def test_record_feeds_every_tier_and_chart(monkeypatch):
+    monkeypatch.setattr(market_module, "_series", {})
+    monkeypatch.setattr(market_module, "_latest", {})
+    now = 1_800_000_000
+    pair = {"chainId": "near", "priceUsd": "3.5", "volume": {"h24": "1000"}, "info": {"x": 1},
+            "baseToken": {"address": "wrap.near", "symbol": "wNEAR", "extra": 1}}
+    market_module.record({"wrap.near": pair}, ts=now)
+    series = market_module._series["wrap.near"]
+    assert {name: len(ring.points()) for name, ring in series.tiers.items()} == dict.fromkeys(market_module.TIERS, 1)
+    assert market_module._latest["wrap.near"] == {"chainId": "near", "priceUsd": "3.5", "volume": {"h24": "1000"},
+                                                  "baseToken": {"address": "wrap.near", "symbol": "wNEAR"}}
+    monkeypatch.setattr(market_module.time, "time", lambda: now + 60)
+    assert market_module.chart("near", "24h")["points"] == [[now - now % 300, 3.5, 3.5, 3.5, 3.5, 1000.0]]
+
+
+def test_best_pairs_picks_highest_volume_near_pair():
+    pairs = [
+        {"chainId": "near", "priceUsd": "1", "volume": {"h24": 5}, "baseToken": {"address": "A.near"}},
+        {"chainId": "near", "priceUsd": "1", "volume": {"h24": 50}, "baseToken": {"address": "a.near"}},
+        {"chainId": "solana", "priceUsd": "1", "volume": {"h24": 500}, "baseToken": {"address": "a.near"}},
+        {"chainId": "near", "priceUsd": "nan", "volume": {"h24": 900}, "baseToken": {"address": "a.near"}},
+    ]
+    assert market_module.best_pairs(pairs, ["a.near"])["a.near"]["volume"]["h24"] == 50
+
+
+def test_without_poller_routes_poll_once_on_demand(monkeypatch):
+    import api
+
+    calls = []
+
+    def fetch(endpoint, url, **kwargs):
+        calls.append(endpoint)
+        return {"pairs": [{"chainId": "near", "pairAddress": "p1", "priceUsd": "3", "info": {}}]}
+
+    monkeypatch.setattr(market_module, "_fetch", fetch)
+    monkeypatch.setattr(market_module, "_poller", None)
+    monkeypatch.setattr(market_module, "_on_demand_at", {})
+    monkeypatch.setattr(market_module, "_snapshot", dict(market_module._snapshot, pairs=[], pairsAt=None))
+    client = api.app.test_client()
+
+    first = client.get("/api/market/near")
+    second = client.get("/api/market/near")
+
+    assert first.status_code == 200 and second.status_code == 200
+    assert first.get_json()["pairs"] == [{"chainId": "near", "pairAddress": "p1", "priceUsd": "3"}]
+    assert calls == ["search"]  # второй запрос — из снимка, не чаще ON_DEMAND_SECONDS
+
+
+def test_with_poller_read_does_not_fetch(monkeypatch):
+    monkeypatch.setattr(market_module, "poller_running", lambda: True)
+    monkeypatch.setattr(market_module, "_fetch", lambda *a, **k: pytest.fail("fetched on the request path"))
+    monkeypatch.setattr(market_module, "_snapshot", dict(market_module._snapshot, newTokens=[], newTokensAt=None))
+    assert market_module.read("newTokens") == ([], None)
@@ -0,0 +1,109 @@
+"""nft_module: страница /api/nft-tokens и курсоры листинга контрактов."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+
+import nft_module  # noqa: E402
+
+
+def _token(i, contract="paras.near", meta=None, media=None):
+    t = {"token_id": str(i), "contract": contract, "media": media or f"{i}.png"}
+    if meta is not None:
+        t["nft_meta"] = meta
+    return t
+
+
+def test_page_keeps_rows_beyond_per_page():
+    page = nft_module.build_nft_page({"nfts": [_token(i) for i in range(5)], "total": 9}, 1, 4)
+    assert [t["tokenId"] for t in page["tokens"]] == ["0", "1", "2", "3", "4"]
+    assert page["hasMore"] is True
+
+
+def test_short_page_has_no_more():
+    page = nft_module.build_nft_page({"nfts": [_token(i) for i in range(3)]}, 2, 4)
+    assert page["hasMore"] is False
+
+
+def test_contract_meta_taken_from_first_token_that_has_it():
+    meta = {"name": "Paras Gems", "icon": "data:image/png;base64,AA", "base_uri": "https://cdn.paras.id"}
+    raw = [_token(1), _token(2, meta=meta), _token(3)]
+    tokens = nft_module.build_nft_page({"nfts": raw}, 1, 24)["tokens"]
+    assert {t["contractName"] for t in tokens} == {"Paras Gems"}
+    assert {t["contractIcon"] for t in tokens} == {"data:image/png;base64,AA"}
+    assert tokens[1]["media"] == "https://cdn.paras.id/2.png"
+    assert tokens[2]["media"] == "https://cdn.paras.id/3.png"  # base_uri контракта — и токенам без своих метаданных
+
+
+def test_token_without_any_meta_falls_back_to_display_name():
+    tokens = nft_module.build_nft_page({"nfts": [_token(1, contract="x.paras.near")]}, 1, 24)["tokens"]
+    assert tokens[0]["contractName"] == nft_module._contract_display_name("x.paras.near")
+    assert tokens[0]["contractIcon"] is None
+
+
+def _listing():
+    # одинаковые count — порядок по имени контракта
+    return nft_module._build_listing([("c.near", 3, []), ("a.near", 5, []), ("b.near", 3, []), ("d.near", 1, [])])
+
+
+def test_listing_sorted_by_count_then_contract():
+    listing = _listing()
+    assert [c["contract"] for c in listing["contracts"]] == ["a.near", "b.near", "c.near", "d.near"]
+    assert listing["totalNfts"] == 12
+
+
+def test_contracts_cursor_round_trip():
+    assert nft_module.decode_cursor(nft_module.encode_cursor((-3, "b.near"))) == (-3, "b.near")
+
+
+def test_contracts_cursor_walks_all_pages():
+    listing = _listing()
+    seen, cursor = [], None
+    for _ in range(3):
+        payload, _ = nft_module.contracts_page(listing, "x.near", 1, 3, cursor)
+        seen += [c["contract"] for c in payload["nfts"]]
+        cursor = payload["nextCursor"]
+        if not payload["hasMore"]:
+            break
+    assert seen == ["a.near", "b.near", "c.near", "d.near"]
+    assert payload["page"] == 2 and cursor is None
+
+
+def test_contracts_cursor_survives_insert_before_it():
+    payload, _ = nft_module.contracts_page(_listing(), "x.near", 1, 2)
+    grown = nft_module._build_listing([("c.near", 3, []), ("a.near", 5, []), ("b.near", 3, []),
+                                       ("d.near", 1, []), ("aa.near", 4, [])])
+    nxt, _ = nft_module.contracts_page(grown, "x.near", 1, 2, payload["nextCursor"])
+    assert [c["contract"] for c in nxt["nfts"]] == ["c.near", "d.near"]
+
+
+def test_contracts_page_etag_depends_on_listing_and_slice():
+    listing = _listing()
+    _, first = nft_module.contracts_page(listing, "x.near", 1, 2)
+    _, second = nft_module.contracts_page(listing, "x.near", 2, 2)
+    _, other = nft_module.contracts_page(nft_module._build_listing([("a.near", 6, [])]), "x.near", 1, 2)
+    assert len({first, second, other}) == 3
+
+
+def test_contracts_malformed_cursor_is_value_error():
+    with pytest.raises(ValueError):
+        nft_module.contracts_page(_listing(), "x.near", 1, 2, "garbage")
+
+
+@pytest.mark.parametrize("page, per_page", [(1, 0), (1, -5), (0, 20), (-1, 20)])
+def test_contracts_page_rejects_bad_page_or_limit(page, per_page):
+    with pytest.raises(ValueError):
+        nft_module.contracts_page(_listing(), "x.near", page, per_page)
+
+
+@pytest.mark.parametrize("query", ["limit=0", "page=0", "page=-2&limit=5"])
+def test_nfts_route_answers_400_before_upstream(monkeypatch, query):
+    import api
+
+    monkeypatch.setattr(nft_module, "fetch_nft_listing", lambda account: pytest.fail("listing fetched"))
+    r = api.app.test_client().get(f"/api/nfts/x.near?{query}")
+    assert r.status_code == 400
+    assert "must be at least 1" in r.get_json()["error"]
@@ -0,0 +1,35 @@
+"""price_history_module: общий ряд price_hist: читается, когда Redis подключился."""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+
+import price_history_module as ph  # noqa: E402
+
+
+def _stored(token, price):
+    hour = time.time() - time.time() % ph.HOUR
+    return {ph._key(token): {"tiers": {"hour": [[hour, price]], "day": []}, "backfilledAt": 0}}
+
+
+def test_history_not_marked_loaded_until_redis_is_read(monkeypatch):
+    connected = {"redis": False}
+    monkeypatch.setattr(ph, "UPSTASH_REDIS_URL", "redis://cache:6379")
+    monkeypatch.setattr(ph, "has_redis", lambda: connected["redis"])
+    # без соединения get_many видит только память процесса
+    monkeypatch.setattr(ph, "get_many", lambda keys: _stored("shared-token", 3.5) if connected["redis"] else {})
+
+    assert ph.prices_at([("shared-token", time.time())]) == [None]
+    assert "shared-token" not in ph._loaded
+
+    connected["redis"] = True
+    assert ph.prices_at([("shared-token", time.time())]) == [3.5]
+    assert "shared-token" in ph._loaded
+
+
+def test_without_redis_memory_read_counts_as_loaded(monkeypatch):
+    monkeypatch.setattr(ph, "get_many", lambda keys: {})
+    ph.prices_at([("local-token", time.time())])
+    assert "local-token" in ph._loaded
@@ -0,0 +1,38 @@
+"""token_registry_module.from_row: decimals из ft_meta строки NearBlocks inventory."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+
+import token_registry_module as token_registry  # noqa: E402
+
+
+@pytest.mark.parametrize("decimals, expected", [
+    (24, 24),
+    ("24", 24),
+    (" 6 ", 6),
+    (0, 0),
+    (18.0, 18),
+])
+def test_decimals_accepted(decimals, expected):
+    meta = token_registry.from_row({"contract": "Some.Token.near", "ft_meta": {"decimals": decimals}})
+    assert meta["decimals"] == expected
+    assert meta["source"] == "nearblocks"
+
+
+@pytest.mark.parametrize("decimals", [None, "", "abc", "2.5", -1, "-6", True, [18]])
+def test_decimals_rejected(decimals):
+    meta = token_registry.from_row({"contract": "some.token.near", "ft_meta": {"decimals": decimals}})
+    assert "decimals" not in meta
+
+
+def test_row_level_decimals_when_ft_meta_has_none():
+    assert token_registry.from_row({"contract": "x.near", "decimals": "9"})["decimals"] == 9
+
+
+def test_seed_decimals_win_over_row():
+    meta = token_registry.from_row({"contract": "usdt.tether-token.near", "ft_meta": {"decimals": "18"}})
+    assert meta["decimals"] == 6
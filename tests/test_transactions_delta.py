@@ -0,0 +1,88 @@
+"""/api/transactions?since=: курсор и reset (api.build_transactions_delta)."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+
+import api  # noqa: E402
+
+
+def _index(n, newest=1_000):
+    # id tN — N-я по новизне; у t2 и t3 одна секунда: порядок внутри — по id
+    analyzed = [{"id": f"t{i}", "timestamp": str(newest - i + (i == 3))} for i in range(n)]
+    return api.build_transactions_index(list(reversed(analyzed)), 5.0)
+
+
+def _ids(result):
+    return [tx["id"] for tx in result["transactions"]]
+
+
+def _cursor_of(index, tx_id):
+    return api.encode_tx_cursor(next(k for k in index["sortKeys"] if k[1] == tx_id))
+
+
+def test_index_is_newest_first_with_ties_by_id():
+    index = _index(5)
+    assert [tx["id"] for tx in index["transactions"]] == ["t0", "t1", "t2", "t3", "t4"]
+    assert index["sortKeys"] == sorted(index["sortKeys"])
+
+
+def test_cursor_round_trip():
+    key = [-1_000, "t0"]
+    assert api.decode_tx_cursor(api.encode_tx_cursor(key)) == key
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", api.encode_tx_cursor(["x"])[:-2]])
+def test_malformed_cursor_is_value_error(cursor):
+    with pytest.raises(ValueError):
+        api.build_transactions_delta(_index(3), cursor, 10)
+
+
+def test_full_result_cursor_points_at_newest():
+    index = _index(5)
+    result = api.build_transactions_result(index, 2)
+    assert _ids(result) == ["t0", "t1"]
+    assert result["total"] == 5
+    assert api.decode_tx_cursor(result["cursor"]) == index["sortKeys"][0]
+
+
+def test_delta_returns_only_newer():
+    index = _index(6)
+    delta = api.build_transactions_delta(index, _cursor_of(index, "t3"), 10)
+    assert _ids(delta) == ["t0", "t1", "t2"]
+    assert delta["reset"] is False
+    assert api.decode_tx_cursor(delta["cursor"]) == index["sortKeys"][0]
+
+
+def test_delta_without_news_keeps_cursor():
+    index = _index(4)
+    cursor = _cursor_of(index, "t0")
+    delta = api.build_transactions_delta(index, cursor, 10)
+    assert delta["transactions"] == []
+    assert delta["cursor"] == cursor
+    assert delta["reset"] is False
+
+
+def test_more_news_than_limit_resets():
+    index = _index(10)
+    delta = api.build_transactions_delta(index, _cursor_of(index, "t8"), 5)
+    assert delta["reset"] is True
+    assert _ids(delta) == ["t0", "t1", "t2", "t3", "t4"]
+
+
+def test_cursor_older_than_cached_list_resets():
+    index = _index(4)
+    delta = api.build_transactions_delta(index, api.encode_tx_cursor([-1, "ancient"]), 10)
+    assert delta["reset"] is True
+    assert _ids(delta) == ["t0", "t1", "t2", "t3"]
+
+
+def test_cursor_of_unknown_tx_inside_list_still_deltas():
+    # транзакция курсора выпала из списка, но по времени он внутри — бинпоиск по ключу
+    index = _index(6)
+    delta = api.build_transactions_delta(index, api.encode_tx_cursor([-998, "t1z"]), 10)
+    assert _ids(delta) == ["t0", "t1"]
+    assert delta["reset"] is False
@@ -0,0 +1,44 @@
+"""hedged(): отказ governor'а на одной ноге не помечает запрос degraded."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("UPSTASH_REDIS_URL", None)
+
+import upstream_module as upstream  # noqa: E402
+
+
+@pytest.fixture
+def throttled_intear(monkeypatch):
+    # у intear нет токенов дольше MAX_WAIT — admit бросает Throttled
+    monkeypatch.setattr(upstream, "_admission_wait", lambda provider, priority: 60.0 if provider == "intear" else 0)
+
+
+def _intear():
+    # как api.intear_near_price: до сети дело не доходит — отказ на admit
+    return upstream.get("intear", "http://127.0.0.1:9/prices", endpoint="near_price", degrade=False).json()
+
+
+def test_shed_leg_does_not_degrade_when_other_answers(throttled_intear):
+    with upstream.scope():
+        assert upstream.hedged(("intear", _intear), ("coingecko", lambda: 2.0)) == 2.0
+        assert not upstream.degraded()
+
+
+def test_hedged_degrades_when_nobody_answers(throttled_intear):
+    def coingecko():
+        raise upstream.UpstreamError("coingecko HTTP 503")
+
+    with upstream.scope():
+        with pytest.raises(upstream.UpstreamError):
+            upstream.hedged(("intear", _intear), ("coingecko", coingecko))
+        assert upstream.failed_providers() == ["coingecko", "intear"]
+
+
+def test_shed_degrades_by_default(throttled_intear):
+    with upstream.scope():
+        with pytest.raises(upstream.Throttled):
+            upstream.admit("intear")
+        assert upstream.degraded()
@@ -0,0 +1,397 @@
+"""
+NearPulse — реестр метаданных FT-токенов, общий для всех аккаунтов.
+
+Для каждого контракта: decimals, symbol, name, iconHash, coingeckoId,
+spam-вердикт и источник (source). Запись заполняется лениво — из ft_meta
+строк NearBlocks inventory, а если там нет decimals, из ft_metadata самого
+контракта (RPC call_function). Раз узнанные метаданные хранятся в памяти
+процесса и в общем кэше (Redis, ключ token:<contract>, REGISTRY_TTL), так
+что следующий аккаунт с тем же токеном не угадывает decimals заново.
+
+Порядок доверия decimals: SEED_DECIMALS (проверено руками) → ft_meta /
+ft_metadata → догадка по величине суммы. Догадка (source="guess") не
+сохраняется: при следующей встрече токена метаданные запрашиваются снова.
+
+Spam / major: правила — в token_rules.json (TOKEN_RULES_FILE): список major,
+ключевые слова spam для symbol / name, подстроки контрактов, allow / deny.
+Файл перечитывается при изменении (проверка mtime раз в RULES_CHECK_SECONDS).
+Вердикт считается один раз на (contract, symbol, name) и лежит в индексе
+правил, так что разбор токенов аккаунта — линейный проход с O(1)-поиском.
+
+Суммы считаются точно: raw amount — int из строки, перевод в единицы —
+Decimal.scaleb(-decimals); float появляется только в итоговом JSON.
+"""
+import os
+import re
+import json
+import time
+import base64
+import hashlib
+import threading
+from decimal import Decimal, InvalidOperation
+from cache_module import get_many, set_many
+
+REGISTRY_TTL = 7 * 24 * 3600
+REFRESH_AFTER = 24 * 3600     # запись старше — обновляется из ft_meta строки inventory
+RETRY_MISSING_AFTER = 3600    # контракт без ft_metadata не спрашиваем чаще
+RPC_LOOKUPS_PER_REQUEST = 8  # ft_metadata за один запрос баланса, остальное — в следующий раз
+TOKEN_RULES_FILE = os.environ.get("TOKEN_RULES_FILE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "token_rules.json")
+RULES_CHECK_SECONDS = 30      # как часто смотреть mtime файла правил
+INDEX_MAX = 100_000           # вердиктов в индексе; при переполнении индекс строится заново
+
+SEED_DECIMALS = {
+    "dac17f958d2ee523a2206206994597c13d831ec7.factory.bridge.near": 6,
+    "usdt.tether-token.near": 6,
+    "a0b86991c6218b36c1d19d4a2e9eb0ce3606eb48.factory.bridge.near": 6,
+    "17208628f84f5d6ad33f0da3bbbeb27ffcb398eac501a31bd6ad2011e36133a1": 18,
+    "wrap.near": 24,
+    "token.v2.ref-finance.near": 18,
+    "token.burrow.near": 9,
+    "meta-pool.near": 24,
+    "token.skyward.near": 18,
+    "token.pembrock.near": 18,
+    "2260fac5e5542a773aa44fbcfedf7c193bc2c599.factory.bridge.near": 8,
+    "c02aaa39b223fe8d0a0e5c4f27ead9083c756cc2.factory.bridge.near": 18,
+    "eth.bridge.near": 18,
+    "aurora": 18,
+    "token.paras.near": 18,
+    "game.hot.tg": 6,
+    "harvest-moon.near": 6,
+    "aa-harvest-moon.near": 9,
+    "token.0xshitzu.near": 18,
+    "pre.meteor-token.near": 9,
+    "meteor-points.near": 9,
+    "token.rhealab.near": 9,
+    "lst.rhealab.near": 24,
+    "token.lonkingnearbackto2024.near": 18,
+    "dd.tg": 18,
+    "benthedog.near": 18,
+    "meme-cooking.near": 18,
+}
+
+SEED_COINGECKO = {
+    "dac17f958d2ee523a2206206994597c13d831ec7.factory.bridge.near": "tether",
+    "usdt.tether-token.near": "tether",
+    "a0b86991c6218b36c1d19d4a2e9eb0ce3606eb48.factory.bridge.near": "usd-coin",
+    "17208628f84f5d6ad33f0da3bbbeb27ffcb398eac501a31bd6ad2011e36133a1": "dai",
+    "wrap.near": "near",
+    "token.v2.ref-finance.near": "ref-finance",
+    "token.burrow.near": "burrow",
+    "2260fac5e5542a773aa44fbcfedf7c193bc2c599.factory.bridge.near": "wrapped-bitcoin",
+    "c02aaa39b223fe8d0a0e5c4f27ead9083c756cc2.factory.bridge.near": "ethereum",
+    "eth.bridge.near": "ethereum",
+    "aurora": "aurora-near",
+    "token.paras.near": "paras",
+}
+
+_registry = {}  # contract.lower() → метаданные
+_no_metadata = {}  # contract.lower() → когда ft_metadata не удалось получить
+_lock = threading.Lock()
+
+
+def _key(contract):
+    return f"token:{contract}"
+
+
+# ─── Правила и индекс spam / major ─────────────────────────────────────────
+def _matcher(words):
+    """Одна регулярка на набор подстрок вместо any(k in s for k in ...)."""
+    words = sorted({w.lower() for w in words or () if w}, key=len, reverse=True)
+    if not words:
+        return lambda text: None
+    return re.compile("|".join(re.escape(w) for w in words)).search
+
+
+class Rules:
+    """Разобранный token_rules.json. version — хэш содержимого: по нему
+    записи реестра понимают, что их spam-вердикт посчитан по старым правилам."""
+
+    def __init__(self, data, version):
+        spam = data.get("spam") or {}
+        self.version = version
+        self.major = frozenset(c.lower() for c in data.get("major") or ())
+        self.allow = frozenset(c.lower() for c in data.get("allow") or ())
+        self.deny = frozenset(c.lower() for c in data.get("deny") or ())
+        self.symbol = _matcher(spam.get("symbol_keywords"))
+        self.name = _matcher(spam.get("name_keywords"))
+        self.contract = _matcher(spam.get("contract_patterns"))
+        self.index = {}  # (contract, symbol, name) → (major, spam)
+
+    def verdict(self, contract, symbol, name):
+        """(major, spam) для токена."""
+        c = contract.lower()
+        if c in self.deny:
+            return c in self.major, True
+        if c in self.allow:
+            return c in self.major, False
+        spam = bool(
+            self.symbol((symbol or "").lower())
+            or self.name((name or "").lower())
+            or self.contract(c)
+        )
+        return c in self.major, spam
+
+
+_rules = Rules({}, "empty")
+_rules_mtime = None
+_rules_checked = float("-inf")
+
+
+def load_rules(path=None):
+    """Перечитать файл правил; при ошибке остаются прежние правила."""
+    global _rules, _rules_mtime
+    path = path or TOKEN_RULES_FILE
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        mtime = os.path.getmtime(path)
+        _rules = Rules(json.loads(raw), hashlib.blake2b(raw, digest_size=6).hexdigest())
+        _rules_mtime = mtime
+        print(f"[Tokens] rules {_rules.version}: {len(_rules.major)} major, "
+              f"{len(_rules.allow)} allow, {len(_rules.deny)} deny")
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        print(f"[Tokens] rules file {path} not loaded: {e}")
+    return _rules
+
+
+def rules():
+    """Текущие правила; раз в RULES_CHECK_SECONDS — проверка, не изменился ли файл."""
+    global _rules_checked
+    now = time.monotonic()
+    if now - _rules_checked >= RULES_CHECK_SECONDS:
+        _rules_checked = now
+        try:
+            changed = os.path.getmtime(TOKEN_RULES_FILE) != _rules_mtime
+        except OSError:
+            changed = False
+        if changed:
+            load_rules()
+    return _rules
+
+
+def classify(contract, symbol, name):
+    """(major, spam) — из индекса текущих правил; правила применяются один раз на токен."""
+    current = rules()
+    key = (contract, symbol, name)
+    found = current.index.get(key)
+    if found is None:
+        if len(current.index) >= INDEX_MAX:
+            current.index.clear()
+        found = current.index[key] = current.verdict(contract, symbol, name)
+    return found
+
+
+def is_spam(contract, symbol, name):
+    return classify(contract, symbol, name)[1]
+
+
+def is_major(contract):
+    return contract.lower() in rules().major
+
+
+def icon_hash(icon):
+    return hashlib.blake2b(icon.encode(), digest_size=8).hexdigest() if icon else None
+
+
+def _with_verdict(meta):
+    version = rules().version
+    if meta.get("spamRules") != version:
+        meta["spam"] = is_spam(meta["contract"], meta.get("symbol"), meta.get("name"))
+        meta["spamRules"] = version
+    return meta
+
+
+def lookup(contracts):
+    """
+    {contract.lower(): метаданные} для известных реестру контрактов: память
+    процесса, затем один MGET общего кэша. Неизвестные в ответ не попадают.
+    """
+    wanted = {c.lower() for c in contracts}
+    with _lock:
+        found = {c: _registry[c] for c in wanted if c in _registry}
+    missing = [c for c in wanted if c not in found]
+    if missing:
+        shared = get_many([_key(c) for c in missing])
+        with _lock:
+            for c in missing:
+                meta = shared.get(_key(c))
+                if meta:
+                    found[c] = _registry[c] = _with_verdict(dict(meta))
+    return found
+
+
+_FIELDS = ("decimals", "symbol", "name", "iconHash", "coingeckoId")
+
+
+def _differs(old, new):
+    return any(old.get(k) != new.get(k) for k in _FIELDS)
+
+
+def remember(metas):
+    """Сохранить новые или изменившиеся записи (в память и пакетом в общий кэш)."""
+    changed = {}
+    with _lock:
+        for meta in metas:
+            c = meta["contract"]
+            old = _registry.get(c) or {}
+            new = _with_verdict({**old, **meta, "updatedAt": int(time.time())})
+            if _differs(old, new):
+                changed[_key(c)] = new
+            _registry[c] = new
+    if changed:
+        set_many(changed, REGISTRY_TTL)
+
+
+def _seed(contract):
+    meta = {"contract": contract, "coingeckoId": SEED_COINGECKO.get(contract)}
+    if contract in SEED_DECIMALS:
+        meta["decimals"], meta["source"] = SEED_DECIMALS[contract], "seed"
+    return meta
+
+
+def _parse_decimals(value):
+    """decimals из ft_meta: число или строка ("24"); None — не разбирается или отрицательное."""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        decimals = int(value)
+    except (TypeError, ValueError):
+        return None
+    return decimals if decimals >= 0 else None
+
+
+def from_row(row):
+    """Метаданные из строки NearBlocks inventory (ft_meta) — без decimals, если их нет."""
+    ft_meta = row.get("ft_meta") or {}
+    contract = (row.get("contract") or "").lower()
+    meta = _seed(contract)
+    decimals = _parse_decimals(ft_meta.get("decimals", row.get("decimals")))
+    if "decimals" not in meta and decimals is not None:
+        meta["decimals"], meta["source"] = decimals, "nearblocks"
+    meta["symbol"] = row.get("symbol") or ft_meta.get("symbol")
+    meta["name"] = row.get("name") or ft_meta.get("name")
+    meta["iconHash"] = icon_hash(row.get("icon") or ft_meta.get("icon"))
+    return meta
+
+
+def resolve_rows(rows):
+    """
+    {contract.lower(): метаданные} для строк inventory. Decimals из реестра
+    главнее ft_meta строки (кроме SEED); новое запоминается. Контракты без
+    decimals — в missing_decimals() для запроса ft_metadata.
+    """
+    known = lookup(row.get("contract") or "" for row in rows)
+    learned = []
+    now = time.time()
+    for row in rows:
+        old = known.get((row.get("contract") or "").lower()) or {}
+        if old.get("decimals") is not None and now - old.get("updatedAt", 0) < REFRESH_AFTER:
+            continue  # свежая запись: строку (и её иконку) не разбираем
+        meta = from_row(row)
+        c = meta["contract"]
+        merged = {**old, **{k: v for k, v in meta.items() if v is not None}}
+        if old.get("decimals") is not None and meta.get("source") != "seed":
+            merged["decimals"], merged["source"] = old["decimals"], old.get("source")
+        if merged.get("decimals") is not None and _differs(old, merged):
+            learned.append(merged)
+        known[c] = merged
+    if learned:
+        remember(learned)
+    return known
+
+
+def missing_decimals(known):
+    """Контракты без decimals, для которых стоит запросить ft_metadata (не больше RPC_LOOKUPS_PER_REQUEST)."""
+    now = time.time()
+    return [
+        c for c, meta in known.items()
+        if meta.get("decimals") is None and now - _no_metadata.get(c, 0) >= RETRY_MISSING_AFTER
+    ][:RPC_LOOKUPS_PER_REQUEST]
+
+
+# ─── ft_metadata через RPC ─────────────────────────────────────────────────
+def ft_metadata_payload(contract):
+    return {
+        "jsonrpc": "2.0",
+        "id": "dontcare",
+        "method": "query",
+        "params": {
+            "request_type": "call_function",
+            "finality": "final",
+            "account_id": contract,
+            "method_name": "ft_metadata",
+            "args_base64": base64.b64encode(b"{}").decode(),
+        },
+    }
+
+
+def parse_ft_metadata(contract, data):
+    """Ответ RPC ft_metadata → метаданные реестра или None."""
+    result = (data.get("result") or {}).get("result") if isinstance(data, dict) else None
+    if not result or not isinstance(result, list):
+        return None
+    try:
+        ft = json.loads(bytes(result).decode("utf-8"))
+        decimals = int(ft["decimals"])
+    except (ValueError, KeyError, TypeError):
+        return None
+    meta = _seed(contract)
+    meta.setdefault("decimals", decimals)
+    meta.setdefault("source", "ft_metadata")
+    meta.update({"symbol": ft.get("symbol"), "name": ft.get("name"), "iconHash": icon_hash(ft.get("icon"))})
+    return meta
+
+
+def apply_ft_metadata(known, contracts, metas):
+    """Результаты ft_metadata (None — ошибка) для contracts → в known и реестр."""
+    now = time.time()
+    fetched = []
+    for contract, meta in zip(contracts, metas):
+        if meta:
+            known[contract] = {**known.get(contract, {}), **meta}
+            fetched.append(meta)
+            _no_metadata.pop(contract, None)
+        else:
+            _no_metadata[contract] = now
+    if fetched:
+        remember(fetched)
+
+
+# ─── Amounts ───────────────────────────────────────────────────────────────
+def raw_amount(value):
+    """Сумма в минимальных единицах: int из строки ("1e+21" и "12.0" тоже)."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(Decimal(str(value)))
+        except (InvalidOperation, ValueError):
+            return 0
+
+
+def guess_decimals(raw):
+    return 18 if raw > 10**15 else 0
+
+
+def to_units(raw, decimals):
+    return Decimal(raw).scaleb(-decimals) if decimals else Decimal(raw)
+
+
+def decimals_of(known, contract, raw):
+    """(decimals, угадано ли). known — разрешённые метаданные; без них — память процесса и SEED."""
+    meta = known.get(contract.lower()) or _registry.get(contract.lower()) or {}
+    if meta.get("decimals") is not None:
+        return int(meta["decimals"]), False
+    if contract.lower() in SEED_DECIMALS:
+        return SEED_DECIMALS[contract.lower()], False
+    return guess_decimals(raw), True
+
+
+def coingecko_id(contract):
+    meta = _registry.get(contract.lower())
+    return (meta or {}).get("coingeckoId") or SEED_COINGECKO.get(contract.lower())
+
+
+def known_coingecko_ids():
+    return sorted(set(SEED_COINGECKO.values()))
@@ -0,0 +1,288 @@
+"""
+NearPulse — лёгкий трейсинг запросов и заголовок Server-Timing.
+
+Каждый запрос получает trace; в него пишутся спаны: вызовы upstream
+(upstream_module — "nearblocks.inventory", "rpc.view_account", ...),
+фазы вычислений (@traced: get_tokens_with_prices, analyze_transactions,
+compute_analytics, ...) и работа с кэшем. По завершении:
+
+  • ответ получает Server-Timing (суммы по имени спана + total) и X-Trace-Id —
+    в DevTools видно, что именно было медленным на экране баланса;
+  • выбранные trace (доля TRACE_SAMPLE_RATE, все медленнее TRACE_SLOW_MS
+    и запросы с заголовком "X-Trace-Sample: 1" от админа — вместе с
+    "Authorization: Bearer <ADMIN_TOKEN>") уходят в фоне в JSONL-файл
+    и/или OTLP/HTTP JSON коллектор. Без ADMIN_TOKEN заголовок игнорируется:
+    иначе любой клиент заставил бы экспортировать каждый свой запрос.
+
+Env:
+  SERVER_TIMING     — "0" отключает заголовок
+  TRACE_SAMPLE_RATE — доля запросов, сохраняемых целиком (по умолчанию 0)
+  TRACE_SLOW_MS     — сохранять все запросы дольше этого (0 — выкл.)
+  TRACE_FILE        — путь JSONL-файла
+  TRACE_OTLP_URL    — OTLP/HTTP endpoint, напр. http://collector:4318/v1/traces
+  ADMIN_TOKEN       — токен, с которым принимается X-Trace-Sample
+"""
+import os
+import hmac
+import json
+import time
+import queue
+import random
+import asyncio
+import functools
+import threading
+import contextlib
+import contextvars
+import requests as http_requests
+from flask import request
+
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") != "0"
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", 0))
+TRACE_FILE = os.environ.get("TRACE_FILE", "")
+TRACE_OTLP_URL = os.environ.get("TRACE_OTLP_URL", "")
+SAMPLE_HEADER = "X-Trace-Sample"
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+_trace = contextvars.ContextVar("trace", default=None)
+_parent = contextvars.ContextVar("trace_parent", default=None)
+_export_queue = None
+_exporter_pid = None
+
+
+def _new_id(nbytes):
+    return f"{random.getrandbits(nbytes * 8):0{nbytes * 2}x}"
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attrs")
+
+    def __init__(self, name, parent_id, start, attrs):
+        self.name, self.parent_id, self.start, self.attrs = name, parent_id, start, attrs
+        self.span_id = _new_id(8)
+        self.end = start
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "start", "wall_start", "spans", "force")
+
+    def __init__(self, name, force=False):
+        self.trace_id = _new_id(16)
+        self.name = name
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans = []  # list.append атомарен — пишут и потоки hedge, и asyncio-задачи
+        self.force = force
+
+
+def start_trace(name, force=False):
+    trace = Trace(name, force)
+    _trace.set(trace)
+    _parent.set(None)
+    return trace
+
+
+def end_trace():
+    _trace.set(None)
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    s = Span(name, _parent.get(), time.perf_counter(), attrs)
+    token = _parent.set(s.span_id)
+    try:
+        yield s
+    finally:
+        s.end = time.perf_counter()
+        _parent.reset(token)
+        trace.spans.append(s)
+
+
+def record(name, start, end, **attrs):
+    """Готовый спан по замерам perf_counter (хук upstream_module)."""
+    trace = _trace.get()
+    if trace is not None:
+        s = Span(name, _parent.get(), start, attrs)
+        s.end = end
+        trace.spans.append(s)
+
+
+def traced(name=None):
+    """Декоратор фазы вычислений; работает и для корутин."""
+    def decorate(fn):
+        label = name or fn.__name__
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(label):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ─── Server-Timing ─────────────────────────────────────────────────────────
+def server_timing(trace, total):
+    """Суммы по имени спана в порядке первого появления + total."""
+    sums = {}
+    for s in trace.spans:
+        dur, n = sums.get(s.name, (0.0, 0))
+        sums[s.name] = (dur + s.end - s.start, n + 1)
+    parts = [
+        f'{name};dur={dur * 1000:.1f}' + (f';desc="x{n}"' if n > 1 else "")
+        for name, (dur, n) in sums.items()
+    ]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def timing_headers(trace):
+    """Заголовки ответа → dict; вызывается один раз, в конце запроса."""
+    total = time.perf_counter() - trace.start
+    headers = {"X-Trace-Id": trace.trace_id}
+    if SERVER_TIMING:
+        headers["Server-Timing"] = server_timing(trace, total)
+        headers["Timing-Allow-Origin"] = "*"
+    return headers
+
+
+# ─── Export ────────────────────────────────────────────────────────────────
+def _sampled(trace, total):
+    if trace.force:
+        return True
+    if TRACE_SLOW_MS and total * 1000 >= TRACE_SLOW_MS:
+        return True
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+
+def to_json(trace, status, total):
+    return {
+        "traceId": trace.trace_id,
+        "name": trace.name,
+        "status": status,
+        "start": trace.wall_start,
+        "durationMs": round(total * 1000, 2),
+        "spans": [
+            {
+                "name": s.name,
+                "spanId": s.span_id,
+                "parentId": s.parent_id,
+                "startMs": round((s.start - trace.start) * 1000, 2),
+                "durMs": round((s.end - s.start) * 1000, 2),
+                **({"attrs": s.attrs} if s.attrs else {}),
+            }
+            for s in sorted(trace.spans, key=lambda s: s.start)
+        ],
+    }
+
+
+def _otlp_attrs(attrs):
+    return [{"key": k, "value": {"stringValue": str(v)}} for k, v in attrs.items()]
+
+
+def to_otlp(trace, status, total):
+    """OTLP/HTTP JSON: корневой спан запроса + дочерние."""
+    def nanos(t):
+        return str(int((trace.wall_start + t - trace.start) * 1e9))
+
+    root_id = _new_id(8)
+    spans = [{
+        "traceId": trace.trace_id, "spanId": root_id, "name": trace.name, "kind": 2,
+        "startTimeUnixNano": nanos(trace.start), "endTimeUnixNano": nanos(trace.start + total),
+        "attributes": _otlp_attrs({"http.status_code": status}),
+    }]
+    for s in trace.spans:
+        spans.append({
+            "traceId": trace.trace_id, "spanId": s.span_id, "parentSpanId": s.parent_id or root_id,
+            "name": s.name, "kind": 1,
+            "startTimeUnixNano": nanos(s.start), "endTimeUnixNano": nanos(s.end),
+            "attributes": _otlp_attrs(s.attrs),
+        })
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attrs({"service.name": "nearpulse-api"})},
+        "scopeSpans": [{"scope": {"name": "tracing_module"}, "spans": spans}],
+    }]}
+
+
+def _export(trace, status, total):
+    if TRACE_FILE:
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(to_json(trace, status, total), ensure_ascii=False) + "\n")
+    if TRACE_OTLP_URL:
+        http_requests.post(TRACE_OTLP_URL, json=to_otlp(trace, status, total), timeout=5)
+
+
+def _exporter_loop(q):
+    while True:
+        trace, status, total = q.get()
+        try:
+            _export(trace, status, total)
+        except Exception as e:
+            print(f"[Tracing] export failed: {e}")
+        finally:
+            q.task_done()
+
+
+def _exports():
+    """Очередь экспорта текущего процесса (после fork поток поднимается заново)."""
+    global _export_queue, _exporter_pid
+    if _exporter_pid != os.getpid():
+        _export_queue = queue.Queue(maxsize=1000)
+        _exporter_pid = os.getpid()
+        threading.Thread(target=_exporter_loop, args=(_export_queue,), name="trace-exporter", daemon=True).start()
+    return _export_queue
+
+
+def finish(trace, status):
+    """Конец запроса: в экспорт, если trace попал в выборку."""
+    total = time.perf_counter() - trace.start
+    if (TRACE_FILE or TRACE_OTLP_URL) and _sampled(trace, total):
+        try:
+            _exports().put_nowait((trace, status, total))
+        except queue.Full:
+            pass
+
+
+def force_requested(sample, authorization):
+    """X-Trace-Sample: 1 учитывается только с "Authorization: Bearer <ADMIN_TOKEN>"."""
+    if sample != "1" or not ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest((authorization or "").encode(), f"Bearer {ADMIN_TOKEN}".encode())
+
+
+# ─── Flask ─────────────────────────────────────────────────────────────────
+def _before():
+    rule = request.url_rule.rule if request.url_rule else "unmatched"
+    force = force_requested(request.headers.get(SAMPLE_HEADER), request.headers.get("Authorization"))
+    start_trace(f"{request.method} {rule}", force=force)
+
+
+def _after(resp):
+    trace = _trace.get()
+    if trace is not None:
+        resp.headers.update(timing_headers(trace))
+        finish(trace, resp.status_code)
+    return resp
+
+
+def _teardown(exc):
+    end_trace()
+
+
+def register_tracing(app):
+    app.before_request(_before)
+    app.after_request(_after)
+    app.teardown_request(_teardown)
@@ -0,0 +1,616 @@
+"""
+NearPulse — governor for upstream API calls.
+
+Все запросы к внешним API идут через get()/post() (и request_async() для
+api_async.py) с именем провайдера: "nearblocks", "coingecko", "dexscreener",
+"rpc", "fastnear", "intear", "ref", "anthropic".
+
+  • Token bucket на провайдера. Для провайдеров с лимитами (NearBlocks,
+    CoinGecko, DexScreener) ведро общее для всех воркеров — в Redis (Lua,
+    атомарно); без Redis или при его ошибке — локальное ведро процесса.
+  • Приоритет. Запросы пользователя (INTERACTIVE) ждут токен до
+    UPSTREAM_MAX_WAIT секунд; фоновые (BACKGROUND: прогрев, префетч) берут
+    токены только сверх резерва и уступают интерактивным.
+  • 429 / Retry-After блокирует провайдера для всех воркеров до указанного
+    времени; короткую паузу интерактивный запрос пережидает и повторяет.
+  • Circuit breaker на провайдера: по скользящему окну вызовов (ошибки и
+    медленные ответы). Открытый breaker отказывает сразу, без запроса; через
+    BREAKER_COOLDOWN пропускается один пробный вызов.
+  • hedged(): для критичных по задержке цепочек (цена NEAR Intear → CoinGecko,
+    NFT FastNEAR → NearBlocks) запасной источник стартует, если основной не
+    ответил за свой p95, или сразу — если основной упал / breaker открыт.
+  • Сбой (throttle, таймаут, 5xx) помечает текущий запрос как degraded —
+    set_cache() и кэш NFT не сохраняют собранный из него результат, чтобы
+    0 / [] не кэшировались как настоящий пустой баланс.
+
+Env:
+  UPSTREAM_LIMITS   — "nearblocks=2/6,coingecko=0.5/5": rate (req/s) / burst
+  UPSTREAM_MAX_WAIT — сколько интерактивный запрос ждёт токен, по умолчанию 2 с
+"""
+import os
+import time
+import asyncio
+import threading
+import contextlib
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_futures
+from email.utils import parsedate_to_datetime
+import requests as http_requests
+import metrics_module
+import tracing_module
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# rate (запросов в секунду), burst. Провайдеры без записи не ограничиваются,
+# но 429 от них всё равно учитывается.
+DEFAULT_LIMITS = {
+    "nearblocks": (2.0, 6),
+    "coingecko": (0.5, 5),     # публичный API: ~30 req/min
+    "dexscreener": (1.0, 5),   # token-profiles: 60 req/min
+}
+MAX_WAIT = {
+    INTERACTIVE: float(os.environ.get("UPSTREAM_MAX_WAIT", 2)),
+    BACKGROUND: 10.0,
+}
+BACKGROUND_RESERVE = 0.5  # доля burst, которую фоновые запросы не трогают
+DEFAULT_RETRY_AFTER = 30
+MAX_RETRY_AFTER = 300
+
+BREAKER_WINDOW = 60         # с, скользящее окно вызовов
+BREAKER_MAX_CALLS = 200     # не больше стольких последних вызовов в окне
+BREAKER_MIN_CALLS = 10      # раньше не судим
+BREAKER_ERROR_RATE = 0.5    # доля ошибок и медленных вызовов, открывающая breaker
+BREAKER_SLOW_CALL = 5.0     # с, медленный ответ считается как ошибка
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", 30))
+HEDGE_DEFAULT_DELAY = 1.0   # пока нет статистики p95
+HEDGE_MIN_DELAY = 0.05
+HEDGE_MAX_DELAY = 2.0
+
+
+def _parse_limits(spec):
+    limits = dict(DEFAULT_LIMITS)
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        try:
+            name, value = item.split("=", 1)
+            rate, burst = value.split("/", 1)
+            limits[name.strip()] = (float(rate), int(burst))
+        except ValueError:
+            print(f"[Upstream] Bad UPSTREAM_LIMITS entry: {item!r}")
+    return limits
+
+
+LIMITS = _parse_limits(os.environ.get("UPSTREAM_LIMITS", ""))
+
+
+class UpstreamError(Exception):
+    """Upstream недоступен или ответил 5xx."""
+
+
+class CircuitOpen(UpstreamError):
+    def __init__(self, provider):
+        super().__init__(f"{provider} circuit open")
+        self.provider = provider
+
+
+class Throttled(UpstreamError):
+    """Запрос не отправлен (нет токенов) или получил 429."""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} throttled, retry in {retry_after:.1f}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+# ─── Request scope (priority + degraded flag) ──────────────────────────────
+class _Scope:
+    __slots__ = ("priority", "failed")
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.failed = set()
+
+
+_scope = contextvars.ContextVar("upstream_scope", default=None)
+
+
+def begin_request(priority=INTERACTIVE):
+    """Новый scope для запроса (Flask before_request). Дочерние asyncio-задачи
+    видят тот же объект, поэтому сбой в любой из них помечает весь запрос."""
+    _scope.set(_Scope(priority))
+
+
+@contextlib.contextmanager
+def scope(priority=INTERACTIVE):
+    token = _scope.set(_Scope(priority))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def register_governor(app):
+    app.before_request(begin_request)
+
+
+def current_priority():
+    s = _scope.get()
+    return s.priority if s else INTERACTIVE
+
+
+def mark_failed(provider):
+    s = _scope.get()
+    if s is not None:
+        s.failed.add(provider)
+
+
+def degraded():
+    """Текущий запрос опирается на ответ, которого не было (throttle/ошибка)."""
+    s = _scope.get()
+    return bool(s and s.failed)
+
+
+def failed_providers():
+    s = _scope.get()
+    return sorted(s.failed) if s else []
+
+
+# ─── Token buckets ─────────────────────────────────────────────────────────
+class _Bucket:
+    __slots__ = ("rate", "burst", "tokens", "ts", "lock")
+
+    def __init__(self, rate, burst):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.ts = float(burst), time.time()
+        self.lock = threading.Lock()
+
+    def take(self, floor, now):
+        """Взять токен, оставив в ведре не меньше floor → 0, иначе сколько ждать."""
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+            self.ts = now
+            if self.tokens - 1 >= floor:
+                self.tokens -= 1
+                return 0.0
+            return (floor + 1 - self.tokens) / self.rate
+
+
+# KEYS[1] — ведро (hash t/ts), KEYS[2] — блокировка после 429 (unix-время)
+_TAKE_LUA = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local now, floor = tonumber(ARGV[3]), tonumber(ARGV[4])
+local blocked = tonumber(redis.call('GET', KEYS[2]) or '0')
+if blocked > now then return tostring(blocked - now) end
+local b = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens - 1 >= floor then tokens = tokens - 1 else wait = (floor + 1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_blocked_until = {}
+_script = None
+_script_client = None
+
+
+def _redis():
+    import cache_module  # cache_module сам зависит от degraded()
+    return cache_module.redis_client()
+
+
+def _redis_failed(error):
+    import cache_module
+    cache_module.redis_failed(error)
+
+
+def _take_script(client):
+    global _script, _script_client
+    if _script_client is not client:
+        _script, _script_client = client.register_script(_TAKE_LUA), client
+    return _script
+
+
+def _local_bucket(provider, limit):
+    bucket = _buckets.get(provider)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.setdefault(provider, _Bucket(*limit))
+    return bucket
+
+
+def _admission_wait(provider, priority):
+    """0 — можно отправлять; иначе сколько секунд ждать токен / конец блокировки."""
+    now = time.time()
+    blocked = _blocked_until.get(provider, 0) - now
+    if blocked > 0:
+        return blocked
+    limit = LIMITS.get(provider)
+    if limit is None:
+        return 0.0
+    floor = limit[1] * BACKGROUND_RESERVE if priority == BACKGROUND else 0
+    client = _redis()
+    if client is not None:
+        try:
+            keys = [f"np:rl:{provider}", f"np:rl:{provider}:block"]
+            return float(_take_script(client)(keys=keys, args=[limit[0], limit[1], now, floor]))
+        except Exception as e:
+            print(f"[Upstream] Redis bucket unavailable ({e}), using local bucket")
+            _redis_failed(e)
+    return _local_bucket(provider, limit).take(floor, now)
+
+
+def _shed(provider, wait, endpoint, degrade):
+    print(f"[Upstream] {provider}/{endpoint or '-'} shed ({current_priority()}), wait {wait:.1f}s")
+    metrics_module.upstream_rejected(provider, endpoint, "throttled")
+    if degrade:
+        mark_failed(provider)
+    return Throttled(provider, wait)
+
+
+def admit(provider, endpoint=None, degrade=True):
+    """
+    Дождаться токена в пределах MAX_WAIT приоритета или бросить Throttled.
+    degrade=False — отказ не помечает запрос degraded (нога hedged(): решает
+    общий исход).
+    """
+    priority = current_priority()
+    deadline = time.time() + MAX_WAIT[priority]
+    while True:
+        wait = _admission_wait(provider, priority)
+        if wait <= 0:
+            return
+        if time.time() + wait > deadline:
+            raise _shed(provider, wait, endpoint, degrade)
+        with tracing_module.span(f"{provider}.wait"):
+            time.sleep(wait)
+
+
+async def admit_async(provider, endpoint=None, degrade=True):
+    priority = current_priority()
+    deadline = time.time() + MAX_WAIT[priority]
+    shared = provider in LIMITS and _redis() is not None
+    while True:
+        # Redis-клиент блокирующий — в пул потоков, локальное ведро — сразу
+        if shared:
+            wait = await asyncio.to_thread(_admission_wait, provider, priority)
+        else:
+            wait = _admission_wait(provider, priority)
+        if wait <= 0:
+            return
+        if time.time() + wait > deadline:
+            raise _shed(provider, wait, endpoint, degrade)
+        with tracing_module.span(f"{provider}.wait"):
+            await asyncio.sleep(wait)
+
+
+# ─── 429 / Retry-After ─────────────────────────────────────────────────────
+def _retry_after(value):
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return DEFAULT_RETRY_AFTER
+    return min(max(seconds, 1.0), MAX_RETRY_AFTER)
+
+
+def note_throttled(provider, retry_after_header, endpoint=None):
+    """429 от провайдера: блокируем его для всех воркеров до Retry-After."""
+    delay = _retry_after(retry_after_header)
+    until = time.time() + delay
+    _blocked_until[provider] = max(_blocked_until.get(provider, 0), until)
+    client = _redis()
+    if client is not None:
+        try:
+            client.set(f"np:rl:{provider}:block", f"{until:.3f}", px=int(delay * 1000))
+        except Exception as e:
+            _redis_failed(e)
+    print(f"[Upstream] {provider}/{endpoint or '-'} 429, blocked for {delay:.0f}s")
+    return delay
+
+
+def _is_throttle(status, headers):
+    return status == 429 or (status == 503 and headers.get("Retry-After"))
+
+
+# ─── Circuit breakers ──────────────────────────────────────────────────────
+class _Breaker:
+    __slots__ = ("calls", "opened_until", "probing", "lock")
+
+    def __init__(self):
+        self.calls = deque(maxlen=BREAKER_MAX_CALLS)  # (ts, failed, latency)
+        self.opened_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def state(self, now=None):
+        if not self.opened_until:
+            return "closed"
+        return "open" if (now or time.time()) < self.opened_until else "half_open"
+
+    def allow(self):
+        """Закрыт — да; открыт — нет; после cooldown — один пробный вызов."""
+        with self.lock:
+            if not self.opened_until:
+                return True
+            if time.time() < self.opened_until or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, ok, latency):
+        """ok=None — исход не говорит о здоровье провайдера (429)."""
+        now = time.time()
+        with self.lock:
+            if self.probing:
+                self.probing = False
+                if ok is None:
+                    return
+                if ok and latency < BREAKER_SLOW_CALL:
+                    self.opened_until = 0.0
+                    self.calls.clear()
+                else:
+                    self.opened_until = now + BREAKER_COOLDOWN
+                return
+            if ok is None:
+                return
+            self.calls.append((now, not ok or latency >= BREAKER_SLOW_CALL, latency))
+            while self.calls and self.calls[0][0] < now - BREAKER_WINDOW:
+                self.calls.popleft()
+            if len(self.calls) >= BREAKER_MIN_CALLS and not self.opened_until:
+                bad = sum(1 for c in self.calls if c[1])
+                if bad / len(self.calls) >= BREAKER_ERROR_RATE:
+                    self.opened_until = now + BREAKER_COOLDOWN
+                    print(f"[Upstream] circuit open: {bad}/{len(self.calls)} failed or slow")
+
+    def p95(self):
+        with self.lock:
+            latencies = sorted(c[2] for c in self.calls if not c[1])
+        if len(latencies) < BREAKER_MIN_CALLS:
+            return None
+        return latencies[int(len(latencies) * 0.95) - 1]
+
+
+_breakers = {}
+
+
+def _breaker(provider):
+    b = _breakers.get(provider)
+    if b is None:
+        with _buckets_lock:
+            b = _breakers.setdefault(provider, _Breaker())
+    return b
+
+
+def circuit_open(provider):
+    return _breaker(provider).state() == "open"
+
+
+def breaker_states():
+    """Провайдеры с незакрытым breaker'ом (для /api/health)."""
+    now = time.time()
+    return {p: b.state(now) for p, b in _breakers.items() if b.opened_until}
+
+
+def hedge_delay(provider):
+    p95 = _breaker(provider).p95()
+    if p95 is None:
+        return HEDGE_DEFAULT_DELAY
+    return min(max(p95, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+
+# ─── Requests ──────────────────────────────────────────────────────────────
+# Единая точка учёта вызова: breaker, метрики (и всё, что повесят позже) —
+# и для requests, и для aiohttp.
+def _circuit_open(provider, endpoint):
+    metrics_module.upstream_rejected(provider, endpoint, "circuit_open")
+    return CircuitOpen(provider)
+
+
+def _check_circuit(provider, endpoint):
+    if circuit_open(provider):
+        raise _circuit_open(provider, endpoint)
+
+
+def _start(provider, endpoint):
+    if not _breaker(provider).allow():
+        raise _circuit_open(provider, endpoint)
+    return time.perf_counter()
+
+
+def _finish(provider, endpoint, t0, status=None, error=None):
+    now = time.perf_counter()
+    elapsed = now - t0
+    if error is not None:
+        timeout = isinstance(error, (http_requests.Timeout, asyncio.TimeoutError))
+        outcome, ok = ("timeout" if timeout else "error"), False
+    elif _is_throttle(status[0], status[1]):
+        outcome, ok = "429", None
+    else:
+        outcome, ok = f"{status[0] // 100}xx", status[0] < 500
+    _breaker(provider).record(ok, elapsed)
+    metrics_module.upstream_call(provider, endpoint, outcome, elapsed)
+    tracing_module.record(f"{provider}.{endpoint or '-'}", t0, now, outcome=outcome)
+
+
+def _send(provider, endpoint, method, url, kwargs):
+    t0 = _start(provider, endpoint)
+    try:
+        r = http_requests.request(method, url, **kwargs)
+    except Exception as e:
+        _finish(provider, endpoint, t0, error=e)
+        raise
+    _finish(provider, endpoint, t0, (r.status_code, r.headers))
+    return r
+
+
+def request(provider, method, url, endpoint=None, degrade=True, **kwargs):
+    """
+    requests.request() через governor. Возвращает Response (включая 4xx);
+    Throttled — нет токенов или повторный 429, CircuitOpen — провайдер
+    выключен breaker'ом, UpstreamError — 5xx.
+    degrade=False — для первичного источника в цепочке fallback: его сбой
+    не портит запрос, если запасной источник ответил.
+    """
+    try:
+        _check_circuit(provider, endpoint)
+        for attempt in range(2):
+            admit(provider, endpoint, degrade)
+            r = _send(provider, endpoint, method, url, kwargs)
+            if not _is_throttle(r.status_code, r.headers):
+                break
+            delay = note_throttled(provider, r.headers.get("Retry-After"), endpoint)
+            if attempt:
+                raise Throttled(provider, delay)
+        if r.status_code >= 500:
+            raise UpstreamError(f"{provider} HTTP {r.status_code}")
+        return r
+    except Exception:
+        if degrade:
+            mark_failed(provider)
+        raise
+
+
+def get(provider, url, **kwargs):
+    return request(provider, "GET", url, **kwargs)
+
+
+def post(provider, url, **kwargs):
+    return request(provider, "POST", url, **kwargs)
+
+
+async def request_async(session, provider, method, url, endpoint=None, degrade=True, **kwargs):
+    """То же для aiohttp-сессии → (status, json)."""
+    try:
+        _check_circuit(provider, endpoint)
+        for attempt in range(2):
+            await admit_async(provider, endpoint, degrade)
+            t0 = _start(provider, endpoint)
+            try:
+                async with session.request(method, url, **kwargs) as r:
+                    throttled = _is_throttle(r.status, r.headers)
+                    if not throttled and r.status < 500:
+                        data = await r.json(content_type=None)
+            except Exception as e:
+                _finish(provider, endpoint, t0, error=e)
+                raise
+            _finish(provider, endpoint, t0, (r.status, r.headers))
+            if not throttled:
+                if r.status >= 500:
+                    raise UpstreamError(f"{provider} HTTP {r.status}")
+                return r.status, data
+            delay = note_throttled(provider, r.headers.get("Retry-After"), endpoint)
+            if attempt:
+                raise Throttled(provider, delay)
+    except Exception:
+        if degrade:
+            mark_failed(provider)
+        raise
+
+
+@contextlib.asynccontextmanager
+async def stream_async(session, provider, method, url, endpoint=None, **kwargs):
+    """
+    request_async для потокового ответа: отдаёт открытый aiohttp-ответ
+    (не 429 и не 5xx), тело читает вызывающий. Выход из блока — в том числе
+    отмена задачи при разрыве клиента — закрывает соединение. Повтора на
+    429 нет: начатый поток не переотправляем.
+    """
+    _check_circuit(provider, endpoint)
+    await admit_async(provider, endpoint)
+    t0 = _start(provider, endpoint)
+    try:
+        r = await session.request(method, url, **kwargs)
+    except Exception as e:
+        _finish(provider, endpoint, t0, error=e)
+        raise
+    _finish(provider, endpoint, t0, (r.status, r.headers))
+    try:
+        if _is_throttle(r.status, r.headers):
+            raise Throttled(provider, note_throttled(provider, r.headers.get("Retry-After"), endpoint))
+        if r.status >= 500:
+            raise UpstreamError(f"{provider} HTTP {r.status}")
+        yield r
+    finally:
+        r.close()
+
+
+# ─── Hedged requests ───────────────────────────────────────────────────────
+# primary / secondary — (provider, fn): fn() возвращает результат или бросает
+# исключение (пустой ответ тоже ошибка). fn должны звать get()/post() с
+# degrade=False: запрос помечается degraded, только если не ответил никто.
+_hedge_pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="hedge")
+
+
+def _hedge_failed(providers, errors):
+    for name in providers:
+        mark_failed(name)
+    return UpstreamError("; ".join(errors))
+
+
+def hedged(primary, secondary):
+    """Результат первого успешного источника. Проигравший запрос досчитывается
+    в фоне (requests не отменить) и только пополняет статистику breaker'а."""
+    queue_ = [secondary] if circuit_open(primary[0]) else [primary, secondary]
+    pending, errors = {}, []
+
+    def launch():
+        name, fn = queue_.pop(0)
+        if pending or errors:
+            metrics_module.upstream_hedge(name)
+        # copy_context: пул видит scope запроса (приоритет, degraded)
+        pending[_hedge_pool.submit(contextvars.copy_context().run, fn)] = name
+
+    launch()
+    while pending:
+        timeout = hedge_delay(primary[0]) if queue_ else None
+        done, _ = wait_futures(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for f in done:
+            name = pending.pop(f)
+            try:
+                return f.result()
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+        if queue_:
+            launch()  # основной медлит дольше p95 или упал
+    raise _hedge_failed((primary[0], secondary[0]), errors)
+
+
+async def hedged_async(primary, secondary):
+    """То же для корутин; проигравший запрос отменяется."""
+    queue_ = [secondary] if circuit_open(primary[0]) else [primary, secondary]
+    pending, errors = {}, []
+
+    def launch():
+        name, fn = queue_.pop(0)
+        if pending or errors:
+            metrics_module.upstream_hedge(name)
+        pending[asyncio.ensure_future(fn())] = name
+
+    launch()
+    try:
+        while pending:
+            timeout = hedge_delay(primary[0]) if queue_ else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                name = pending.pop(t)
+                try:
+                    return t.result()
+                except Exception as e:
+                    errors.append(f"{name}: {e}")
+            if queue_:
+                launch()
+    finally:
+        for t in pending:
+            t.cancel()
+    raise _hedge_failed((primary[0], secondary[0]), errors)
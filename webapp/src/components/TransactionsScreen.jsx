@@ -1,6 +1,6 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Clock, ExternalLink, Copy, Info, Globe, Filter } from 'lucide-react';
-import { fetchTransactions } from '../services/api';
+import { fetchTransactions, fetchTransactionsSince, subscribeLive } from '../services/api';
 import { useTelegram } from '../hooks/useTelegram';
 import Toast from './Toast';
 import dayjs from 'dayjs';
@@ -36,6 +36,7 @@ export default function TransactionsScreen() {
   const [expandedTx, setExpandedTx] = useState(null);
   const [toast, setToast] = useState(null);
   const [filter, setFilter] = useState('all');
+  const cursorRef = useRef(null);
 
   const displayAddress = address || 'root.near';
 
@@ -55,6 +56,7 @@ export default function TransactionsScreen() {
           return true;
         });
         setTransactions(unique);
+        cursorRef.current = data.cursor || null;
       } catch (err) {
         console.error('Error loading transactions:', err);
         setError(err.message);
@@ -66,6 +68,38 @@ export default function TransactionsScreen() {
     loadTransactions();
   }, [displayAddress]);
 
+  // Новые транзакции приходят с сервера сами — без повторных запросов
+  useEffect(() => {
+    const prepend = (transactions) => {
+      setTransactions(prev => {
+        const seen = new Set(prev.map(tx => tx.hash || tx.id));
+        const fresh = transactions.filter(tx => !seen.has(tx.hash || tx.id));
+        return fresh.length ? [...fresh, ...prev] : prev;
+      });
+    };
+    // Переподключение или resync: события могли потеряться — догнать дельтой по курсору
+    const catchUp = async () => {
+      if (!cursorRef.current) return;
+      try {
+        const data = await fetchTransactionsSince(displayAddress, cursorRef.current, 10);
+        if (data.reset) setTransactions(data.transactions);
+        else prepend(data.transactions);
+        cursorRef.current = data.cursor || cursorRef.current;
+      } catch (err) {
+        console.error('Error catching up transactions:', err);
+      }
+    };
+    return subscribeLive([displayAddress], {
+      tx: (data) => {
+        prepend(data.transactions);
+        // курсор самой новой транзакции: следующий catchUp не перечитает уже показанные
+        if (data.cursor) cursorRef.current = data.cursor;
+      },
+      snapshot: catchUp,
+      resync: catchUp,
+    });
+  }, [displayAddress]);
+
   // Фильтрация транзакций по типу
   const filteredTransactions = filter === 'all'
     ? transactions
@@ -11,29 +11,62 @@ export async function fetchUserBalance(address) {
   return response.json();
 }
 
+function normalizeTransactions(transactions, nearPrice) {
+  return transactions.map(tx => ({
+    ...tx,
+    hash: tx.hash || tx.id || '',
+    description: tx.description || tx.action || 'Транзакция',
+    amount: tx.amount ?? tx.allNearSpent ?? tx.allNearReceived ?? 0,
+    amountFormatted: tx.amountFormatted ?? (tx.amount || tx.allNearSpent || tx.allNearReceived || 0).toFixed(4),
+    usdValue: tx.usdValue ?? (nearPrice && (tx.amount || tx.allNearSpent) > 0 ? (tx.amount || tx.allNearSpent) * nearPrice : null),
+    tokenName: tx.tokenName || null,
+    gas: tx.gas ?? null,
+    protocol: tx.protocol || null,
+    txCount: tx.txCount || 1,
+  }));
+}
+
+// Без cache-bust: о новых транзакциях сообщает /api/live (subscribeLive)
 export async function fetchTransactions(address, limit = 10) {
-  const cacheBust = `_=${Date.now()}`;
-  const response = await fetch(`${API_BASE_URL}/api/transactions/${address}?limit=${limit}&${cacheBust}`);
+  const response = await fetch(`${API_BASE_URL}/api/transactions/${address}?limit=${limit}`);
   if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
   const data = await response.json();
-  const nearPrice = data.nearPrice || 0;
   if (data.transactions) {
-    data.transactions = data.transactions.map(tx => ({
-      ...tx,
-      hash: tx.hash || tx.id || '',
-      description: tx.description || tx.action || 'Транзакция',
-      amount: tx.amount ?? tx.allNearSpent ?? tx.allNearReceived ?? 0,
-      amountFormatted: tx.amountFormatted ?? (tx.amount || tx.allNearSpent || tx.allNearReceived || 0).toFixed(4),
-      usdValue: tx.usdValue ?? (nearPrice && (tx.amount || tx.allNearSpent) > 0 ? (tx.amount || tx.allNearSpent) * nearPrice : null),
-      tokenName: tx.tokenName || null,
-      gas: tx.gas ?? null,
-      protocol: tx.protocol || null,
-      txCount: tx.txCount || 1,
-    }));
+    data.transactions = normalizeTransactions(data.transactions, data.nearPrice || 0);
   }
   return data;
 }
 
+/**
+ * Только транзакции новее cursor (из прошлого ответа /api/transactions):
+ * { transactions, cursor, reset }. reset — у клиента пропуск, transactions —
+ * полный top-limit, которым надо заменить список.
+ */
+export async function fetchTransactionsSince(address, cursor, limit = 10) {
+  const response = await fetch(`${API_BASE_URL}/api/transactions/${address}?limit=${limit}&since=${encodeURIComponent(cursor)}`);
+  if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+  const data = await response.json();
+  data.transactions = normalizeTransactions(data.transactions || [], data.nearPrice || 0);
+  return data;
+}
+
+/**
+ * Live-обновления аккаунтов (SSE /api/live): handlers — { tx, balance, hot_claim, snapshot, resync }.
+ * tx получает уже нормализованные транзакции. Возвращает функцию отписки.
+ * Обрыв соединения EventSource переподключает сам.
+ */
+export function subscribeLive(accounts, handlers = {}) {
+  const source = new EventSource(`${API_BASE_URL}/api/live?accounts=${accounts.join(',')}`);
+  for (const [event, handler] of Object.entries(handlers)) {
+    source.addEventListener(event, (e) => {
+      const data = JSON.parse(e.data);
+      if (event === 'tx') data.transactions = normalizeTransactions(data.transactions || [], data.nearPrice || 0);
+      handler(data);
+    });
+  }
+  return () => source.close();
+}
+
 export async function fetchHotClaimStatus(address) {
   const response = await fetch(`${API_BASE_URL}/api/hot-claim/${address}`);
   if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
@@ -78,10 +111,23 @@ export async function fetchNFTs(address) {
  * @returns {Promise<{reply: string, model: string}>}
  */
 export async function sendAiMessage(message, history = [], walletContext = null) {
+  // Полный контекст (токены, статистика, транзакции) сервер берёт из своего кэша
+  // по accountId; клиент шлёт только краткую сводку на случай пустого кэша
+  const accountId = walletContext?.address || null;
+  const summary = walletContext
+    ? {
+        address: walletContext.address,
+        near: walletContext.near,
+        staking: walletContext.staking,
+        hot: walletContext.hot,
+        nearPrice: walletContext.nearPrice,
+        totalUSD: walletContext.totalUSD,
+      }
+    : null;
   const response = await fetch(`${API_BASE_URL}/api/ai/chat`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ message, history, walletContext }),
+    body: JSON.stringify({ message, history, accountId, walletContext: summary }),
   });
   if (!response.ok) {
     const err = await response.json().catch(() => ({}));
@@ -93,6 +139,8 @@ export async function sendAiMessage(message, history = [], walletContext = null)
 export default {
   fetchUserBalance,
   fetchTransactions,
+  fetchTransactionsSince,
+  subscribeLive,
   fetchHotClaimStatus,
   checkApiHealth,
   fetchAnalytics,